@@ -0,0 +1,483 @@
+import os, sys, argparse, bisect, json, time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Mapping, Optional, Sequence, TextIO, Union
+# autogen
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage, ModelInfo, RequestUsage
+from autogen_core.tools import Tool, ToolSchema
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import (
+    BaseAgentEvent, BaseChatMessage, ModelClientStreamingChunkEvent, ToolCallExecutionEvent, ToolCallRequestEvent)
+
+from stats_utils import print_table
+from rate_limiter import estimate_tokens
+
+# エージェントごと、ターンごとのトークン数と処理時間を集計し、JSONとPrometheusのテキスト形式で出力する
+# - モデル呼び出し: create_agentで作成したエージェントとチームの選択用モデルクライアントをMeteredChatCompletionClientで包んで計測
+# - ターンとツール呼び出し: run_streamのメッセージをRunMetricsで計測
+# - エージェント選択(selector_func): SelectionEngine.selectの処理時間を選択方法ごとに計測
+# - プロンプトキャッシュ: モデル呼び出しごとに、同じエージェントの前回のプロンプトと一致する先頭部分をPrefixCacheTrackerで計測
+
+METRIC_PREFIX = "autogen_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+
+# メトリクス名: (種類, 説明)
+METRICS: dict[str, tuple[str, str]] = {
+    "llm_calls_total": ("counter", "Model calls per agent (cached calls are counted with cached=\"true\")."),
+    "llm_prompt_tokens_total": ("counter", "Prompt tokens per agent."),
+    "llm_completion_tokens_total": ("counter", "Completion tokens per agent."),
+    "llm_latency_seconds": ("histogram", "Model call latency per agent (agent=\"selector\" is speaker selection)."),
+    "turn_prompt_tokens": ("histogram", "Prompt tokens per agent turn."),
+    "turn_completion_tokens": ("histogram", "Completion tokens per agent turn."),
+    "turn_latency_seconds": ("histogram", "Time from the previous message to the agent's message, including speaker selection."),
+    "tool_latency_seconds": ("histogram", "Tool call latency per agent and tool."),
+    "selector_latency_seconds": ("histogram", "selector_func latency per selection method."),
+    "run_latency_seconds": ("histogram", "Run (task) latency."),
+    "compaction_original_tokens_total": ("counter", "Estimated tokens of nested agent transcripts before compaction."),
+    "compaction_result_tokens_total": ("counter", "Estimated tokens of execute_agent results after compaction."),
+    "speculation_total": ("counter", "Speculative next-speaker model calls per agent and outcome (hit/miss)."),
+    "speculation_wasted_tokens_total": ("counter", "Tokens of discarded speculative model calls (prompt tokens estimated if cancelled)."),
+    "speculation_saved_seconds_total": ("counter", "Latency saved by used speculative model calls."),
+    "prompt_prefix_calls_total": ("counter", "Model calls per agent by provider prompt cache eligibility (eligible=\"true\"/\"false\")."),
+    "prompt_prefix_tokens_total": ("counter", "Estimated prompt tokens shared with the agent's previous prompt."),
+    "prompt_cacheable_tokens_total": ("counter", "Estimated prompt tokens a provider prompt cache could serve."),
+    "checkpoint_turns_total": ("counter", "Team turns written to the checkpoint file."),
+    "checkpoint_bytes_total": ("counter", "Bytes appended to the checkpoint file."),
+    "checkpoint_capture_seconds": ("histogram", "Time the turn waits for team.save_state() when checkpointing."),
+    "checkpoint_write_seconds": ("histogram", "Background time to diff, encode and append a checkpoint turn."),
+    "output_sink_messages_total": ("counter", "Messages per output sink and outcome (written/dropped)."),
+    "output_sink_blocked_seconds_total": ("counter", "Time the stream consumer waited for space in an output sink queue."),
+    "output_sink_write_seconds": ("histogram", "Output sink batch write latency."),
+    "role_llm_calls_total": ("counter", "Model calls per role (model_tiers.py) and model, including each tier of a cascade."),
+    "role_llm_prompt_tokens_total": ("counter", "Prompt tokens per role and model."),
+    "role_llm_completion_tokens_total": ("counter", "Completion tokens per role and model."),
+    "role_llm_cost_usd_total": ("counter", "Estimated cost (USD, model_tiers.MODEL_PRICES) per role and model."),
+    "role_llm_latency_seconds": ("histogram", "Model call latency per role and model."),
+    "role_latency_seconds": ("histogram", "Latency of a role's model request as seen by the caller, including cascade escalations."),
+    "model_escalations_total": ("counter", "Cascade escalations per role, rejected model and reason."),
+    "agent_service_requests_total": ("counter", "Agent service requests per strategy and outcome (completed/incomplete/error/rejected)."),
+    "agent_service_request_seconds": ("histogram", "Agent service request latency per strategy, including the wait for a free session."),
+}
+
+LabelKey = tuple[tuple[str, str], ...]
+
+def _label_key(labels: Mapping[str, Any]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+class Histogram:
+    """
+    Fixed-bucket histogram in the Prometheus style. Bucket counts are not cumulative here;
+    to_prometheus() accumulates them. Histograms with the same buckets can be merged.
+    """
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # 最後の要素は+Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram"):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> float:
+        # Prometheusのhistogram_quantileと同じく、バケット内を線形補間する。+Infのバケットは最大の境界値
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count > 0:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "Histogram":
+        histogram = cls(data["buckets"])
+        histogram.counts = list(data["counts"])
+        histogram.sum = data["sum"]
+        histogram.count = data["count"]
+        return histogram
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def _format_labels(labels: LabelKey, extra: Sequence[tuple[str, str]] = ()) -> str:
+    items = list(labels) + list(extra)
+    if len(items) == 0:
+        return ""
+    escaped = [(name, value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for name, value in items]
+    return "{" + ",".join([f'{name}="{value}"' for name, value in escaped]) + "}"
+
+class MetricsRegistry:
+    """
+    Process-wide counters and histograms keyed by metric name and labels.
+    Exported as a JSON report (with a per-agent summary) and in the Prometheus text format.
+    """
+    def __init__(self):
+        self.counters: dict[str, dict[LabelKey, float]] = {}
+        self.histograms: dict[str, dict[LabelKey, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: Any):
+        series = self.counters.setdefault(name, {})
+        key = _label_key(labels)
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, **labels: Any):
+        series = self.histograms.setdefault(name, {})
+        key = _label_key(labels)
+        if key not in series:
+            series[key] = Histogram(buckets)
+        series[key].observe(value)
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+
+    def merge(self, data: Mapping[str, Any]):
+        # to_json()の出力(別プロセスの集計)を加算する
+        for item in data.get("counters", []):
+            self.inc(item["name"], item["value"], **item["labels"])
+        for item in data.get("histograms", []):
+            series = self.histograms.setdefault(item["name"], {})
+            key = _label_key(item["labels"])
+            histogram = Histogram.from_dict(item)
+            if key in series:
+                series[key].merge(histogram)
+            else:
+                series[key] = histogram
+
+    def agent_summary(self) -> list[dict[str, Any]]:
+        # エージェントごとのモデル呼び出し回数、トークン数、モデル呼び出しとツールの時間
+        rows: dict[str, dict[str, Any]] = {}
+
+        def row(agent: str) -> dict[str, Any]:
+            return rows.setdefault(agent, {
+                "agent": agent, "llm_calls": 0, "cached_calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "llm_seconds": 0.0, "llm_p50": 0.0, "llm_p99": 0.0, "turns": 0, "tool_calls": 0, "tool_seconds": 0.0})
+
+        for name, series in self.counters.items():
+            for key, value in series.items():
+                labels = dict(key)
+                if "agent" not in labels:
+                    continue
+                if name == "llm_calls_total":
+                    row(labels["agent"])["llm_calls"] += int(value)
+                    if labels.get("cached") == "true":
+                        row(labels["agent"])["cached_calls"] += int(value)
+                elif name == "llm_prompt_tokens_total":
+                    row(labels["agent"])["prompt_tokens"] += int(value)
+                elif name == "llm_completion_tokens_total":
+                    row(labels["agent"])["completion_tokens"] += int(value)
+        for name, series in self.histograms.items():
+            for key, histogram in series.items():
+                labels = dict(key)
+                if "agent" not in labels:
+                    continue
+                if name == "llm_latency_seconds":
+                    row(labels["agent"]).update(
+                        llm_seconds=histogram.sum, llm_p50=histogram.quantile(0.5), llm_p99=histogram.quantile(0.99))
+                elif name == "turn_latency_seconds":
+                    row(labels["agent"])["turns"] += histogram.count
+                elif name == "tool_latency_seconds":
+                    row(labels["agent"])["tool_calls"] += histogram.count
+                    row(labels["agent"])["tool_seconds"] += histogram.sum
+        return sorted(rows.values(), key=lambda item: item["llm_seconds"], reverse=True)
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "generated_at": time.time(),
+            "agents": self.agent_summary(),
+            "counters": [
+                {"name": name, "labels": dict(key), "value": value}
+                for name, series in self.counters.items() for key, value in series.items()],
+            "histograms": [
+                {"name": name, "labels": dict(key), **histogram.to_dict()}
+                for name, series in self.histograms.items() for key, histogram in series.items()],
+        }
+
+    def to_prometheus(self) -> str:
+        lines: list[str] = []
+
+        def header(name: str, default_type: str):
+            metric_type, description = METRICS.get(name, (default_type, name))
+            lines.append(f"# HELP {METRIC_PREFIX}{name} {description}")
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} {metric_type}")
+
+        for name, series in self.counters.items():
+            header(name, "counter")
+            for key, value in series.items():
+                lines.append(f"{METRIC_PREFIX}{name}{_format_labels(key)} {_format_number(value)}")
+        for name, series in self.histograms.items():
+            header(name, "histogram")
+            for key, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(list(histogram.buckets) + [float("inf")], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(key, [('le', _format_number(bound))])} {cumulative}")
+                lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(key)} {_format_number(histogram.sum)}")
+                lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, prefix: str) -> tuple[str, str]:
+        # prefix.json(レポート)とprefix.prom(Prometheusのテキスト形式。node_exporterのtextfile collectorなどで読み込む)を出力する
+        directory = os.path.dirname(prefix)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        json_path, prom_path = prefix + ".json", prefix + ".prom"
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f, ensure_ascii=False, indent=2)
+        # 読み込み中のファイルを書き換えないように、一時ファイルに書き込んでから置き換える
+        with open(prom_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(prom_path + ".tmp", prom_path)
+        return json_path, prom_path
+
+# プロセス全体の集計
+metrics = MetricsRegistry()
+
+def get_metrics_output() -> Union[str, None]:
+    # 環境変数METRICS_OUTPUTが設定されている場合は、実行の終了時にMETRICS_OUTPUT.jsonとMETRICS_OUTPUT.promを出力する
+    output = os.getenv("METRICS_OUTPUT")
+    return output if output is not None and output != "" else None
+
+def write_metrics_report(prefix: Union[str, None] = None, registry: Union[MetricsRegistry, None] = None) -> Union[tuple[str, str], None]:
+    prefix = prefix if prefix is not None else get_metrics_output()
+    if prefix is None:
+        return None
+    return (registry if registry is not None else metrics).write(prefix)
+
+def print_agent_summary(registry: Union[MetricsRegistry, None] = None, file: TextIO = sys.stdout):
+    rows = (registry if registry is not None else metrics).agent_summary()
+    if len(rows) > 0:
+        print_table(rows, list(rows[0].keys()), file=file)
+
+# プロバイダ(OpenAI)のプロンプトキャッシュの条件: 前回までのリクエストと先頭の1024トークン以上が一致すること。以降は128トークン単位
+PREFIX_CACHE_MIN_TOKENS = 1024
+PREFIX_CACHE_INCREMENT = 128
+
+def prompt_text(messages: Sequence[LLMMessage], tools: Sequence[Tool | ToolSchema] = []) -> str:
+    # プロバイダに送られる順(ツールの定義、メッセージ)のテキスト。先頭部分の比較に使用する
+    parts = [json.dumps(tool.schema if isinstance(tool, Tool) else tool, ensure_ascii=False, sort_keys=True) for tool in tools]
+    for message in messages:
+        content = message.content
+        # FunctionCall, FunctionExecutionResultはpydanticのモデル、Imageは文字列にする
+        parts.append(f"{message.type}: " + (content if isinstance(content, str) else json.dumps(
+            content, ensure_ascii=False, default=lambda item: item.model_dump() if hasattr(item, "model_dump") else str(item))))
+    return "\n".join(parts)
+
+@dataclass
+class PrefixCacheReport:
+    agent: str
+    prompt_tokens: int
+    # 前回のプロンプトと一致する先頭部分
+    prefix_tokens: int
+    # プロバイダのキャッシュで処理できるトークン数(最小トークン数未満の場合は0)
+    cacheable_tokens: int
+
+    @property
+    def eligible(self) -> bool:
+        return self.cacheable_tokens > 0
+
+class PrefixCacheTracker:
+    """
+    Estimates, per model call, how much of the prompt a provider side prompt cache could serve:
+    the prefix shared with the previous prompt of the same agent, counted if it reaches min_tokens.
+    The latest max_calls reports are kept in calls.
+    """
+    def __init__(
+            self, min_tokens: int = PREFIX_CACHE_MIN_TOKENS, increment: int = PREFIX_CACHE_INCREMENT,
+            registry: Union[MetricsRegistry, None] = None, max_calls: int = 1000):
+        self.min_tokens = min_tokens
+        self.increment = increment
+        self.registry = registry if registry is not None else metrics
+        self._previous: dict[str, str] = {}
+        self.calls: deque[PrefixCacheReport] = deque(maxlen=max_calls)
+
+    def observe(self, agent: str, text: str) -> PrefixCacheReport:
+        previous = self._previous.get(agent, "")
+        self._previous[agent] = text
+        prefix_tokens = estimate_tokens(len(os.path.commonprefix([previous, text])))
+        cacheable_tokens = 0
+        if prefix_tokens >= self.min_tokens:
+            cacheable_tokens = self.min_tokens + (prefix_tokens - self.min_tokens) // self.increment * self.increment
+        report = PrefixCacheReport(agent, estimate_tokens(len(text)), prefix_tokens, cacheable_tokens)
+        self.calls.append(report)
+        self.registry.inc("prompt_prefix_calls_total", agent=agent, eligible="true" if report.eligible else "false")
+        self.registry.inc("prompt_prefix_tokens_total", prefix_tokens, agent=agent)
+        self.registry.inc("prompt_cacheable_tokens_total", cacheable_tokens, agent=agent)
+        return report
+
+    def summary(self) -> list[dict[str, Any]]:
+        # エージェントごとの呼び出し数、キャッシュの対象となった呼び出しの割合、プロンプトのうち先頭部分が一致した割合
+        rows: dict[str, dict[str, Any]] = {}
+        for report in self.calls:
+            row = rows.setdefault(report.agent, {
+                "agent": report.agent, "calls": 0, "eligible_calls": 0, "prompt_tokens": 0, "prefix_tokens": 0, "cacheable_tokens": 0})
+            row["calls"] += 1
+            row["eligible_calls"] += 1 if report.eligible else 0
+            row["prompt_tokens"] += report.prompt_tokens
+            row["prefix_tokens"] += report.prefix_tokens
+            row["cacheable_tokens"] += report.cacheable_tokens
+        for row in rows.values():
+            row["eligible_rate"] = row["eligible_calls"] / row["calls"]
+            row["prefix_rate"] = row["prefix_tokens"] / row["prompt_tokens"] if row["prompt_tokens"] > 0 else 0.0
+        return sorted(rows.values(), key=lambda row: row["agent"])
+
+    def reset(self):
+        self._previous.clear()
+        self.calls.clear()
+
+# プロセス全体のプロンプトの先頭部分の計測
+prefix_cache_tracker = PrefixCacheTracker()
+
+def _record_usage(registry: MetricsRegistry, agent: str, result: CreateResult, elapsed: float):
+    registry.inc("llm_calls_total", agent=agent, cached="true" if result.cached else "false")
+    registry.inc("llm_prompt_tokens_total", result.usage.prompt_tokens, agent=agent)
+    registry.inc("llm_completion_tokens_total", result.usage.completion_tokens, agent=agent)
+    registry.observe("llm_latency_seconds", elapsed, agent=agent)
+
+class MeteredChatCompletionClient(ChatCompletionClient):
+    """
+    ChatCompletionClient wrapper that records the latency and token usage of each call under the given agent name.
+    Wrap a shared client once per agent so that calls are attributed to the agent that made them.
+    """
+    def __init__(self, client: ChatCompletionClient, agent: str, registry: Union[MetricsRegistry, None] = None):
+        self._client = client
+        self.agent = agent
+        self.registry = registry if registry is not None else metrics
+
+    async def create(
+            self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = [],
+            tool_choice: Any = "auto", json_output: Optional[Any] = None,
+            extra_create_args: Mapping[str, Any] = {}, cancellation_token: Optional[CancellationToken] = None,
+            ) -> CreateResult:
+        prefix_cache_tracker.observe(self.agent, prompt_text(messages, tools))
+        start = time.perf_counter()
+        result = await self._client.create(
+            messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+            extra_create_args=extra_create_args, cancellation_token=cancellation_token)
+        _record_usage(self.registry, self.agent, result, time.perf_counter() - start)
+        return result
+
+    async def create_stream(
+            self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = [],
+            tool_choice: Any = "auto", json_output: Optional[Any] = None,
+            extra_create_args: Mapping[str, Any] = {}, cancellation_token: Optional[CancellationToken] = None,
+            ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        prefix_cache_tracker.observe(self.agent, prompt_text(messages, tools))
+        # 最後のCreateResultを受け取るまでの時間を記録する
+        start = time.perf_counter()
+        async for chunk in self._client.create_stream(
+                messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+                extra_create_args=extra_create_args, cancellation_token=cancellation_token):
+            if isinstance(chunk, CreateResult):
+                _record_usage(self.registry, self.agent, chunk, time.perf_counter() - start)
+            yield chunk
+
+    async def close(self) -> None:
+        await self._client.close()
+
+    def actual_usage(self) -> RequestUsage:
+        return self._client.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self._client.total_usage()
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self._client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self._client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> Any:
+        return self._client.capabilities # type: ignore
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._client.model_info
+
+@dataclass
+class _Turn:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+class RunMetrics:
+    """
+    Records per-turn tokens and latency and tool call latency from a run_stream() message sequence.
+    A turn of an agent ends with its chat message; its tokens are the models_usage of the agent's
+    events and message since its previous message. Its latency is measured from the previous chat message,
+    so it includes the speaker selection before the turn.
+    """
+    def __init__(self, registry: Union[MetricsRegistry, None] = None):
+        self.registry = registry if registry is not None else metrics
+        self.start()
+
+    def start(self):
+        self._run_started = time.perf_counter()
+        self._last_message = self._run_started
+        self._turns: dict[str, _Turn] = {}
+        # ツール呼び出しのid: (開始時刻, エージェント名, ツール名)
+        self._tool_calls: dict[str, tuple[float, str, str]] = {}
+
+    def observe(self, message: BaseAgentEvent | BaseChatMessage | TaskResult):
+        now = time.perf_counter()
+        if isinstance(message, TaskResult):
+            self.registry.observe("run_latency_seconds", now - self._run_started)
+            return
+        if isinstance(message, ModelClientStreamingChunkEvent) or message.source == "user":
+            return
+        if message.models_usage is not None:
+            turn = self._turns.setdefault(message.source, _Turn())
+            turn.prompt_tokens += message.models_usage.prompt_tokens
+            turn.completion_tokens += message.models_usage.completion_tokens
+        if isinstance(message, ToolCallRequestEvent):
+            for call in message.content:
+                self._tool_calls[call.id] = (now, message.source, call.name)
+        elif isinstance(message, ToolCallExecutionEvent):
+            for result in message.content:
+                started = self._tool_calls.pop(result.call_id, None)
+                if started is not None:
+                    self.registry.observe("tool_latency_seconds", now - started[0], agent=started[1], tool=started[2])
+        elif isinstance(message, BaseChatMessage):
+            turn = self._turns.pop(message.source, _Turn())
+            self.registry.observe("turn_prompt_tokens", turn.prompt_tokens, TOKEN_BUCKETS, agent=message.source)
+            self.registry.observe("turn_completion_tokens", turn.completion_tokens, TOKEN_BUCKETS, agent=message.source)
+            self.registry.observe("turn_latency_seconds", now - self._last_message, agent=message.source)
+            self._last_message = now
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="METRICS_OUTPUTで出力したJSONレポートの、エージェントごとの集計を表示する")
+    parser.add_argument("paths", nargs="+", help="JSONレポート(複数指定した場合は合算する)")
+    args = parser.parse_args()
+    registry = MetricsRegistry()
+    for path in args.paths:
+        with open(path, encoding="utf-8") as f:
+            registry.merge(json.load(f))
+    print_agent_summary(registry)
@@ -0,0 +1,203 @@
+import asyncio, time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Sequence, Union
+# autogen
+from autogen_core import CancellationToken
+from autogen_agentchat.base import ChatAgent
+from autogen_agentchat.messages import ModelClientStreamingChunkEvent
+
+from agent_registry import AgentFactory, AgentRegistry
+from parallel_execution import DEFAULT_MAX_CONCURRENCY, AgentExecutionResult, run_agent_with_chunks
+from result_compaction import CompactionPolicy, TranscriptStore
+from stats_utils import percentile
+
+# create_agentで作成したエージェントを再利用するためのプール
+# 貸し出したエージェントは返却時にリセットするため、リクエスト間で会話履歴は共有されない
+
+@dataclass
+class PoolStats:
+    created: int = 0
+    # リセットに失敗して破棄したエージェントの数
+    discarded: int = 0
+    checkouts: int = 0
+    # 空きがなく、返却を待った回数
+    waits: int = 0
+    in_use: int = 0
+    peak_in_use: int = 0
+    # 貸し出していた時間の合計(秒)
+    busy_seconds: float = 0.0
+    # 直近の待ち時間(秒)
+    wait_seconds: deque[float] = field(default_factory=lambda: deque(maxlen=10000))
+
+    @property
+    def reuse_rate(self) -> float:
+        # 作成せずに再利用したエージェントの割合
+        return 1.0 - self.created / self.checkouts if self.checkouts > 0 else 0.0
+
+class AgentPool:
+    """
+    Pool of interchangeable agents built by one factory, at most max_size at a time.
+    checkout() returns an idle agent, builds a new one while the pool is below max_size,
+    or waits until an agent is returned. checkin() resets the agent before it can be checked out again;
+    an agent whose reset fails is discarded, and a new one is built in its place on a later checkout.
+    """
+    def __init__(self, name: str, factory: AgentFactory, max_size: int = DEFAULT_MAX_CONCURRENCY):
+        self.name = name
+        self.factory = factory
+        self.max_size = max_size
+        self.stats = PoolStats()
+        self._idle: list[ChatAgent] = []
+        self._checked_out: dict[int, float] = {}
+        self._condition = asyncio.Condition()
+        self._created_at = time.perf_counter()
+
+    async def checkout(self) -> ChatAgent:
+        start = time.perf_counter()
+        waited = False
+        async with self._condition:
+            while len(self._idle) == 0 and self.stats.created - self.stats.discarded >= self.max_size:
+                waited = True
+                await self._condition.wait()
+            if len(self._idle) > 0:
+                agent = self._idle.pop()
+            else:
+                agent = self.factory()
+                self.stats.created += 1
+            now = time.perf_counter()
+            self.stats.checkouts += 1
+            self.stats.in_use += 1
+            self.stats.peak_in_use = max(self.stats.peak_in_use, self.stats.in_use)
+            self.stats.wait_seconds.append(now - start)
+            if waited:
+                self.stats.waits += 1
+            self._checked_out[id(agent)] = now
+            return agent
+
+    async def checkin(self, agent: ChatAgent):
+        # 会話履歴をリセットしてから空きに戻す
+        # リセットに失敗した(キャンセルされた)場合は会話履歴が残っている可能性があるため破棄し、待っている貸し出しには新しく作成させる
+        # 貸し出していないエージェント(二重の返却や別のプールのエージェント)はin_useや空きを壊さないようにエラーにする
+        async with self._condition:
+            started = self._checked_out.pop(id(agent), None)
+            if started is None:
+                raise ValueError(f"プール {self.name} から貸し出していないエージェントです: {agent.name}")
+            self.stats.busy_seconds += time.perf_counter() - started
+        reset = False
+        try:
+            await agent.on_reset(CancellationToken())
+            reset = True
+        finally:
+            async with self._condition:
+                self.stats.in_use -= 1
+                if reset:
+                    self._idle.append(agent)
+                else:
+                    self.stats.discarded += 1
+                self._condition.notify()
+
+    @asynccontextmanager
+    async def agent(self) -> AsyncIterator[ChatAgent]:
+        agent = await self.checkout()
+        try:
+            yield agent
+        finally:
+            await self.checkin(agent)
+
+    def utilization(self) -> float:
+        # プール作成からの経過時間に対して、max_size個のエージェントが貸し出されていた時間の割合
+        elapsed = time.perf_counter() - self._created_at
+        busy = self.stats.busy_seconds + sum([time.perf_counter() - started for started in self._checked_out.values()])
+        return busy / (elapsed * self.max_size) if elapsed > 0 else 0.0
+
+    def report(self) -> dict:
+        waits = list(self.stats.wait_seconds)
+        return {
+            "agent": self.name,
+            "max_size": self.max_size,
+            "created": self.stats.created,
+            "discarded": self.stats.discarded,
+            "checkouts": self.stats.checkouts,
+            "reuse_rate": self.stats.reuse_rate,
+            "peak_in_use": self.stats.peak_in_use,
+            "utilization": self.utilization(),
+            "waits": self.stats.waits,
+            "wait_p50_ms": percentile(waits, 50) * 1000,
+            "wait_p99_ms": percentile(waits, 99) * 1000,
+        }
+
+class AgentPoolGroup:
+    """
+    One AgentPool per agent registered in an AgentRegistry, created on first checkout.
+    max_sizes overrides max_size for individual agent names.
+    """
+    def __init__(self, registry: AgentRegistry, max_size: int = DEFAULT_MAX_CONCURRENCY, max_sizes: dict[str, int] = {}):
+        self.registry = registry
+        self.max_size = max_size
+        self.max_sizes = max_sizes
+        self._pools: dict[str, AgentPool] = {}
+
+    def pool(self, name: str) -> Union[AgentPool, None]:
+        pool = self._pools.get(name)
+        if pool is None:
+            factory = self.registry.factory(name)
+            if factory is None:
+                return None
+            pool = AgentPool(name, factory, self.max_sizes.get(name, self.max_size))
+            self._pools[name] = pool
+        return pool
+
+    @asynccontextmanager
+    async def agent(self, name: str) -> AsyncIterator[ChatAgent]:
+        pool = self.pool(name)
+        if pool is None:
+            raise KeyError(f"プールに登録されていないエージェントです: {name}")
+        async with pool.agent() as agent:
+            yield agent
+
+    async def checkout_all(self, names: Sequence[str]) -> AgentRegistry:
+        # セッション用に、各エージェントを1つずつ貸し出したAgentRegistryを作成する
+        registry = AgentRegistry()
+        for name in names:
+            pool = self.pool(name)
+            if pool is None:
+                raise KeyError(f"プールに登録されていないエージェントです: {name}")
+            registry.register_agent(await pool.checkout())
+        return registry
+
+    async def checkin_all(self, registry: AgentRegistry):
+        for name in registry.names():
+            pool = self._pools.get(name)
+            agent = registry.get(name)
+            if pool is not None and agent is not None:
+                await pool.checkin(agent)
+
+    async def execute(
+            self, tasks: Sequence[tuple[str, str]], max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+            on_chunk: Union[Callable[[ModelClientStreamingChunkEvent], None], None] = None,
+            compaction: Union[CompactionPolicy, None] = None, store: Union[TranscriptStore, None] = None) -> list[AgentExecutionResult]:
+        """
+        Run (agent_name, initial_message) pairs concurrently with agents checked out from the pools.
+        Unlike execute_agents_concurrently, tasks for the same agent name can run at the same time
+        (up to the pool size), because each task gets its own agent instance.
+        on_chunk receives the streaming chunks of all tasks as they arrive.
+        compaction and store are passed to run_agent_stream.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run_task(agent_name: str, initial_message: str) -> AgentExecutionResult:
+            if self.pool(agent_name) is None:
+                return AgentExecutionResult(agent_name, initial_message, "", 0.0, "The specified agent does not exist.")
+            async with semaphore, self.agent(agent_name) as agent:
+                start = time.perf_counter()
+                try:
+                    output_text = await run_agent_with_chunks(agent, initial_message, on_chunk, compaction, store)
+                    return AgentExecutionResult(agent_name, initial_message, output_text, time.perf_counter() - start)
+                except Exception as e:
+                    return AgentExecutionResult(agent_name, initial_message, "", time.perf_counter() - start, str(e))
+
+        return list(await asyncio.gather(*[run_task(agent_name, initial_message) for agent_name, initial_message in tasks]))
+
+    def report(self) -> list[dict]:
+        return [pool.report() for pool in self._pools.values()]
@@ -0,0 +1,222 @@
+import asyncio
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Annotated, AsyncGenerator, Callable, Sequence, Union
+# autogen
+from autogen_core import CancellationToken
+from autogen_core.tools import BaseTool, FunctionTool
+from autogen_agentchat.base import ChatAgent
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, ModelClientStreamingChunkEvent
+
+from parallel_execution import AgentTask, AgentTaskList, run_agent_stream, execute_agents_concurrently, format_execution_results
+from streaming import StreamFunctionTool
+from result_compaction import CompactionPolicy, TranscriptStore, create_transcript_store, get_compaction_policy
+if TYPE_CHECKING:
+    from agent_pool import AgentPoolGroup
+
+# エージェントを名前で登録し、最初に使用されたときに作成する
+
+AgentFactory = Callable[[], ChatAgent]
+
+@dataclass
+class AgentSpec:
+    name: str
+    description: str
+    # エージェントを作成する関数。作成済みのエージェントを登録した場合はNone
+    factory: Union[AgentFactory, None] = None
+
+class AgentRegistry:
+    """
+    Registry of agents indexed by name.
+    Agents are registered with a factory and built on first use, so registering many agents costs
+    only a dict entry each. The description listing is cached and rebuilt only when the registry changes.
+    """
+    def __init__(self):
+        self._specs: dict[str, AgentSpec] = {}
+        self._agents: dict[str, ChatAgent] = {}
+        # 登録内容が変更されるたびに1増える
+        self.version = 0
+        self._descriptions: list[dict[str, str]] = []
+        self._descriptions_version = -1
+
+    def register(self, name: str, description: str, factory: AgentFactory):
+        self._specs[name] = AgentSpec(name, description, factory)
+        self._agents.pop(name, None)
+        self.version += 1
+
+    def register_agent(self, agent: ChatAgent):
+        # 作成済みのエージェントを登録する
+        self._specs[agent.name] = AgentSpec(agent.name, agent.description)
+        self._agents[agent.name] = agent
+        self.version += 1
+
+    @classmethod
+    def from_agents(cls, agents: Sequence[ChatAgent]) -> "AgentRegistry":
+        # 作成済みのエージェントの一覧からregistryを作成する
+        registry = cls()
+        for agent in agents:
+            registry.register_agent(agent)
+        return registry
+
+    def unregister(self, name: str):
+        if name in self._specs:
+            del self._specs[name]
+            self._agents.pop(name, None)
+            self.version += 1
+
+    def get(self, name: str) -> Union[ChatAgent, None]:
+        agent = self._agents.get(name)
+        if agent is not None:
+            return agent
+        spec = self._specs.get(name)
+        if spec is None or spec.factory is None:
+            return None
+        agent = spec.factory()
+        if agent.name != name:
+            raise ValueError(f"エージェント名が登録名と一致しません: {name} != {agent.name}")
+        self._agents[name] = agent
+        return agent
+
+    def factory(self, name: str) -> Union[AgentFactory, None]:
+        spec = self._specs.get(name)
+        return spec.factory if spec is not None else None
+
+    def is_built(self, name: str) -> bool:
+        return name in self._agents
+
+    def names(self) -> list[str]:
+        return list(self._specs.keys())
+
+    def agents(self) -> list[ChatAgent]:
+        # 登録順に全てのエージェントを返す(未作成のエージェントは作成する)
+        return [self.get(name) for name in self._specs] # type: ignore
+
+    def descriptions(self) -> list[dict[str, str]]:
+        # list_agentsの戻り値。エージェントを作成せずに登録時のdescriptionから作成する
+        if self._descriptions_version != self.version:
+            self._descriptions = [{"name": spec.name, "description": spec.description} for spec in self._specs.values()]
+            self._descriptions_version = self.version
+        return self._descriptions
+
+    async def reset(self):
+        # 作成済みのエージェントのみリセットする
+        for agent in self._agents.values():
+            await agent.on_reset(CancellationToken())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._specs
+
+    def __len__(self) -> int:
+        return len(self._specs)
+
+def create_agent_tools(
+        registry: AgentRegistry, parallel_execution: bool = True,
+        pools: Union["AgentPoolGroup", None] = None, streaming: bool = False,
+        compaction: Union[CompactionPolicy, None] = None, store: Union[TranscriptStore, None] = None) -> list[BaseTool]:
+    # agent_selectorが使用するlist_agents, execute_agent, execute_agents, get_transcriptをregistryから作成する
+    # poolsが指定されている場合は、呼び出しごとにプールからエージェントを借りて実行し、返却時にリセットする
+    # streamingがTrueの場合、execute_agentは実行中のエージェントのチャンクをagent_selectorのrun_streamに流す
+    # 結果の圧縮方法(既定値はget_compaction_policy())はここで1回だけ決定し、get_transcriptツールの有無と全ての呼び出しで同じものを使用する
+    # 会話全体の保存先(既定値は新しいTranscriptStore)はツールごと(チャットごと)のため、他のセッションの会話全体は参照できない
+    compaction = compaction if compaction is not None else get_compaction_policy()
+    store = store if store is not None else create_transcript_store()
+
+    # エージェント一覧を取得する関数
+    def list_agents() -> Annotated[list[dict[str, str]], "List of registered agents, each containing 'name' and 'description'"]:
+        """
+        This function retrieves a list of registered agents.
+        """
+        return registry.descriptions()
+
+    # 圧縮したexecute_agentの結果に含まれる参照から、呼び出したエージェントの会話全体を取得する関数
+    def get_transcript(
+            reference: Annotated[str, "Transcript reference"],
+            ) -> Annotated[str, "Full transcript"]:
+        """
+        Returns the full transcript of an agent execution by its reference, if the result is not enough.
+        """
+        transcript = store.get(reference)
+        return transcript if transcript is not None else "The specified transcript does not exist."
+
+    # エージェントを実行する関数
+    async def execute_agent(
+            agent_name: Annotated[str, "Agent name"], initial_message: Annotated[str, "Input text"],
+            ) -> Annotated[str, "Output text"]:
+        """
+        This function executes the specified agent with the input text and returns the output text.
+        First argument: agent name, second argument: input text.
+        - Agent name: Specify the name of the agent as the Python function name.
+        - Input text: The text data to be processed by the agent.
+        """
+        output_text = ""
+        async for item in execute_agent_stream(AgentTask(agent_name=agent_name, initial_message=initial_message)):
+            if isinstance(item, str):
+                output_text = item
+        return output_text
+
+    # execute_agentのストリーミング版。チャンクを順に返し、最後に出力テキストを返す
+    async def execute_agent_stream(task: AgentTask) -> AsyncGenerator[Union[BaseAgentEvent, BaseChatMessage, str], None]:
+        if pools is not None:
+            if pools.pool(task.agent_name) is None:
+                yield "The specified agent does not exist."
+                return
+            async with pools.agent(task.agent_name) as pooled_agent:
+                async for item in run_agent_stream(pooled_agent, task.initial_message, compaction, store):
+                    yield item
+            return
+        agent = registry.get(task.agent_name)
+        if agent is None:
+            yield "The specified agent does not exist."
+            return
+        async for item in run_agent_stream(agent, task.initial_message, compaction, store):
+            yield item
+
+    # 複数のエージェントを並列に実行する関数
+    async def execute_agents(
+            tasks: Annotated[list[AgentTask], "List of tasks. Each task has agent_name and initial_message"],
+            ) -> Annotated[str, "Output text of each agent in the order of tasks"]:
+        """
+        This function executes several agents concurrently and returns their output texts in the order of tasks.
+        Use it instead of calling execute_agent several times when the tasks do not depend on each other.
+        - agent_name: Specify the name of the agent as the Python function name.
+        - initial_message: The text data to be processed by the agent.
+        """
+        return await run_tasks(tasks)
+
+    async def run_tasks(
+            tasks: list[AgentTask], on_chunk: Union[Callable[[ModelClientStreamingChunkEvent], None], None] = None) -> str:
+        if pools is not None:
+            return format_execution_results(await pools.execute(
+                [(task.agent_name, task.initial_message) for task in tasks], on_chunk=on_chunk, compaction=compaction, store=store))
+        # タスクで指定されたエージェントのみ作成する
+        agents = [registry.get(name) for name in set([task.agent_name for task in tasks])]
+        results = await execute_agents_concurrently(
+            [agent for agent in agents if agent is not None], [(task.agent_name, task.initial_message) for task in tasks],
+            on_chunk=on_chunk, compaction=compaction, store=store)
+        return format_execution_results(results)
+
+    # execute_agentsのストリーミング版。全てのタスクのチャンクを届いた順に返し、最後に出力テキストを返す
+    async def execute_agents_stream(args: AgentTaskList) -> AsyncGenerator[Union[BaseAgentEvent, BaseChatMessage, str], None]:
+        chunks: asyncio.Queue[Union[ModelClientStreamingChunkEvent, None]] = asyncio.Queue()
+        running = asyncio.create_task(run_tasks(args.tasks, chunks.put_nowait))
+        running.add_done_callback(lambda _: chunks.put_nowait(None))
+        try:
+            while (chunk := await chunks.get()) is not None:
+                yield chunk
+        finally:
+            if not running.done():
+                running.cancel()
+        yield await running
+
+    tools: list[BaseTool] = [
+        StreamFunctionTool(execute_agent_stream, AgentTask, "execute_agent", execute_agent.__doc__) # type: ignore
+        if streaming else FunctionTool(execute_agent, execute_agent.__doc__, name = "execute_agent"), # type: ignore
+        FunctionTool(list_agents, list_agents.__doc__ ,name = "list_agents") # type: ignore
+    ]
+    # 結果を圧縮する場合のみ、会話全体を取得するツールを追加する(ツールの定義もプロンプトのトークン数になるため)
+    if compaction.mode != "full":
+        tools.append(FunctionTool(get_transcript, get_transcript.__doc__, name = "get_transcript")) # type: ignore
+    if parallel_execution:
+        tools.append(
+            StreamFunctionTool(execute_agents_stream, AgentTaskList, "execute_agents", execute_agents.__doc__) # type: ignore
+            if streaming else FunctionTool(execute_agents, execute_agents.__doc__, name = "execute_agents")) # type: ignore
+    return tools
@@ -0,0 +1,110 @@
+import math, re
+from collections import Counter
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Union
+import numpy as np
+# autogen
+from autogen_agentchat.base import ChatAgent
+if TYPE_CHECKING:
+    from agent_registry import AgentRegistry
+
+# エージェントのname, description, system_messageから作成したTF-IDFの索引により、
+# LLMを呼び出さずにタスクを担当するエージェントを選択する
+
+def tokenize(text: str) -> list[str]:
+    # 英数字は単語単位(_で分割)、それ以外(日本語)は文字bi-gramに分割する
+    tokens: list[str] = []
+    for word in re.findall(r"[A-Za-z0-9]+", text.lower()):
+        tokens.append(word)
+    for chunk in re.findall(r"[^\x00-\x7f\s、。，．・「」『』（）！？]+", text):
+        if len(chunk) == 1:
+            tokens.append(chunk)
+        tokens.extend([chunk[i:i + 2] for i in range(len(chunk) - 1)])
+    return tokens
+
+def agent_document(agent: ChatAgent) -> str:
+    # AssistantAgentの場合はsystem_messageも索引に含める
+    system_messages = getattr(agent, "_system_messages", [])
+    system_text = "\n".join([message.content for message in system_messages])
+    return f"{agent.name.replace('_', ' ')}\n{agent.description}\n{system_text}"
+
+@dataclass
+class RouteResult:
+    agent_name: str
+    # 最も類似度の高いエージェントのコサイン類似度
+    score: float
+    # 1位と2位の類似度の差を1位の類似度で割った値(0〜1)
+    confidence: float
+    # 類似度の高い順に上位のエージェントの類似度
+    top_scores: dict[str, float]
+
+class AgentRouter:
+    """
+    In-process router that scores a task against all agents with one matrix-vector product
+    over a TF-IDF index of each agent's name, description and system message.
+    The agents are those of registry; the index is rebuilt automatically when the registry changes
+    (agents added, removed or registered again with a new description), detected by registry.version.
+    """
+    def __init__(self, registry: "AgentRegistry", min_score: float = 0.05, top_k: int = 5):
+        self.registry = registry
+        self.min_score = min_score
+        self.top_k = top_k
+        # 索引を作成した時点のregistry.version
+        self._version: Union[int, None] = None
+        self._names: list[str] = []
+        self._vocabulary: dict[str, int] = {}
+        self._idf = np.zeros(0)
+        self._matrix = np.zeros((0, 0))
+
+    def rebuild(self):
+        version = self.registry.version
+        agents = self.registry.agents()
+        documents = [Counter(tokenize(agent_document(agent))) for agent in agents]
+        self._names = [agent.name for agent in agents]
+        self._vocabulary = {}
+        for document in documents:
+            for token in document:
+                self._vocabulary.setdefault(token, len(self._vocabulary))
+
+        matrix = np.zeros((len(documents), len(self._vocabulary)), dtype=np.float32)
+        for row, document in enumerate(documents):
+            for token, count in document.items():
+                matrix[row, self._vocabulary[token]] = 1.0 + math.log(count)
+        # 全てのエージェントに含まれる語(「エージェント」など)は重み0になる
+        document_frequency = np.count_nonzero(matrix, axis=0)
+        self._idf = np.log((1.0 + len(documents)) / (1.0 + document_frequency)).astype(np.float32)
+        matrix *= self._idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self._matrix = matrix / np.where(norms == 0, 1.0, norms)
+        self._version = version
+
+    def _ensure_index(self):
+        if self._version != self.registry.version:
+            self.rebuild()
+
+    def vectorize(self, text: str) -> np.ndarray:
+        vector = np.zeros(len(self._vocabulary), dtype=np.float32)
+        for token, count in Counter(tokenize(text)).items():
+            index = self._vocabulary.get(token)
+            if index is not None:
+                vector[index] = 1.0 + math.log(count)
+        vector *= self._idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def route(self, text: str) -> Union[RouteResult, None]:
+        self._ensure_index()
+        if len(self._names) == 0:
+            return None
+        scores = self._matrix @ self.vectorize(text)
+        k = min(self.top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        best = float(scores[top[0]])
+        if best < self.min_score:
+            return None
+        second = float(scores[top[1]]) if len(top) > 1 else 0.0
+        return RouteResult(
+            agent_name=self._names[top[0]], score=best, confidence=(best - second) / best,
+            top_scores={self._names[index]: float(scores[index]) for index in top},
+        )
@@ -0,0 +1,369 @@
+import os, sys, asyncio, argparse, importlib, itertools, json, signal, time
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from typing import Any, Union
+
+from selector_group_chat_test_00 import init_env, init_trace, get_model_client, enable_model_client_reuse
+from batch_runner import BatchTask, create_session_pools, session_chat, run_session, is_speculative
+from agent_pool import AgentPoolGroup
+from agent_metrics import metrics, write_metrics_report
+from output_sinks import BufferedSink, JsonlTranscriptSink, get_transcript_output_dir
+from strategies import STRATEGIES
+from stats_utils import percentile
+
+# 常駐してタスクを受け付けるサービス
+# タスクごとにプロセスを起動する場合(python selector_group_chat_test_03.py など)と異なり、
+# 起動時にモジュールのimport、モデルクライアント(接続プール)の作成、エージェントの作成を1回だけ行い、以降のタスクで再利用する。
+# タスクはオーケストレーション方法の名前(strategies.py)を指定して実行し、セッションごとにエージェントを分けて並列に実行する
+#
+# HTTP(TCPまたはUnixドメインソケット):
+#   POST /run         {"task": "...", "strategy": "selector_func+rules", "id": "..."} -> batch_runner.BatchResultの内容
+#   GET  /health      サービスとプールの状況
+#   GET  /strategies  実行できるオーケストレーション方法
+#   GET  /metrics     Prometheusのテキスト形式のメトリクス
+# stdio(--stdio): 1行に1リクエストのJSON({"op": "run"|"health"|"strategies", ...})を読み込み、1行に1レスポンスを書き込む。
+#   リクエストは並列に処理するため、レスポンスは完了順になる(idで対応付ける)
+
+DEFAULT_STRATEGY = "selector_func+rules"
+# リクエストの本文の最大バイト数
+MAX_REQUEST_BYTES = 1024 * 1024
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+@dataclass
+class ServiceStats:
+    requests: int = 0
+    completed: int = 0
+    # 終了条件を満たさずに終了したタスクと、例外で終了したタスク
+    incomplete: int = 0
+    errors: int = 0
+    # 停止中に受け付けなかったリクエスト
+    rejected: int = 0
+    in_flight: int = 0
+    peak_in_flight: int = 0
+    # 直近のリクエストの処理時間(同時実行数の上限による待ち時間を含む)
+    latencies: deque[float] = field(default_factory=lambda: deque(maxlen=10000))
+
+class AgentService:
+    """
+    Keeps the modules, model clients, connection pools and agents of the strategies warm in one process
+    and runs tasks on them with at most concurrency sessions at a time.
+    Each session gets its own agents (isolation="pooled": checked out from pools and reset on return,
+    isolation="fresh": built per session), so concurrent requests never share a conversation.
+    """
+    def __init__(self, concurrency: int = 4, isolation: str = "pooled", strategies: Union[list[str], None] = None):
+        if isolation not in ("pooled", "fresh"):
+            # isolation="shared"はモジュールの共有のエージェントを使用するため、並列のリクエストでは使用できない
+            raise ValueError(f"Unsupported isolation for the service: {isolation}")
+        self.concurrency = concurrency
+        self.isolation = isolation
+        if strategies is None:
+            # isolation="pooled"では、投機的実行の方法(プールのエージェントでは投機的な呼び出しを使用できない)を除く
+            strategies = [
+                name for name, (_, kwargs) in STRATEGIES.items() if isolation != "pooled" or not is_speculative(kwargs)]
+        elif isolation == "pooled":
+            speculative = [name for name in strategies if is_speculative(STRATEGIES[name][1])]
+            if len(speculative) > 0:
+                raise ValueError(f"Speculative strategies need isolation=\"fresh\": {', '.join(speculative)}")
+        self.strategies = {name: STRATEGIES[name] for name in strategies}
+        # strategyを指定しないリクエストの方法。受け付ける方法に含まれない場合は最初の方法
+        self.default_strategy = DEFAULT_STRATEGY if DEFAULT_STRATEGY in self.strategies else next(iter(self.strategies))
+        self.stats = ServiceStats()
+        self.pools: Union[AgentPoolGroup, None] = None
+        self.transcript: Union[BufferedSink, None] = None
+        self.startup_seconds = 0.0
+        self._modules: dict[str, Any] = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._ids = itertools.count(1)
+        self._tasks: set[asyncio.Task[Any]] = set()
+        self._closing = False
+        self._started_at = time.perf_counter()
+
+    async def start(self, warmup: bool = True):
+        # タスクごとのプロセスで毎回行っていた初期化を、起動時に1回だけ行う
+        start = time.perf_counter()
+        init_env()
+        init_trace()
+        enable_model_client_reuse()
+        for module_name, _ in self.strategies.values():
+            self._modules[module_name] = importlib.import_module(module_name)
+        get_model_client()
+        if self.isolation == "pooled":
+            self.pools = create_session_pools(self.concurrency)
+        transcript_dir = get_transcript_output_dir()
+        if transcript_dir is not None:
+            prefix = f"service-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+            self.transcript = BufferedSink(JsonlTranscriptSink(transcript_dir, prefix))
+        if warmup:
+            await self.warmup()
+        self.startup_seconds = time.perf_counter() - start
+        self._started_at = time.perf_counter()
+
+    async def warmup(self):
+        # 各方法のチームを1回作成して、モデルクライアントとプールのエージェントを作成しておく(モデルは呼び出さない)
+        for module_name, kwargs in self.strategies.values():
+            async with session_chat(self._modules[module_name], kwargs, self.isolation, self.pools):
+                pass
+
+    async def run(self, input: str, strategy: Union[str, None] = None, id: Union[str, None] = None) -> dict[str, Any]:
+        strategy = strategy if strategy is not None else self.default_strategy
+        if self._closing:
+            self.stats.rejected += 1
+            metrics.inc("agent_service_requests_total", strategy=strategy, outcome="rejected")
+            raise RequestError(503, "The service is shutting down.")
+        if strategy not in self.strategies:
+            raise RequestError(404, f"Unknown strategy: {strategy}")
+        module_name, kwargs = self.strategies[strategy]
+        task = BatchTask(id if id is not None else f"request-{next(self._ids)}", input)
+        self.stats.requests += 1
+        self.stats.in_flight += 1
+        self.stats.peak_in_flight = max(self.stats.peak_in_flight, self.stats.in_flight)
+        start = time.perf_counter()
+        try:
+            async with self._semaphore:
+                queued = time.perf_counter() - start
+                result = await run_session(self._modules[module_name], kwargs, task, self.isolation, self.pools, self.transcript)
+        finally:
+            self.stats.in_flight -= 1
+        elapsed = time.perf_counter() - start
+        self.stats.latencies.append(elapsed)
+        if result.error is not None:
+            self.stats.errors += 1
+            outcome = "error"
+        elif result.completed:
+            self.stats.completed += 1
+            outcome = "completed"
+        else:
+            self.stats.incomplete += 1
+            outcome = "incomplete"
+        metrics.inc("agent_service_requests_total", strategy=strategy, outcome=outcome)
+        metrics.observe("agent_service_request_seconds", elapsed, strategy=strategy)
+        return {**asdict(result), "strategy": strategy, "queued": queued}
+
+    def report(self) -> dict[str, Any]:
+        latencies = list(self.stats.latencies)
+        report = {key: value for key, value in asdict(self.stats).items() if key != "latencies"}
+        report.update({
+            "status": "closing" if self._closing else "ok",
+            "pid": os.getpid(),
+            "isolation": self.isolation,
+            "concurrency": self.concurrency,
+            "startup_seconds": self.startup_seconds,
+            "uptime_seconds": time.perf_counter() - self._started_at,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p99": percentile(latencies, 99),
+            "pools": self.pools.report() if self.pools is not None else [],
+        })
+        return report
+
+    async def handle(self, request: dict[str, Any]) -> dict[str, Any]:
+        # HTTPとstdioで共通のリクエストの処理
+        op = request.get("op", "run")
+        if op == "health":
+            return self.report()
+        if op == "strategies":
+            return {"strategies": list(self.strategies.keys()), "default": self.default_strategy}
+        if op != "run":
+            raise RequestError(400, f"Unknown op: {op}")
+        input = request.get("task")
+        if not isinstance(input, str) or input == "":
+            raise RequestError(400, "\"task\" is required.")
+        strategy = request.get("strategy")
+        id = request.get("id")
+        return await self.run(input, str(strategy) if strategy is not None else None, str(id) if id is not None else None)
+
+    def track(self, coroutine: Any) -> asyncio.Task[Any]:
+        # 停止時に処理中のリクエストの完了を待つため、リクエストのタスクを記録する
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def close(self):
+        # 新しいリクエストを受け付けずに、処理中のリクエストの完了を待ってから停止する
+        self._closing = True
+        if len(self._tasks) > 0:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+        if self.transcript is not None:
+            await self.transcript.close()
+        write_metrics_report()
+
+async def _read_http_request(reader: asyncio.StreamReader) -> Union[tuple[str, str, dict[str, str], bytes], None]:
+    # HTTP/1.1のリクエストを1つ読み込む。接続が閉じられた場合はNone
+    request_line = await reader.readline()
+    if request_line == b"":
+        return None
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise RequestError(400, "Malformed request line.")
+    method, path, version = parts
+    headers: dict[str, str] = {"version": version}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0"))
+    if length > MAX_REQUEST_BYTES:
+        raise RequestError(413, "Request body is too large.")
+    body = await reader.readexactly(length) if length > 0 else b""
+    return method, path.split("?", 1)[0], headers, body
+
+async def _dispatch_http(service: AgentService, method: str, path: str, body: bytes) -> tuple[int, str, bytes]:
+    # (ステータス, Content-Type, 本文)を返す
+    if method == "GET" and path == "/metrics":
+        return 200, "text/plain; version=0.0.4", metrics.to_prometheus().encode("utf-8")
+    routes = {("GET", "/health"): "health", ("GET", "/strategies"): "strategies", ("POST", "/run"): "run"}
+    op = routes.get((method, path))
+    if op is None:
+        raise RequestError(404, f"Not found: {method} {path}")
+    request: dict[str, Any] = {}
+    if op == "run":
+        try:
+            request = json.loads(body)
+        except ValueError:
+            raise RequestError(400, "The request body must be JSON.")
+        if not isinstance(request, dict):
+            raise RequestError(400, "The request body must be a JSON object.")
+    response = await service.handle({**request, "op": op})
+    return 200, "application/json", json.dumps(response, ensure_ascii=False).encode("utf-8")
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+async def handle_http_connection(service: AgentService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    # keep-aliveの接続では、同じ接続で続けてリクエストを処理する
+    try:
+        while True:
+            keep_alive = False
+            try:
+                request = await _read_http_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers["version"] == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                status, content_type, payload = await service.track(_dispatch_http(service, method, path, body))
+            except RequestError as e:
+                status, content_type = e.status, "application/json"
+                payload = json.dumps({"error": str(e)}, ensure_ascii=False).encode("utf-8")
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            except Exception as e:
+                status, content_type = 500, "application/json"
+                payload = json.dumps({"error": repr(e)}, ensure_ascii=False).encode("utf-8")
+            head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+            writer.write(head.encode("latin-1") + payload)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def serve_http(service: AgentService, host: str, port: int, unix_path: Union[str, None], stop: asyncio.Event):
+    # 停止時に待機中のkeep-aliveの接続を閉じるため、接続を記録する
+    connections: set[asyncio.StreamWriter] = set()
+
+    async def on_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connections.add(writer)
+        try:
+            await handle_http_connection(service, reader, writer)
+        finally:
+            connections.discard(writer)
+
+    if unix_path is not None:
+        if os.path.exists(unix_path):
+            os.remove(unix_path)
+        server = await asyncio.start_unix_server(on_connection, path=unix_path)
+        address = f"unix:{unix_path}"
+    else:
+        server = await asyncio.start_server(on_connection, host, port)
+        bound_host, bound_port = server.sockets[0].getsockname()[:2]
+        address = f"http://{bound_host}:{bound_port}"
+    # 準備ができたことを呼び出し元(benchmark_agent_service.pyなど)に知らせる。--port 0の場合は割り当てられたポート
+    print(f"agent_service ready: {address}", file=sys.stderr, flush=True)
+    async with server:
+        await stop.wait()
+        server.close()
+        await service.close()
+        for writer in list(connections):
+            writer.close()
+    if unix_path is not None and os.path.exists(unix_path):
+        os.remove(unix_path)
+
+async def serve_stdio(service: AgentService, stop: asyncio.Event):
+    # 標準出力はレスポンス専用にする。エージェントなどのprintは標準エラー出力に表示する
+    output = sys.stdout
+    sys.stdout = sys.stderr
+    lock = asyncio.Lock()
+
+    async def respond(response: dict[str, Any]):
+        async with lock:
+            await asyncio.to_thread(_write_line, output, json.dumps(response, ensure_ascii=False, default=str))
+
+    async def handle_line(line: str):
+        id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise RequestError(400, "The request must be a JSON object.")
+            id = request.get("id")
+            response = await service.handle(request)
+        except ValueError:
+            response = {"error": "The request must be JSON.", "status": 400}
+        except RequestError as e:
+            response = {"error": str(e), "status": e.status}
+        except Exception as e:
+            response = {"error": repr(e), "status": 500}
+        await respond({"id": id, **response})
+
+    print("agent_service ready: stdio", file=sys.stderr, flush=True)
+    while not stop.is_set():
+        line = await asyncio.to_thread(sys.stdin.readline)
+        if line == "":
+            break
+        if line.strip() != "":
+            service.track(handle_line(line))
+    await service.close()
+
+def _write_line(file: Any, text: str):
+    file.write(text + "\n")
+    file.flush()
+
+async def main(args: argparse.Namespace):
+    try:
+        service = AgentService(args.concurrency, args.isolation, args.strategies)
+    except ValueError as e:
+        print(f"agent_service: {e}", file=sys.stderr)
+        sys.exit(2)
+    await service.start(warmup=not args.no_warmup)
+    print(f"agent_service started in {service.startup_seconds:.3f}s "
+          f"(strategies: {len(service.strategies)}, isolation: {service.isolation}, concurrency: {service.concurrency})",
+          file=sys.stderr, flush=True)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    if args.stdio:
+        await serve_stdio(service, stop)
+    else:
+        await serve_http(service, args.host, args.port, args.unix, stop)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="モデルクライアントとエージェントを保持したまま、タスクを受け付けて実行する常駐サービス")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("AGENT_SERVICE_PORT", "8765")), help="0の場合は空いているポートを使用する")
+    parser.add_argument("--unix", default=None, help="TCPの代わりに使用するUnixドメインソケットのパス")
+    parser.add_argument("--stdio", action="store_true", help="標準入出力でJSONの行を送受信する")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("AGENT_SERVICE_CONCURRENCY", "4")), help="同時実行セッション数")
+    parser.add_argument("--isolation", default="pooled", choices=["pooled", "fresh"], help="セッションごとのエージェントの作成方法")
+    parser.add_argument("--strategies", nargs="*", default=None, choices=list(STRATEGIES.keys()), help="受け付けるオーケストレーション方法(既定は全て)")
+    parser.add_argument("--no-warmup", action="store_true", help="起動時にチームとエージェントを作成しない")
+    asyncio.run(main(parser.parse_args()))
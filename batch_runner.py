@@ -0,0 +1,265 @@
+import os, sys, asyncio, argparse, importlib, inspect, json, time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, asdict
+from typing import Any, AsyncIterator, Sequence, Union
+# autogen
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import BaseChatMessage
+
+from selector_group_chat_test_00 import init_env, get_model_client, create_worker_registry, create_planner
+from agent_registry import AgentRegistry
+from agent_pool import AgentPoolGroup
+from agent_metrics import metrics, RunMetrics, write_metrics_report, print_agent_summary
+from termination import is_completed
+from output_sinks import BufferedSink, JsonlTranscriptSink, get_transcript_output_dir
+from speculation import cancel_speculation
+from stats_utils import percentile, print_table
+
+# 複数のタスクをJSONLファイルから読み込み、セッションごとに別のエージェントを使用して並列に実行する
+
+@dataclass
+class BatchTask:
+    id: str
+    input: str
+
+@dataclass
+class BatchResult:
+    id: str
+    input: str
+    # 最後のメッセージ
+    output: str
+    stop_reason: Union[str, None]
+    completed: bool
+    messages: int
+    # タスクの実行時間(秒)。同時実行数の上限による待ち時間は含まない
+    elapsed: float
+    error: Union[str, None] = None
+
+def load_tasks(path: str) -> list[BatchTask]:
+    # 1行に1タスク。{"id": ..., "input": ...}の形式、または入力テキストのみのJSON文字列
+    tasks = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip() == "":
+                continue
+            data = json.loads(line)
+            if isinstance(data, str):
+                data = {"input": data}
+            tasks.append(BatchTask(id=str(data.get("id", len(tasks) + 1)), input=data["input"]))
+    return tasks
+
+def create_session_pools(max_size: int) -> AgentPoolGroup:
+    # セッションに貸し出す作業用エージェントとplannerのプール
+    registry = create_worker_registry()
+    registry.register("planner", "planner", lambda: create_planner(get_model_client("planner")))
+    return AgentPoolGroup(registry, max_size)
+
+# isolation="pooled"でプールから貸し出せるcreate_chat()の引数
+POOLED_PARAMETERS = ("pools", "registry", "planner")
+
+def is_speculative(kwargs: dict[str, Any]) -> bool:
+    # create_chat(speculative=True)はチャット専用のSpeculativeExecutorでエージェントを作成する
+    return bool(kwargs.get("speculative", False))
+
+def check_isolation(script: str, isolation: str, kwargs: dict[str, Any] = {}):
+    # isolation="pooled"でプールのエージェントを受け取れないスクリプトは、プールを使用せずに実行されるため実行前にエラーにする
+    # プールのエージェントは投機的実行用のクライアントで作成されていないため、speculative=Trueも使用できない
+    if isolation != "pooled":
+        return
+    if is_speculative(kwargs):
+        raise ValueError(
+            "speculative=True needs agents built with the chat's own SpeculativeExecutor; "
+            "it cannot run with isolation=\"pooled\" (use isolation=\"fresh\").")
+    parameters = inspect.signature(importlib.import_module(script).create_chat).parameters
+    if not any(name in parameters for name in POOLED_PARAMETERS):
+        raise ValueError(
+            f"{script}.create_chat() does not accept {', '.join(POOLED_PARAMETERS)}; "
+            "it cannot run with isolation=\"pooled\".")
+
+@asynccontextmanager
+async def session_chat(
+        module: Any, kwargs: dict[str, Any], isolation: str,
+        pools: Union[AgentPoolGroup, None] = None) -> AsyncIterator[Any]:
+    """
+    Create a team for one session with module.create_chat(**kwargs).
+    - isolation="fresh": the session gets newly built worker agents and planner.
+      With speculative=True, create_chat builds them itself, wrapped for its SpeculativeExecutor.
+    - isolation="pooled": the session checks out worker agents and planner from pools and returns them (reset) afterwards.
+      Scripts whose create_chat accepts pools borrow workers per execute_agent call instead.
+    - isolation="shared": the module-level agents are used and reset after the session (only safe with concurrency 1).
+    """
+    session_kwargs = dict(kwargs)
+    parameters = inspect.signature(module.create_chat).parameters
+    checked_out: list[Any] = []
+    if isolation == "pooled" and is_speculative(kwargs):
+        check_isolation(module.__name__, isolation, kwargs)
+    # speculative=Trueの場合は、create_chat()がセッションごとに投機的実行用のエージェントを作成する
+    if isolation == "fresh" and not is_speculative(kwargs):
+        if "registry" in parameters:
+            session_kwargs["registry"] = create_worker_registry()
+        if "planner" in parameters:
+            session_kwargs["planner"] = create_planner(get_model_client("planner"))
+    elif isolation == "pooled" and pools is not None:
+        worker_names = [name for name in pools.registry.names() if name != "planner"]
+        if "pools" in parameters:
+            session_kwargs["registry"] = create_worker_registry()
+            session_kwargs["pools"] = pools
+        elif "registry" in parameters:
+            registry = await pools.checkout_all(worker_names)
+            checked_out.append(registry)
+            session_kwargs["registry"] = registry
+        if "planner" in parameters:
+            planner = await pools.pool("planner").checkout() # type: ignore
+            checked_out.append(planner)
+            session_kwargs["planner"] = planner
+    chat = module.create_chat(**session_kwargs)
+    try:
+        yield chat
+    finally:
+        # セッションの終了後に投機的な呼び出しが残らないようにする
+        cancel_speculation(chat)
+        if isolation == "shared":
+            # 共有のエージェントを使用する場合は、次のタスクに会話履歴が残らないようにリセットする
+            await chat.reset()
+        for item in checked_out:
+            if isinstance(item, AgentRegistry):
+                await pools.checkin_all(item) # type: ignore
+            else:
+                await pools.pool("planner").checkin(item) # type: ignore
+
+async def run_session(
+        module: Any, kwargs: dict[str, Any], task: BatchTask, isolation: str,
+        pools: Union[AgentPoolGroup, None] = None, transcript: Union[BufferedSink, None] = None) -> BatchResult:
+    start = time.perf_counter()
+    try:
+        async with session_chat(module, kwargs, isolation, pools) as chat:
+            output = ""
+            message_count = 0
+            stop_reason = None
+            run_metrics = RunMetrics()
+            async for message in chat.run_stream(task=task.input):
+                run_metrics.observe(message)
+                if transcript is not None:
+                    await transcript.emit(message, session=task.id)
+                if isinstance(message, TaskResult):
+                    stop_reason = message.stop_reason
+                elif isinstance(message, BaseChatMessage):
+                    output = message.to_text()
+                    message_count += 1
+        completed = is_completed(stop_reason)
+        return BatchResult(task.id, task.input, output, stop_reason, completed, message_count, time.perf_counter() - start)
+    except Exception as e:
+        return BatchResult(task.id, task.input, "", None, False, 0, time.perf_counter() - start, str(e))
+
+async def run_batch(
+        tasks: Sequence[BatchTask], script: str, kwargs: dict[str, Any] = {},
+        concurrency: int = 4, isolation: str = "fresh", report_pools: bool = False,
+        transcript_dir: Union[str, None] = None) -> list[BatchResult]:
+    # 最大concurrency個のセッションを並列に実行し、タスクの順に結果を返す
+    # isolation="pooled"の場合、report_poolsがTrueであればプールの使用状況を表示する
+    # transcript_dir(既定はRUN_TRANSCRIPT_DIR)が設定されている場合は、全てのセッションのメッセージを
+    # セッション(タスクのid)付きでプロセスごとのJSONLファイルに書き込む
+    init_env()
+    check_isolation(script, isolation, kwargs)
+    module = importlib.import_module(script)
+    if isolation == "shared":
+        concurrency = 1
+    semaphore = asyncio.Semaphore(concurrency)
+    pools = create_session_pools(concurrency) if isolation == "pooled" else None
+    transcript_dir = transcript_dir if transcript_dir is not None else get_transcript_output_dir()
+    transcript = None
+    if transcript_dir is not None:
+        prefix = f"batch-{script}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        transcript = BufferedSink(JsonlTranscriptSink(transcript_dir, prefix))
+
+    async def run_with_semaphore(task: BatchTask) -> BatchResult:
+        async with semaphore:
+            return await run_session(module, kwargs, task, isolation, pools, transcript)
+
+    results = list(await asyncio.gather(*[run_with_semaphore(task) for task in tasks]))
+    if transcript is not None:
+        await transcript.close()
+    if pools is not None and report_pools:
+        # 1つもプールを使用しなかった場合は表示しない
+        report = pools.report()
+        if len(report) > 0:
+            print_table(report, list(report[0].keys()))
+    return results
+
+def _run_batch_in_process(
+        tasks: list[BatchTask], script: str, kwargs: dict[str, Any], concurrency: int, isolation: str) -> tuple[list[BatchResult], dict[str, Any]]:
+    # 結果と、このプロセスのメトリクスの集計を返す
+    results = asyncio.run(run_batch(tasks, script, kwargs, concurrency, isolation, True))
+    return results, metrics.to_json()
+
+def run_batch_in_processes(
+        tasks: Sequence[BatchTask], script: str, kwargs: dict[str, Any] = {},
+        concurrency: int = 4, isolation: str = "fresh", processes: int = 1) -> list[BatchResult]:
+    """
+    Split the tasks across a process pool, each process running run_batch() with the given concurrency.
+    With processes=1 the batch runs in this process.
+    The metrics of the other processes are merged into agent_metrics.metrics of this process.
+    """
+    init_env()
+    check_isolation(script, isolation, kwargs)
+    if processes <= 1:
+        return asyncio.run(run_batch(tasks, script, kwargs, concurrency, isolation, True))
+    chunks = [list(tasks[i::processes]) for i in range(processes)]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(_run_batch_in_process, chunk, script, kwargs, concurrency, isolation) for chunk in chunks if len(chunk) > 0]
+        outputs = [future.result() for future in futures]
+    results = [result for output in outputs for result in output[0]]
+    for output in outputs:
+        metrics.merge(output[1])
+    # タスクの順に並べ替える
+    index = {task.id: i for i, task in enumerate(tasks)}
+    return sorted(results, key=lambda result: index.get(result.id, len(tasks)))
+
+def summarize(results: Sequence[BatchResult], wall_clock: float) -> dict[str, Any]:
+    latencies = [result.elapsed for result in results]
+    return {
+        "tasks": len(results),
+        "completed": sum([1 for result in results if result.completed]),
+        "errors": sum([1 for result in results if result.error is not None]),
+        "wall_clock": wall_clock,
+        "tasks/min": len(results) / wall_clock * 60 if wall_clock > 0 else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p99": percentile(latencies, 99),
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="JSONLファイルの複数のタスクを並列に実行する")
+    parser.add_argument("tasks", help="タスクのJSONLファイル")
+    parser.add_argument("--script", default="selector_group_chat_test_03", help="create_chat()を定義したスクリプトのモジュール名")
+    parser.add_argument("--kwargs", default="{}", help="create_chat()の引数(JSON)")
+    parser.add_argument("--concurrency", type=int, default=4, help="1プロセスあたりの同時実行セッション数")
+    parser.add_argument("--processes", type=int, default=1, help="プロセス数")
+    parser.add_argument("--isolation", default="fresh", choices=["fresh", "pooled", "shared"], help="セッションごとのエージェントの作成方法")
+    parser.add_argument("--output", default=None, help="タスクごとの結果を出力するJSONLファイル")
+    parser.add_argument("--metrics", default=None, help="エージェントごとのメトリクスを出力するファイル名(拡張子なし。.jsonと.promを出力する)。既定値は環境変数METRICS_OUTPUT")
+    args = parser.parse_args()
+
+    tasks = load_tasks(args.tasks)
+    start = time.perf_counter()
+    try:
+        results = run_batch_in_processes(
+            tasks, args.script, json.loads(args.kwargs), args.concurrency, args.isolation, args.processes)
+    except ValueError as e:
+        parser.error(str(e))
+    wall_clock = time.perf_counter() - start
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(asdict(result), ensure_ascii=False) + "\n")
+    for result in results:
+        if result.error is not None:
+            print(f"{result.id}: {result.error}", file=sys.stderr)
+    summary = summarize(results, wall_clock)
+    print_table([summary], list(summary.keys()))
+    paths = write_metrics_report(args.metrics)
+    if paths is not None:
+        print()
+        print_agent_summary()
+        print(f"metrics: {paths[0]}, {paths[1]}")
@@ -0,0 +1,73 @@
+import os, sys, argparse, time
+# ベンチマークはMockChatCompletionClientで実行する。各スクリプトのimport前に設定する必要がある
+os.environ.setdefault("MOCK_MODEL_CLIENT", "1")
+
+from selector_group_chat_test_00 import get_model_client, create_agent
+from agent_registry import AgentRegistry
+from benchmark_utils import percentile, print_table
+
+# エージェント数ごとに、AgentRegistryへの登録時間、名前による検索時間、エージェント一覧の取得時間を計測する
+# 比較のため、従来のリストの線形探索による検索時間も計測する
+
+def register_dummy_agents(registry: AgentRegistry, count: int):
+    for i in range(count):
+        name = f"specialist_{i}"
+        registry.register(
+            name, f"分野{i}の専門知識に関する質問に答えるエージェント",
+            lambda name=name, i=i: create_agent(
+                name=name, description=f"分野{i}の専門知識に関する質問に答えるエージェント",
+                system_message=f"あなたは分野{i}の専門家です。", model_client=get_model_client()))
+
+def measure(count: int, repeat: int) -> dict:
+    registry = AgentRegistry()
+    start = time.perf_counter()
+    register_dummy_agents(registry, count)
+    register_ms = (time.perf_counter() - start) * 1000
+
+    # 最後に登録したエージェントを検索する(線形探索の最悪ケース)
+    name = f"specialist_{count - 1}"
+    start = time.perf_counter()
+    registry.get(name)
+    first_get_ms = (time.perf_counter() - start) * 1000
+
+    lookup_latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        registry.get(name)
+        lookup_latencies.append((time.perf_counter() - start) * 1e6)
+
+    list_latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        registry.descriptions()
+        list_latencies.append((time.perf_counter() - start) * 1e6)
+
+    # 検索と一覧の取得で作成されたエージェント数
+    built = sum([1 for agent_name in registry.names() if registry.is_built(agent_name)])
+
+    # 従来の実装: 全エージェントを作成したリストを線形探索する
+    agents = registry.agents()
+    linear_latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        agent_list = [item for item in agents if item.name == name]
+        linear_latencies.append((time.perf_counter() - start) * 1e6)
+
+    return {
+        "agents": count,
+        "register_ms": register_ms,
+        "first_get_ms": first_get_ms,
+        "built": built,
+        "lookup_p50_us": percentile(lookup_latencies, 50),
+        "list_agents_p50_us": percentile(list_latencies, 50),
+        "linear_lookup_p50_us": percentile(linear_latencies, 50),
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="AgentRegistryの登録、検索時間をエージェント数ごとに計測する")
+    parser.add_argument("--agents", type=int, nargs="*", default=[3, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+
+    rows = [measure(count, args.repeat) for count in args.agents]
+    print_table(rows, list(rows[0].keys()))
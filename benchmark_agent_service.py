@@ -0,0 +1,119 @@
+import os, sys, asyncio, argparse, json, subprocess, tempfile, time
+from typing import Any, Union
+# ベンチマークはMockChatCompletionClientで実行する。サービスとタスクごとのプロセスにも環境変数で引き継ぐ
+os.environ.setdefault("MOCK_MODEL_CLIENT", "1")
+import httpx
+
+from strategies import STRATEGIES
+from benchmark_strategies import TASKS
+from benchmark_utils import percentile, mean, print_table, write_json
+
+# タスクごとにプロセスを起動する場合(cold: batch_runner.pyに1タスクのJSONLを渡す)と、
+# 常駐サービス(agent_service.py)にリクエストを送る場合で、タスクごとの待ち時間を比較する
+# - cold: プロセスの起動からタスクの完了までの時間(import、モデルクライアントとエージェントの作成を含む)
+# - warm_sequential: 1つずつリクエストを送った場合の、リクエストからレスポンスまでの時間
+# - warm_concurrent: 全てのリクエストを同時に送った場合(サービスの同時実行数の上限による待ち時間を含む)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def run_cold(name: str, task: str, directory: str, index: int) -> tuple[float, bool]:
+    module_name, kwargs = STRATEGIES[name]
+    tasks_path = os.path.join(directory, f"cold-{index}.jsonl")
+    output_path = os.path.join(directory, f"cold-{index}.out.jsonl")
+    with open(tasks_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"id": str(index), "input": task}, ensure_ascii=False) + "\n")
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, os.path.join(HERE, "batch_runner.py"), tasks_path, "--script", module_name,
+         "--kwargs", json.dumps(kwargs), "--concurrency", "1", "--output", output_path],
+        cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    elapsed = time.perf_counter() - start
+    with open(output_path, encoding="utf-8") as f:
+        completed = json.loads(f.readline())["completed"]
+    return elapsed, completed
+
+def start_service(concurrency: int, isolation: str, unix_path: Union[str, None]) -> tuple[subprocess.Popen, str, float]:
+    # サービスを起動し、準備ができるまで(ready行の出力まで)の時間を返す
+    command = [sys.executable, os.path.join(HERE, "agent_service.py"), "--concurrency", str(concurrency), "--isolation", isolation]
+    command += ["--unix", unix_path] if unix_path is not None else ["--port", "0"]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    assert process.stderr is not None
+    for line in process.stderr:
+        if line.startswith("agent_service ready: "):
+            return process, line.split(": ", 1)[1].strip(), time.perf_counter() - start
+    raise RuntimeError(f"agent_service exited with code {process.wait()}")
+
+async def post_task(client: httpx.AsyncClient, name: str, task: str) -> tuple[float, bool]:
+    start = time.perf_counter()
+    response = await client.post("/run", json={"task": task, "strategy": name})
+    response.raise_for_status()
+    return time.perf_counter() - start, response.json()["completed"]
+
+async def run_warm(name: str, tasks: list[str], address: str) -> list[dict[str, Any]]:
+    if address.startswith("unix:"):
+        client = httpx.AsyncClient(transport=httpx.AsyncHTTPTransport(uds=address[len("unix:"):]), base_url="http://agent-service", timeout=600)
+    else:
+        client = httpx.AsyncClient(base_url=address, timeout=600)
+    rows = []
+    async with client:
+        start = time.perf_counter()
+        sequential = [await post_task(client, name, task) for task in tasks]
+        rows.append(summarize("warm_sequential", name, sequential, time.perf_counter() - start))
+        start = time.perf_counter()
+        concurrent = list(await asyncio.gather(*[post_task(client, name, task) for task in tasks]))
+        rows.append(summarize("warm_concurrent", name, concurrent, time.perf_counter() - start))
+    return rows
+
+def summarize(mode: str, name: str, results: list[tuple[float, bool]], wall_clock: float, startup: Union[float, None] = None) -> dict[str, Any]:
+    latencies = [elapsed for elapsed, _ in results]
+    return {
+        "mode": mode,
+        "strategy": name,
+        "tasks": len(results),
+        "completed": sum([1 for _, completed in results if completed]),
+        "startup": startup if startup is not None else "",
+        "latency_mean": mean(latencies),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p99": percentile(latencies, 99),
+        "wall_clock": wall_clock,
+    }
+
+def main(strategies: list[str], repeat: int, concurrency: int, isolation: str, use_unix: bool, json_path: Union[str, None]):
+    tasks = TASKS * repeat
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name in strategies:
+            start = time.perf_counter()
+            cold = [run_cold(name, task, directory, i) for i, task in enumerate(tasks)]
+            rows.append(summarize("cold", name, cold, time.perf_counter() - start))
+        unix_path = os.path.join(directory, "agent_service.sock") if use_unix else None
+        process, address, startup = start_service(concurrency, isolation, unix_path)
+        try:
+            for name in strategies:
+                warm = asyncio.run(run_warm(name, tasks, address))
+                warm[0]["startup"] = startup
+                rows.extend(warm)
+        finally:
+            process.terminate()
+            process.wait()
+    print(f"service: {address}")
+    print_table(rows, list(rows[0].keys()))
+    if json_path is not None:
+        write_json(json_path, rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="タスクごとのプロセス起動と常駐サービスで、タスクごとの待ち時間を比較する")
+    parser.add_argument("--strategies", nargs="*", default=["selector_func+rules", "swarm_direct"], choices=list(STRATEGIES.keys()))
+    parser.add_argument("--repeat", type=int, default=2, help="各タスクの実行回数")
+    parser.add_argument("--concurrency", type=int, default=4, help="サービスの同時実行セッション数")
+    parser.add_argument("--isolation", default="pooled", choices=["pooled", "fresh"], help="サービスのセッションごとのエージェントの作成方法")
+    parser.add_argument("--unix", action="store_true", help="TCPの代わりにUnixドメインソケットで接続する")
+    parser.add_argument("--latency", type=float, default=0.01, help="モデル呼び出し1回あたりの待ち時間(秒)")
+    parser.add_argument("--json", default=None, help="結果を出力するJSONファイル")
+    args = parser.parse_args()
+
+    # サービスとタスクごとのプロセスに引き継ぐ
+    os.environ["MOCK_MODEL_LATENCY"] = str(args.latency)
+    print(f"tasks: {len(TASKS) * args.repeat}")
+    main(args.strategies, args.repeat, args.concurrency, args.isolation, args.unix, args.json)
@@ -0,0 +1,142 @@
+import os, asyncio, argparse, importlib, logging, tempfile
+from typing import Any
+# ベンチマークはMockChatCompletionClientで実行する。各スクリプトのimport前に設定する必要がある
+os.environ.setdefault("MOCK_MODEL_CLIENT", "1")
+# autogen
+from autogen_core import CancellationToken
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import BaseChatMessage
+
+import mock_model_client
+import checkpoint
+from checkpoint import Checkpointer, resume_chat
+from termination import is_completed
+from benchmark_strategies import STRATEGIES, TASKS, run_task, reset_agents
+from benchmark_utils import mean, print_table, write_json
+
+# チェックポイントのオーバーヘッドと再開の効果を計測する
+# - overhead: チェックポイントの有無で実行時間を比較し、ターンごとのメッセージの複製の時間(ターンの処理中)、
+#   バックグラウンドでの書き込み時間、書き込んだバイト数(毎ターン全てのメッセージを出力した場合との比較)を表示する
+# - resume: 指定したターン数で実行を中断(プロセスの停止やタイムアウトの代わり)した後、チェックポイントから再開し、
+#   中断前と再開後のLLM呼び出し回数を、最初からやり直した場合と比較する
+
+async def run_overhead(name: str, directory: str) -> list[dict[str, Any]]:
+    module_name, kwargs = STRATEGIES[name]
+    module = importlib.import_module(module_name)
+    rows = []
+    for variant in ("off", "on"):
+        checkpoint.total_stats.reset()
+        results = []
+        for i, task in enumerate(TASKS):
+            checkpointer = None
+            task_kwargs = dict(kwargs)
+            if variant == "on":
+                checkpointer = Checkpointer(os.path.join(directory, f"{name}-{i}.jsonl"), module_name, task, kwargs)
+                task_kwargs["checkpoint"] = checkpointer
+            result = await run_task(module, task_kwargs, task)
+            if checkpointer is not None:
+                await checkpointer.close(result["stop_reason"])
+            results.append(result)
+        report = checkpoint.total_stats.report()
+        turns = report["turns"]
+        rows.append({
+            "strategy": name,
+            "checkpoint": variant,
+            "completed": sum([1 for result in results if result["completed"]]),
+            "wall_clock/task": mean([result["wall_clock"] for result in results]),
+            "capture_ms/turn": report["capture_ms/turn"],
+            "max_capture_ms": report["max_capture_ms"],
+            "write_ms/turn": report["write_ms/turn"],
+            "bytes/turn": report["bytes"] / turns if turns > 0 else 0,
+            "full_dump_bytes/turn": report["full_bytes"] / turns if turns > 0 else 0,
+        })
+    return rows
+
+async def interrupted_run(module: Any, kwargs: dict[str, Any], task: str, path: str, interrupt_after: int) -> int:
+    # interrupt_after個の発言の後にキャンセルし、中断までのLLM呼び出し回数を返す
+    # キャンセルの前に会話が終了した場合は、終了理由を記録する(再開しても呼び出しは行わない)
+    await reset_agents(module)
+    mock_model_client.reset_call_log()
+    checkpointer = Checkpointer(path, module.__name__, task, kwargs)
+    chat = module.create_chat(**kwargs, checkpoint=checkpointer)
+    cancellation_token = CancellationToken()
+    turns = 0
+    stop_reason = "interrupted"
+    try:
+        async for message in chat.run_stream(task=task, cancellation_token=cancellation_token):
+            if type(message) == TaskResult:
+                stop_reason = message.stop_reason or stop_reason
+            elif isinstance(message, BaseChatMessage) and message.source != "user":
+                turns += 1
+                if turns >= interrupt_after:
+                    cancellation_token.cancel()
+    except asyncio.CancelledError:
+        pass
+    await checkpointer.close(stop_reason)
+    return len(mock_model_client.call_log)
+
+async def resumed_run(module: Any, path: str) -> tuple[int, bool]:
+    # 新しいプロセスの代わりに共有のエージェントをリセットしてから、チェックポイントのメッセージを渡して続きを実行する
+    await reset_agents(module)
+    mock_model_client.reset_call_log()
+    _, _, records = checkpoint.load_checkpoint(path)
+    if checkpoint.is_checkpoint_completed(records):
+        return 0, True
+    chat, checkpointer = resume_chat(path)
+    stop_reason = None
+    async for message in chat.run_stream(task=checkpointer.messages, output_task_messages=False):
+        if type(message) == TaskResult:
+            stop_reason = message.stop_reason
+    await checkpointer.close(stop_reason)
+    return len(mock_model_client.call_log), is_completed(stop_reason)
+
+async def run_resume(name: str, directory: str, interrupt_after: int) -> list[dict[str, Any]]:
+    module_name, kwargs = STRATEGIES[name]
+    module = importlib.import_module(module_name)
+    rows = []
+    for i, task in enumerate(TASKS):
+        fresh = await run_task(module, kwargs, task)
+        path = os.path.join(directory, f"{name}-resume-{i}.jsonl")
+        before = await interrupted_run(module, kwargs, task, path, interrupt_after)
+        after, completed = await resumed_run(module, path)
+        rows.append({
+            "strategy": name,
+            "task": i + 1,
+            "fresh_llm_calls": fresh["llm_calls"],
+            "interrupted_llm_calls": before,
+            "resumed_llm_calls": after,
+            # 最初からやり直した場合は中断前の呼び出しを全て繰り返す
+            "restart_llm_calls": before + fresh["llm_calls"],
+            "resume_llm_calls": before + after,
+            "completed": completed,
+        })
+    return rows
+
+async def main(strategies: list[str], mode: str, interrupt_after: int, json_path: str | None):
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name in strategies:
+            if mode == "overhead":
+                rows.extend(await run_overhead(name, directory))
+            else:
+                rows.extend(await run_resume(name, directory, interrupt_after))
+    print_table(rows, list(rows[0].keys()))
+    if json_path is not None:
+        write_json(json_path, rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="チェックポイントのターンごとのオーバーヘッドと、中断した実行の再開を計測する")
+    parser.add_argument("--strategies", nargs="*", default=["default_selector", "selector_func+rules", "swarm", "swarm_direct"],
+                        choices=[name for name in STRATEGIES.keys() if name != "task_graph"])
+    parser.add_argument("--mode", choices=["overhead", "resume"], default="overhead")
+    parser.add_argument("--interrupt-after", type=int, default=3, help="resumeで中断するまでの発言数")
+    parser.add_argument("--latency", type=float, default=0.05, help="モデル呼び出し1回あたりの待ち時間(秒)")
+    parser.add_argument("--json", default=None, help="結果を出力するJSONファイル")
+    args = parser.parse_args()
+
+    os.environ["MOCK_MODEL_LATENCY"] = str(args.latency)
+    if args.mode == "resume":
+        # 中断時にキャンセルされたマネージャーの処理がエラーとして出力されるため表示しない
+        logging.getLogger("autogen_core").setLevel(logging.CRITICAL)
+    print(f"tasks: {len(TASKS)}")
+    asyncio.run(main(args.strategies, args.mode, args.interrupt_after, args.json))
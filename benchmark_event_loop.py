@@ -0,0 +1,68 @@
+import os, sys, asyncio, argparse, time
+from typing import Any
+# ベンチマークはMockChatCompletionClientで実行する。各スクリプトのimport前に設定する必要がある
+os.environ.setdefault("MOCK_MODEL_CLIENT", "1")
+
+from selector_group_chat_test_00 import create_model_client, create_worker_agents, create_planner
+from selector_group_chat_test_03 import create_chat
+from benchmark_strategies import TASKS
+from benchmark_utils import percentile, print_table, write_json
+
+# selector_group_chat_test_03.pyのselect_worker_agentについて、
+# 同期クライアント(イベントループをブロックする)と共有の非同期クライアントを比較する
+
+async def monitor_event_loop_lag(interval: float, samples: list[float], stop: asyncio.Event):
+    # interval秒ごとに起床し、予定時刻からの遅れをイベントループの遅延として記録
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - expected))
+
+async def run_chat(blocking_selector: bool, task: str):
+    # セッションごとに新しいエージェントを作成し、チャット間で会話履歴を共有しない
+    model_client = create_model_client()
+    agents = create_worker_agents(model_client) + [create_planner(model_client)]
+    # ルールとルーターで選択するとselect_worker_agentが呼び出されないため、SelectionEngineと投機的実行は使用しない
+    chat = create_chat(agents, blocking_selector=blocking_selector, use_selection_engine=False, speculative=False)
+    await chat.run(task=task)
+
+async def run_concurrent_chats(blocking_selector: bool, concurrency: int, interval: float) -> dict[str, Any]:
+    lag_samples: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_event_loop_lag(interval, lag_samples, stop))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[run_chat(blocking_selector, TASKS[0]) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await monitor
+    return {
+        "selector": "blocking" if blocking_selector else "async",
+        "concurrent_chats": concurrency,
+        "wall_clock": elapsed,
+        "chats/sec": concurrency / elapsed,
+        "loop_lag_p50": percentile(lag_samples, 50),
+        "loop_lag_p99": percentile(lag_samples, 99),
+        "loop_lag_max": max(lag_samples) if len(lag_samples) > 0 else 0.0,
+    }
+
+async def main(concurrency_levels: list[int], interval: float, json_path: str | None):
+    rows = []
+    for concurrency in concurrency_levels:
+        for blocking_selector in [True, False]:
+            rows.append(await run_concurrent_chats(blocking_selector, concurrency, interval))
+    print_table(rows, list(rows[0].keys()))
+    if json_path is not None:
+        write_json(json_path, rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="select_worker_agentの同期/非同期版について、同時実行チャット数ごとのイベントループ遅延とスループットを比較する")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 10, 100], help="同時に実行するチャット数")
+    parser.add_argument("--latency", type=float, default=0.05, help="モデル呼び出し1回あたりの待ち時間(秒)")
+    parser.add_argument("--interval", type=float, default=0.01, help="イベントループ遅延の計測間隔(秒)")
+    parser.add_argument("--json", default=None, help="結果を出力するJSONファイル")
+    args = parser.parse_args()
+
+    os.environ["MOCK_MODEL_LATENCY"] = str(args.latency)
+    asyncio.run(main(args.concurrency, args.interval, args.json))
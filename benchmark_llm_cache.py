@@ -0,0 +1,54 @@
+import os, sys, asyncio, argparse, importlib, tempfile
+# ベンチマークはMockChatCompletionClientで実行する。各スクリプトのimport前に設定する必要がある
+os.environ.setdefault("MOCK_MODEL_CLIENT", "1")
+os.environ["LLM_CACHE"] = "1"
+
+import llm_cache
+from benchmark_strategies import STRATEGIES, TASKS, run_task
+from benchmark_utils import mean, print_table, write_json
+
+# 同じタスクを2回実行し、1回目(キャッシュなし)と2回目(キャッシュあり)のLLM呼び出し回数と実行時間を比較する
+
+async def run_pass(name: str, label: str) -> dict:
+    module_name, kwargs = STRATEGIES[name]
+    module = importlib.import_module(module_name)
+    cache = llm_cache.get_completion_cache()
+    assert cache is not None
+    cache.stats.reset()
+    results = [await run_task(module, kwargs, task) for task in TASKS]
+    return {
+        "strategy": name,
+        "pass": label,
+        "completed": sum([1 for result in results if result["completed"]]),
+        "llm_calls/task": mean([result["llm_calls"] for result in results]),
+        "cache_hits": cache.stats.hits,
+        "memory_hits": cache.stats.memory_hits,
+        "cache_misses": cache.stats.misses,
+        "hit_rate": cache.stats.hit_rate,
+        "wall_clock/task": mean([result["wall_clock"] for result in results]),
+    }
+
+async def main(strategies: list[str], json_path: str | None):
+    rows = []
+    for name in strategies:
+        rows.append(await run_pass(name, "cold"))
+        rows.append(await run_pass(name, "warm"))
+    print_table(rows, list(rows[0].keys()))
+    if json_path is not None:
+        write_json(json_path, rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="LLM応答キャッシュの有無によるLLM呼び出し回数、実行時間を比較する")
+    parser.add_argument("--strategies", nargs="*", default=["default_selector", "selector_func", "agent_selector_tools+parallel", "task_graph"],
+                        choices=list(STRATEGIES.keys()))
+    parser.add_argument("--policy", default="always", choices=["deterministic", "always"],
+                        help="作業用エージェントとplannerのキャッシュ条件(エージェント選択は常にキャッシュする)")
+    parser.add_argument("--latency", type=float, default=0.05, help="モデル呼び出し1回あたりの待ち時間(秒)")
+    parser.add_argument("--json", default=None, help="結果を出力するJSONファイル")
+    args = parser.parse_args()
+
+    os.environ["LLM_CACHE_POLICY"] = args.policy
+    os.environ["MOCK_MODEL_LATENCY"] = str(args.latency)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ["LLM_CACHE_PATH"] = os.path.join(cache_dir, "llm_cache.sqlite3")
+        asyncio.run(main(args.strategies, args.json))
@@ -0,0 +1,117 @@
+import os, sys, asyncio, argparse, importlib, json, subprocess, tempfile
+from typing import Any, Union
+# ベンチマークはMockChatCompletionClientで実行する。各スクリプトのimport前に設定する必要がある
+os.environ.setdefault("MOCK_MODEL_CLIENT", "1")
+
+from strategies import STRATEGIES
+from benchmark_utils import mean, print_table, write_json
+
+# 役割ごとのモデルの設定(model_tiers.py)を変えて同じタスクを実行し、役割ごとの呼び出し1回あたりの時間、
+# カスケードで切り替えた回数、推定コストを比較する
+# モデルの設定はプロセスで1回だけ読み込むため、設定ごとに別のプロセス(--child)で実行する
+# MockChatCompletionClientのモデルごとの待ち時間、不正なJSONの割合、確信度はmock_model_client.MOCK_MODEL_*
+
+# 名前: MODEL_CONFIGの内容
+CONFIGS: dict[str, dict[str, Any]] = {
+    # 以前と同じく全ての役割でgpt-4o-mini
+    "single": {},
+    # 発言者の選択とagent_selectorを小さいモデルにする(不正なJSONはそのまま)
+    "small_selector": {
+        "selector": "gpt-4.1-nano",
+        "agent_selector": "gpt-4.1-nano",
+    },
+    # 小さいモデルで失敗した場合のみgpt-4o-miniに切り替える
+    "small_selector+cascade": {
+        "selector": {"model": "gpt-4.1-nano", "escalate_to": "gpt-4o-mini"},
+        "agent_selector": {"model": "gpt-4.1-nano", "escalate_to": "gpt-4o-mini"},
+    },
+    # 作業用エージェントを全て大きいモデルにする
+    "large_workers": {
+        "science_researcher": "gpt-4.1",
+        "philosophy_researcher": "gpt-4.1",
+        "anime_researcher": "gpt-4.1",
+    },
+    # 作業用エージェントは確信度が低い場合のみ大きいモデルに切り替え、選択は小さいモデルとカスケード
+    "tiered+cascade": {
+        "selector": {"model": "gpt-4.1-nano", "escalate_to": "gpt-4o-mini"},
+        "agent_selector": {"model": "gpt-4.1-nano", "escalate_to": "gpt-4o-mini"},
+        "science_researcher": {"model": "gpt-4o-mini", "escalate_to": "gpt-4.1", "min_confidence": 0.75},
+        "philosophy_researcher": {"model": "gpt-4o-mini", "escalate_to": "gpt-4.1", "min_confidence": 0.75},
+        "anime_researcher": {"model": "gpt-4o-mini", "escalate_to": "gpt-4.1", "min_confidence": 0.75},
+    },
+}
+
+async def run_child(strategies: list[str], repeat: int) -> dict[str, Any]:
+    # このプロセスのMODEL_CONFIGで各方法のタスクを実行し、方法ごとの結果と役割ごとの集計を返す
+    from benchmark_strategies import TASKS, run_task
+    from agent_metrics import metrics
+    from model_tiers import role_summary
+    rows = []
+    for name in strategies:
+        module_name, kwargs = STRATEGIES[name]
+        module = importlib.import_module(module_name)
+        results = []
+        errors = 0
+        for _ in range(repeat):
+            for task in TASKS:
+                try:
+                    results.append(await run_task(module, kwargs, task))
+                except Exception as e:
+                    # 小さいモデルの不正なJSONなどで実行が失敗した場合
+                    errors += 1
+                    print(f"{name}: {e!r}", file=sys.stderr)
+        rows.append({
+            "strategy": name,
+            "tasks": repeat * len(TASKS),
+            "completed": sum([1 for result in results if result["completed"]]),
+            "errors": errors,
+            "llm_calls/task": mean([result["llm_calls"] for result in results]),
+            "wall_clock/task": mean([result["wall_clock"] for result in results]),
+        })
+    return {"strategies": rows, "roles": role_summary(metrics)}
+
+def run_config(name: str, strategies: list[str], repeat: int, directory: str) -> dict[str, Any]:
+    output = os.path.join(directory, f"{name}.json")
+    env = dict(os.environ, MODEL_CONFIG=json.dumps(CONFIGS[name]))
+    subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", output, "--strategies", *strategies, "--repeat", str(repeat)],
+        env=env, check=True)
+    with open(output, encoding="utf-8") as f:
+        return json.load(f)
+
+def main(configs: list[str], strategies: list[str], repeat: int, json_path: Union[str, None]):
+    strategy_rows = []
+    role_rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name in configs:
+            result = run_config(name, strategies, repeat, directory)
+            tasks = sum([row["tasks"] for row in result["strategies"]])
+            cost = sum([row["cost_usd"] for row in result["roles"]])
+            for row in result["strategies"]:
+                strategy_rows.append({"config": name, **row})
+            for row in result["roles"]:
+                role_rows.append({"config": name, **row, "cost_usd/task": row["cost_usd"] / tasks if tasks > 0 else 0.0})
+            role_rows.append({"config": name, "role": "(total)", "cost_usd": cost, "cost_usd/task": cost / tasks if tasks > 0 else 0.0})
+    print_table(strategy_rows, list(strategy_rows[0].keys()))
+    print()
+    print_table(role_rows, ["config", "role", "models", "calls", "model_calls", "escalations",
+                            "latency_mean", "latency_p99", "llm_seconds", "cost_usd", "cost_usd/task"])
+    if json_path is not None:
+        write_json(json_path, {"strategies": strategy_rows, "roles": role_rows})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="役割ごとのモデルとカスケードの設定で、役割ごとの待ち時間と推定コストを比較する")
+    parser.add_argument("--configs", nargs="*", default=list(CONFIGS.keys()), choices=list(CONFIGS.keys()))
+    parser.add_argument("--strategies", nargs="*", default=["selector_func", "agent_selector_tools", "swarm_direct"],
+                        choices=[name for name in STRATEGIES.keys() if name != "task_graph"])
+    parser.add_argument("--repeat", type=int, default=2, help="各タスクの実行回数")
+    parser.add_argument("--latency", type=float, default=0.02, help="gpt-4o-miniのモデル呼び出し1回あたりの待ち時間(秒)")
+    parser.add_argument("--json", default=None, help="結果を出力するJSONファイル")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.environ["MOCK_MODEL_LATENCY"] = str(args.latency)
+    if args.child is not None:
+        write_json(args.child, asyncio.run(run_child(args.strategies, args.repeat)))
+    else:
+        main(args.configs, args.strategies, args.repeat, args.json)
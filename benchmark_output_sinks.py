@@ -0,0 +1,108 @@
+import os, asyncio, argparse, importlib, tempfile, time
+from typing import Any
+# ベンチマークはMockChatCompletionClientで実行する。各スクリプトのimport前に設定する必要がある
+os.environ.setdefault("MOCK_MODEL_CLIENT", "1")
+# autogen
+from autogen_agentchat.base import TaskResult
+
+from benchmark_strategies import STRATEGIES, TASKS
+from benchmark_event_loop import monitor_event_loop_lag
+from batch_runner import session_chat
+from streaming import StreamPrinter
+from output_sinks import BufferedSink, ConsoleSink, FanoutSink, JsonlTranscriptSink
+from benchmark_utils import percentile, print_table, write_json
+
+# 遅い出力先(書き込みごとに待ち時間があるコンソールやパイプ)に対して、
+# メッセージごとに同期で表示する場合(以前のStreamPrinter)と、バッファ付きのシンク(コンソール+JSONLの会話記録)を比較する
+# 同時に実行するチャット数ごとに、実行時間、イベントループの遅延、シンクのキューの状況を表示する
+
+class SlowWriter:
+    # write()のたびにdelay秒ブロックする出力先。書き込まれた内容は捨てる
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.writes = 0
+
+    def write(self, text: str) -> int:
+        time.sleep(self.delay)
+        self.writes += 1
+        return len(text)
+
+    def flush(self):
+        pass
+
+async def run_chats(name: str, mode: str, concurrency: int, delay: float, queue_size: int, directory: str) -> dict[str, Any]:
+    module_name, kwargs = STRATEGIES[name]
+    module = importlib.import_module(module_name)
+    writer = SlowWriter(delay)
+    sink = None
+    if mode == "sink":
+        sink = FanoutSink([
+            BufferedSink(ConsoleSink(writer, show_ttft=False), max_queue=queue_size, overflow="drop_chunks"),
+            BufferedSink(JsonlTranscriptSink(directory, f"{name}-{concurrency}"), max_queue=queue_size),
+        ])
+
+    async def run_chat(session: int):
+        printer = StreamPrinter(writer)
+        async with session_chat(module, kwargs, "fresh") as chat:
+            async for message in chat.run_stream(task=TASKS[session % len(TASKS)]):
+                if sink is not None:
+                    await sink.emit(message, session=str(session))
+                elif not isinstance(message, TaskResult):
+                    printer.print(message)
+
+    lag_samples: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_event_loop_lag(0.005, lag_samples, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*[run_chat(i) for i in range(concurrency)])
+    # チャットの終了までの時間。シンクのキューに残っているメッセージの書き込みは含まない
+    elapsed = time.perf_counter() - start
+    if sink is not None:
+        await sink.close()
+    stop.set()
+    await monitor
+    row: dict[str, Any] = {
+        "mode": mode,
+        "concurrent_chats": concurrency,
+        "wall_clock": elapsed,
+        "loop_lag_p99": percentile(lag_samples, 99),
+        "loop_lag_max": max(lag_samples) if len(lag_samples) > 0 else 0.0,
+        "console_writes": writer.writes,
+    }
+    if sink is not None:
+        console, transcript = sink.sinks
+        row.update({
+            "dropped_chunks": console.stats.dropped,
+            "max_queue_depth": max(console.stats.max_queue_depth, transcript.stats.max_queue_depth),
+            "blocked_seconds": console.stats.blocked_seconds + transcript.stats.blocked_seconds,
+            "transcript_lines": transcript.stats.written,
+        })
+    return row
+
+async def main(name: str, concurrency_levels: list[int], delay: float, queue_size: int, json_path: str | None):
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for concurrency in concurrency_levels:
+            for mode in ("print", "sink"):
+                rows.append(await run_chats(name, mode, concurrency, delay, queue_size, directory))
+    columns = ["mode", "concurrent_chats", "wall_clock", "loop_lag_p99", "loop_lag_max", "console_writes",
+               "dropped_chunks", "max_queue_depth", "blocked_seconds", "transcript_lines"]
+    print_table(rows, columns)
+    if json_path is not None:
+        write_json(json_path, rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="遅い出力先に対して、同期の表示とバッファ付きのシンクで実行時間とイベントループの遅延を比較する")
+    parser.add_argument("--strategy", default="swarm_direct", choices=[name for name in STRATEGIES.keys() if name != "task_graph"])
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 10], help="同時に実行するチャット数")
+    parser.add_argument("--write-delay", type=float, default=0.002, help="出力先への1回の書き込みの待ち時間(秒)")
+    parser.add_argument("--queue-size", type=int, default=100, help="シンクごとのキューの上限")
+    parser.add_argument("--no-stream", action="store_true", help="トークンストリーミングを無効にする")
+    parser.add_argument("--latency", type=float, default=0.01, help="モデル呼び出し1回あたりの待ち時間(秒)")
+    parser.add_argument("--json", default=None, help="結果を出力するJSONファイル")
+    args = parser.parse_args()
+
+    os.environ["MOCK_MODEL_LATENCY"] = str(args.latency)
+    # create_agentは作成時にMODEL_CLIENT_STREAMを参照する
+    os.environ["MODEL_CLIENT_STREAM"] = "0" if args.no_stream else "1"
+    asyncio.run(main(args.strategy, args.concurrency, args.write_delay, args.queue_size, args.json))
@@ -0,0 +1,60 @@
+import os, asyncio, argparse, importlib
+from typing import Any
+# ベンチマークはMockChatCompletionClientで実行する。各スクリプトのimport前に設定する必要がある
+os.environ.setdefault("MOCK_MODEL_CLIENT", "1")
+
+import mock_model_client
+from agent_metrics import prefix_cache_tracker
+from benchmark_strategies import TASKS, run_task
+from benchmark_utils import print_table, write_json
+
+# モデル呼び出しごとに、同じエージェントの前回のプロンプトと一致する先頭部分のトークン数と、
+# プロバイダのプロンプトキャッシュの対象になるか(一致する先頭部分が最小トークン数以上か)を集計する
+# selector_funcはプロンプトの固定部分をsystem_messageに分けた場合(stable_prefix)と、以前の1つのuserメッセージの場合を比較する
+
+# 名前: (スクリプト, create_chat()の引数)
+VARIANTS: dict[str, tuple[str, dict[str, Any]]] = {
+    "selector_func(single_message)": ("selector_group_chat_test_03", {"use_selection_engine": False, "stable_prefix": False}),
+    "selector_func(stable_prefix)": ("selector_group_chat_test_03", {"use_selection_engine": False, "stable_prefix": True}),
+    "selector_prompt": ("selector_group_chat_test_02", {}),
+    "prebriefed_planner": ("selector_group_chat_test_05", {}),
+}
+
+async def run_variant(name: str, repeat: int, per_call: bool) -> list[dict[str, Any]]:
+    module_name, kwargs = VARIANTS[name]
+    module = importlib.import_module(module_name)
+    prefix_cache_tracker.reset()
+    for _ in range(repeat):
+        for task in TASKS:
+            await run_task(module, kwargs, task)
+    if per_call:
+        rows = [{"variant": name, "call": i + 1, "agent": report.agent, "prompt_tokens": report.prompt_tokens,
+                 "prefix_tokens": report.prefix_tokens, "cacheable_tokens": report.cacheable_tokens, "eligible": report.eligible}
+                for i, report in enumerate(prefix_cache_tracker.calls)]
+        print_table(rows, list(rows[0].keys()))
+    return [{"variant": name, **row} for row in prefix_cache_tracker.summary()]
+
+async def main(variants: list[str], repeat: int, per_call: bool, json_path: str | None):
+    rows = []
+    for name in variants:
+        rows.extend(await run_variant(name, repeat, per_call))
+    print_table(rows, list(rows[0].keys()))
+    if json_path is not None:
+        write_json(json_path, rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="モデル呼び出しごとのプロンプトの先頭部分の一致と、プロンプトキャッシュの対象になる割合を比較する")
+    parser.add_argument("--variants", nargs="*", default=list(VARIANTS.keys()), choices=list(VARIANTS.keys()))
+    parser.add_argument("--repeat", type=int, default=1, help="各タスクの実行回数")
+    parser.add_argument("--answer-repeat", type=int, default=1, help="作業用エージェントの回答を繰り返す回数")
+    parser.add_argument("--min-tokens", type=int, default=prefix_cache_tracker.min_tokens, help="キャッシュの対象になる先頭部分の最小トークン数")
+    parser.add_argument("--per-call", action="store_true", help="呼び出しごとの結果も表示する")
+    parser.add_argument("--json", default=None, help="結果を出力するJSONファイル")
+    args = parser.parse_args()
+
+    os.environ["MOCK_MODEL_LATENCY"] = "0"
+    prefix_cache_tracker.min_tokens = args.min_tokens
+    for worker in mock_model_client.DEFAULT_WORKER_PROFILES:
+        worker.answer = worker.answer * args.answer_repeat
+    print(f"tasks: {len(TASKS)}")
+    asyncio.run(main(args.variants, args.repeat, args.per_call, args.json))
@@ -0,0 +1,91 @@
+import asyncio, argparse, time
+from typing import Any, Union
+# autogen
+from autogen_core.models import ChatCompletionClient, UserMessage
+from autogen_ext.models.openai import OpenAIChatCompletionClient
+
+from rate_limiter import PRIORITY_SELECTOR, PRIORITY_WORKER, RateLimiter, RateLimitedChatCompletionClient
+from rate_limit_stub_server import start_stub_server
+from benchmark_utils import percentile, print_table, write_json
+
+# 429を返すスタブサーバーに対して、作業用エージェントの大量の呼び出しと、エージェント選択の呼び出しを同時に行い、
+# レート制限なし(OpenAIクライアントの再試行のみ)とRateLimiterありの429の回数、失敗数、レイテンシを比較する
+
+def create_stub_client(base_url: str, max_retries: int) -> ChatCompletionClient:
+    return OpenAIChatCompletionClient(model="gpt-4o-mini", api_key="dummy", base_url=base_url, max_retries=max_retries)
+
+async def timed_call(client: ChatCompletionClient, text: str) -> tuple[float, Union[str, None]]:
+    start = time.perf_counter()
+    try:
+        await client.create([UserMessage(content=text, source="user")])
+        return time.perf_counter() - start, None
+    except Exception as e:
+        return time.perf_counter() - start, type(e).__name__
+
+async def run_mode(mode: str, base_url: str, state: Any, workers: int, selectors: int, selector_interval: float, rpm: float) -> dict[str, Any]:
+    limiter: Union[RateLimiter, None] = None
+    if mode == "none":
+        # OpenAIクライアントの既定の再試行(2回)のみ
+        worker_client = selector_client = create_stub_client(base_url, 2)
+    else:
+        # adaptive: レート不明のまま429とRetry-Afterで調整する
+        # rpm: 既知のレートの90%で事前に制限する(到着時刻の揺らぎでサーバー側の上限を超えないように余裕を持たせる)
+        limiter = RateLimiter(requests_per_minute=rpm * 0.9 if mode == "rpm" else 1e9, max_concurrency=32)
+        base_client = create_stub_client(base_url, 0)
+        worker_client = RateLimitedChatCompletionClient(base_client, limiter, PRIORITY_WORKER)
+        selector_client = RateLimitedChatCompletionClient(base_client, limiter, PRIORITY_SELECTOR)
+
+    # tiktokenの読み込みと接続の確立が計測中にイベントループを止めないように、1回呼び出しておく
+    await timed_call(worker_client, "warm up")
+    await asyncio.sleep(1.0)
+    state.reset()
+
+    async def run_selectors() -> list[tuple[float, Union[str, None]]]:
+        # 作業用エージェントの呼び出しが溜まっている間に、一定間隔でエージェント選択を呼び出す
+        results = []
+        for i in range(selectors):
+            await asyncio.sleep(selector_interval)
+            results.append(await timed_call(selector_client, f"select next speaker {i}"))
+        return results
+
+    start = time.perf_counter()
+    worker_results, selector_results = await asyncio.gather(
+        asyncio.gather(*[timed_call(worker_client, f"worker task {i}") for i in range(workers)]),
+        run_selectors())
+    wall_clock = time.perf_counter() - start
+    results = list(worker_results) + list(selector_results)
+    return {
+        "mode": mode,
+        "calls": len(results),
+        "failed": sum([1 for _, error in results if error is not None]),
+        "server_requests": state.requests,
+        "429s": state.rate_limited,
+        "wall_clock": wall_clock,
+        "selector_p50": percentile([elapsed for elapsed, error in selector_results if error is None], 50),
+        "selector_p99": percentile([elapsed for elapsed, error in selector_results if error is None], 99),
+        "worker_p50": percentile([elapsed for elapsed, error in worker_results if error is None], 50),
+        "worker_p99": percentile([elapsed for elapsed, error in worker_results if error is None], 99),
+        "min_concurrency_limit": limiter.concurrency_limit if limiter is not None else "",
+    }
+
+async def main(args: argparse.Namespace):
+    server, state, base_url = start_stub_server(args.rpm, args.latency, args.retry_after)
+    try:
+        rows = [await run_mode(mode, base_url, state, args.workers, args.selectors, args.selector_interval, args.rpm) for mode in args.modes]
+    finally:
+        server.shutdown()
+    print_table(rows, list(rows[0].keys()))
+    if args.json is not None:
+        write_json(args.json, rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="スタブサーバーの429応答に対するRateLimiterの効果を比較する")
+    parser.add_argument("--modes", nargs="*", default=["none", "adaptive", "rpm"], choices=["none", "adaptive", "rpm"])
+    parser.add_argument("--workers", type=int, default=60, help="同時に発行する作業用エージェントの呼び出し数")
+    parser.add_argument("--selectors", type=int, default=5, help="エージェント選択の呼び出し数")
+    parser.add_argument("--selector-interval", type=float, default=0.5, help="エージェント選択の呼び出し間隔(秒)")
+    parser.add_argument("--rpm", type=float, default=300, help="スタブサーバーが受け付ける1分あたりのリクエスト数")
+    parser.add_argument("--latency", type=float, default=0.05, help="スタブサーバーの応答時間(秒)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429応答のRetry-After(秒)")
+    parser.add_argument("--json", default=None, help="結果を出力するJSONファイル")
+    asyncio.run(main(parser.parse_args()))
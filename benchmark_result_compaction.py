@@ -0,0 +1,59 @@
+import os, asyncio, argparse
+from typing import Any
+# ベンチマークはMockChatCompletionClientで実行する。各スクリプトのimport前に設定する必要がある
+os.environ.setdefault("MOCK_MODEL_CLIENT", "1")
+
+import mock_model_client
+import result_compaction
+from benchmark_strategies import STRATEGIES, TASKS, run_strategy
+from benchmark_utils import print_table, write_json
+
+# execute_agentの戻り値の圧縮方法ごとに、agent_selectorとplannerのプロンプトのトークン数を比較する
+# 作業用エージェントの回答は--answer-repeat回繰り返して、実際のモデルの長い回答を模す
+
+async def run_mode(name: str, mode: str, repeat: int) -> dict[str, Any]:
+    # create_agent_tools(チャットの作成時)がRESULT_COMPACTIONを参照する
+    os.environ["RESULT_COMPACTION"] = mode
+    result_compaction.total_stats.reset()
+    summary = await run_strategy(name, repeat)
+    stats = result_compaction.total_stats
+    tasks = summary["tasks"]
+    return {
+        "strategy": name,
+        "compaction": mode,
+        "completed": summary["completed"],
+        "prompt_tokens/task": summary["prompt_tokens/task"],
+        # execute_agentの呼び出しごとの、呼び出したエージェントの会話全体と戻り値のトークン数
+        "transcript_tokens/task": stats.original_tokens / tasks,
+        "result_tokens/task": stats.compacted_tokens / tasks,
+        "result_saving_rate": stats.saving_rate,
+        "wall_clock/task": summary["wall_clock/task"],
+    }
+
+async def main(strategies: list[str], modes: list[str], repeat: int, json_path: str | None):
+    rows = []
+    for name in strategies:
+        for mode in modes:
+            rows.append(await run_mode(name, mode, repeat))
+    print_table(rows, list(rows[0].keys()))
+    if json_path is not None:
+        write_json(json_path, rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="execute_agentの戻り値の圧縮方法ごとに、プロンプトのトークン数を比較する")
+    parser.add_argument("--strategies", nargs="*", default=["agent_selector_tools", "agent_selector_tools+parallel", "swarm+parallel"],
+                        choices=list(STRATEGIES.keys()))
+    parser.add_argument("--modes", nargs="*", default=list(result_compaction.COMPACTION_MODES), choices=list(result_compaction.COMPACTION_MODES))
+    parser.add_argument("--repeat", type=int, default=1, help="各タスクの実行回数")
+    parser.add_argument("--answer-repeat", type=int, default=20, help="作業用エージェントの回答を繰り返す回数")
+    parser.add_argument("--max-tokens", type=int, default=200, help="truncate, summaryの最大トークン数")
+    parser.add_argument("--latency", type=float, default=0.0, help="モデル呼び出し1回あたりの待ち時間(秒)")
+    parser.add_argument("--json", default=None, help="結果を出力するJSONファイル")
+    args = parser.parse_args()
+
+    os.environ["MOCK_MODEL_LATENCY"] = str(args.latency)
+    os.environ["RESULT_COMPACTION_MAX_TOKENS"] = str(args.max_tokens)
+    for worker in mock_model_client.DEFAULT_WORKER_PROFILES:
+        worker.answer = worker.answer * args.answer_repeat
+    print(f"tasks: {len(TASKS)}")
+    asyncio.run(main(args.strategies, args.modes, args.repeat, args.json))
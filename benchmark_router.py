@@ -0,0 +1,55 @@
+import os, sys, argparse, time
+# ベンチマークはMockChatCompletionClientで実行する。各スクリプトのimport前に設定する必要がある
+os.environ.setdefault("MOCK_MODEL_CLIENT", "1")
+
+from selector_group_chat_test_00 import create_model_client, create_agent, worker_agents
+from agent_router import AgentRouter
+from agent_registry import AgentRegistry
+from mock_model_client import DEFAULT_WORKER_PROFILES
+from benchmark_utils import percentile, print_table
+
+# AgentRouterの索引作成時間と、1回のルーティングにかかる時間をエージェント数ごとに計測する
+
+def create_dummy_agents(count: int) -> list:
+    model_client = create_model_client()
+    return [
+        create_agent(
+            name=f"specialist_{i}",
+            description=f"分野{i}の専門知識に関する質問に答えるエージェント",
+            system_message=f"あなたは分野{i}の専門家です。",
+            model_client=model_client,
+        )
+        for i in range(count)]
+
+def measure(agents: list, queries: list[str], repeat: int) -> dict:
+    router = AgentRouter(AgentRegistry.from_agents(agents))
+    start = time.perf_counter()
+    router.rebuild()
+    rebuild_ms = (time.perf_counter() - start) * 1000
+    latencies = []
+    correct = 0
+    for _ in range(repeat):
+        for query, expected in queries:
+            start = time.perf_counter()
+            result = router.route(query)
+            latencies.append((time.perf_counter() - start) * 1e6)
+            if result is not None and result.agent_name == expected:
+                correct += 1
+    return {
+        "agents": len(agents),
+        "rebuild_ms": rebuild_ms,
+        "route_p50_us": percentile(latencies, 50),
+        "route_p99_us": percentile(latencies, 99),
+        "accuracy": correct / (len(queries) * repeat),
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="AgentRouterのルーティング時間をエージェント数ごとに計測する")
+    parser.add_argument("--agents", type=int, nargs="*", default=[0, 100, 1000], help="追加するダミーエージェント数")
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+
+    queries = [(worker.topic + "について教えてください", worker.name) for worker in DEFAULT_WORKER_PROFILES]
+    queries += [("ブラックホールの科学的な仕組み", "science_researcher"), ("宇宙を舞台にしたアニメ作品", "anime_researcher")]
+    rows = [measure(worker_agents + create_dummy_agents(count), queries, args.repeat) for count in args.agents]
+    print_table(rows, list(rows[0].keys()))
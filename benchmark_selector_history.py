@@ -0,0 +1,86 @@
+import os, sys, argparse, time
+from typing import Any
+# ベンチマークはMockChatCompletionClientで実行する。各スクリプトのimport前に設定する必要がある
+os.environ.setdefault("MOCK_MODEL_CLIENT", "1")
+# autogen
+from autogen_core.models import UserMessage
+from autogen_agentchat.messages import TextMessage
+
+from mock_model_client import MockChatCompletionClient, DEFAULT_WORKER_PROFILES
+from selector_group_chat_test_00 import worker_agents, planner
+from selector_group_chat_test_03 import create_selector_prompt
+from selector_history import HistoryPolicy, SelectorHistory
+from benchmark_strategies import TASKS
+from benchmark_utils import mean, print_table, write_json
+
+# エージェント選択用プロンプトのトークン数を、全履歴を含める場合とHistoryPolicyを適用した場合で比較する
+
+def create_conversation(length: int, answer_repeat: int) -> list[TextMessage]:
+    # plannerと作業用エージェントが交互に発言する会話(Swarmの長い実行を想定)
+    messages = [
+        TextMessage(source="user", content=TASKS[0]),
+        TextMessage(source="planner", content="以下の計画でタスクを実行します。\n" + "\n".join(
+            [f"{i + 1}. {worker.topic}（担当: {worker.name}）" for i, worker in enumerate(DEFAULT_WORKER_PROFILES)]) + "\n[計画作成完了]"),
+    ]
+    i = 0
+    while len(messages) < length:
+        worker = DEFAULT_WORKER_PROFILES[i % len(DEFAULT_WORKER_PROFILES)]
+        messages.append(TextMessage(source="planner", content=f"次のタスク「{worker.topic}」を{worker.name}に依頼します。"))
+        messages.append(TextMessage(source=worker.name, content=f"{worker.answer_marker}: " + worker.answer * answer_repeat))
+        i += 1
+    return messages[:length]
+
+def measure(messages: list[TextMessage], policy: HistoryPolicy | None) -> list[dict[str, Any]]:
+    token_counter = MockChatCompletionClient()
+    agents = worker_agents + [planner]
+    history_cache = SelectorHistory(policy) if policy is not None else None
+    rows = []
+    for turn in range(1, len(messages) + 1):
+        start = time.perf_counter()
+        prompt = create_selector_prompt(agents, messages[:turn], history_cache)
+        elapsed = time.perf_counter() - start
+        rows.append({
+            "turn": turn,
+            "prompt_tokens": token_counter.count_tokens([UserMessage(content=prompt, source="user")]),
+            "build_us": elapsed * 1e6,
+        })
+    return rows
+
+def main(length: int, answer_repeat: int, policy: HistoryPolicy, json_path: str | None):
+    messages = create_conversation(length, answer_repeat)
+    before = measure(messages, None)
+    after = measure(messages, policy)
+
+    checkpoints = sorted(set([10, 25, 50, 75, length]) & set(range(1, length + 1)))
+    rows = []
+    for turn in checkpoints:
+        rows.append({
+            "turn": turn,
+            "tokens_full": before[turn - 1]["prompt_tokens"],
+            "tokens_policy": after[turn - 1]["prompt_tokens"],
+            "build_us_full": before[turn - 1]["build_us"],
+            "build_us_policy": after[turn - 1]["build_us"],
+        })
+    rows.append({
+        "turn": "total",
+        "tokens_full": sum([row["prompt_tokens"] for row in before]),
+        "tokens_policy": sum([row["prompt_tokens"] for row in after]),
+        "build_us_full": mean([row["build_us"] for row in before]),
+        "build_us_policy": mean([row["build_us"] for row in after]),
+    })
+    print(f"policy: {policy}")
+    print_table(rows, list(rows[0].keys()))
+    if json_path is not None:
+        write_json(json_path, {"before": before, "after": after})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="エージェント選択用プロンプトのターンごとのトークン数を、HistoryPolicyの適用前後で比較する")
+    parser.add_argument("--messages", type=int, default=100, help="会話のメッセージ数")
+    parser.add_argument("--answer-repeat", type=int, default=5, help="作業用エージェントの回答の長さ(サンプル回答の繰り返し回数)")
+    parser.add_argument("--window", type=int, default=HistoryPolicy.window)
+    parser.add_argument("--max-message-chars", type=int, default=HistoryPolicy.max_message_chars)
+    parser.add_argument("--json", default=None, help="ターンごとの結果を出力するJSONファイル")
+    args = parser.parse_args()
+
+    policy = HistoryPolicy(window=args.window, max_message_chars=args.max_message_chars)
+    main(args.messages, args.answer_repeat, policy, args.json)
@@ -0,0 +1,51 @@
+import os, asyncio, argparse
+from typing import Any
+# ベンチマークはMockChatCompletionClientで実行する。各スクリプトのimport前に設定する必要がある
+os.environ.setdefault("MOCK_MODEL_CLIENT", "1")
+
+import speculation
+from benchmark_strategies import STRATEGIES, TASKS, run_strategy
+from benchmark_utils import print_table, write_json
+
+# 次の発言者の投機的実行の有無で、実行時間とLLM呼び出し回数を比較し、予測の的中率、破棄したトークン数、短縮した時間を表示する
+
+async def run(name: str, repeat: int) -> dict[str, Any]:
+    speculation.total_stats.reset()
+    summary = await run_strategy(name, repeat)
+    stats = speculation.total_stats
+    tasks = summary["tasks"]
+    return {
+        "strategy": name,
+        "completed": summary["completed"],
+        "llm_calls/task": summary["llm_calls/task"],
+        "wall_clock/task": summary["wall_clock/task"],
+        "turn_p50": summary["turn_p50"],
+        "turn_p99": summary["turn_p99"],
+        "speculations/task": stats.speculations / tasks,
+        "hit_rate": stats.hit_rate,
+        "wasted_tokens/task": (stats.wasted_prompt_tokens + stats.wasted_completion_tokens) / tasks,
+        "saved_seconds/task": stats.saved_seconds / tasks,
+    }
+
+async def main(strategies: list[str], repeat: int, json_path: str | None):
+    rows = []
+    for name in strategies:
+        # 投機的実行なしの方法と交互に実行する
+        for variant in (name, f"{name}+speculative"):
+            rows.append(await run(variant, repeat))
+    print_table(rows, list(rows[0].keys()))
+    if json_path is not None:
+        write_json(json_path, rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="次の発言者の投機的実行の有無で、実行時間と予測の的中率を比較する")
+    parser.add_argument("--strategies", nargs="*", default=["default_selector", "selector_func"],
+                        choices=[name for name in STRATEGIES.keys() if f"{name}+speculative" in STRATEGIES])
+    parser.add_argument("--repeat", type=int, default=1, help="各タスクの実行回数")
+    parser.add_argument("--latency", type=float, default=0.05, help="モデル呼び出し1回あたりの待ち時間(秒)")
+    parser.add_argument("--json", default=None, help="結果を出力するJSONファイル")
+    args = parser.parse_args()
+
+    os.environ["MOCK_MODEL_LATENCY"] = str(args.latency)
+    print(f"tasks: {len(TASKS)}")
+    asyncio.run(main(args.strategies, args.repeat, args.json))
@@ -0,0 +1,105 @@
+import os, sys, argparse, json, subprocess, time
+from typing import Any
+
+from benchmark_utils import percentile, print_table, write_json
+
+# スクリプトごとに、新しいPythonプロセスでのimport時間と、最初のモデル呼び出しが完了するまでの時間を計測する
+# --baselineに以前の結果(--jsonで出力したファイル)を指定すると、許容範囲を超えて遅くなった場合に終了コード1を返す
+
+MODULES = [
+    "selector_group_chat_test_00",
+    "selector_group_chat_test_01",
+    "selector_group_chat_test_02",
+    "selector_group_chat_test_03",
+    "selector_group_chat_test_04",
+    "selector_group_chat_test_05",
+    "swarm_test_01",
+    "task_graph_test_01",
+]
+
+# import時に読み込まれるべきでない(最初に使用されたときに読み込む)モジュール
+HEAVY_MODULES = ["openai", "traceloop", "autogen_ext", "httpx", "dotenv", "numpy"]
+
+# 子プロセスで実行するコード。計測結果をJSONで標準出力に出力する
+CHILD_CODE = """
+import sys, time, json, asyncio, importlib
+start = time.perf_counter()
+module = importlib.import_module(sys.argv[1])
+import_s = time.perf_counter() - start
+heavy = [name for name in sys.argv[2].split(",") if name in sys.modules]
+
+async def first_request():
+    # create_chat()からチームを作成し、最初のエージェントの発言(モデル呼び出し)が返るまでの時間
+    chat = module.create_chat()
+    async for message in chat.run_stream(task="宇宙の成り立ちについて教えてください"):
+        if getattr(message, "source", "user") != "user":
+            break
+
+first_request_s = None
+if hasattr(module, "create_chat"):
+    start = time.perf_counter()
+    asyncio.run(first_request())
+    first_request_s = time.perf_counter() - start
+print(json.dumps({"import_s": import_s, "first_request_s": first_request_s, "heavy_imports": heavy}))
+"""
+
+def run_once(module_name: str) -> dict[str, Any]:
+    env = dict(os.environ)
+    env["MOCK_MODEL_CLIENT"] = "1"
+    env["MOCK_MODEL_LATENCY"] = "0"
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-c", CHILD_CODE, module_name, ",".join(HEAVY_MODULES)],
+        env=env, capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    process_s = time.perf_counter() - start
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["process_s"] = process_s
+    return result
+
+def measure(module_name: str, repeat: int) -> dict[str, Any]:
+    runs = [run_once(module_name) for _ in range(repeat)]
+    first_request_values = [run["first_request_s"] for run in runs if run["first_request_s"] is not None]
+    return {
+        "module": module_name,
+        "import_p50": percentile([run["import_s"] for run in runs], 50),
+        "first_request_p50": percentile(first_request_values, 50) if len(first_request_values) > 0 else "",
+        "process_p50": percentile([run["process_s"] for run in runs], 50),
+        "heavy_imports": ",".join(runs[-1]["heavy_imports"]),
+    }
+
+def find_regressions(rows: list[dict[str, Any]], baseline: list[dict[str, Any]], tolerance: float) -> list[str]:
+    # import時間がbaselineのtolerance倍を超えた場合、またはimport時に読み込まれる重いモジュールが増えた場合
+    baseline_rows = {row["module"]: row for row in baseline}
+    regressions = []
+    for row in rows:
+        base = baseline_rows.get(row["module"])
+        if base is None:
+            continue
+        if row["import_p50"] > base["import_p50"] * tolerance:
+            regressions.append(f"{row['module']}: import {base['import_p50']:.3f}s -> {row['import_p50']:.3f}s")
+        added = set(row["heavy_imports"].split(",")) - set(base["heavy_imports"].split(",")) - {""}
+        if len(added) > 0:
+            regressions.append(f"{row['module']}: import時に読み込まれるモジュールが増えました: {', '.join(sorted(added))}")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="スクリプトのimport時間と最初のモデル呼び出しまでの時間を計測する")
+    parser.add_argument("--modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=5, help="各スクリプトの計測回数(プロセス起動回数)")
+    parser.add_argument("--json", default=None, help="結果を出力するJSONファイル")
+    parser.add_argument("--baseline", default=None, help="比較する以前の結果のJSONファイル")
+    parser.add_argument("--tolerance", type=float, default=1.3, help="baselineに対して許容するimport時間の倍率")
+    args = parser.parse_args()
+
+    rows = [measure(module_name, args.repeat) for module_name in args.modules]
+    print_table(rows, list(rows[0].keys()))
+    if args.json is not None:
+        write_json(args.json, rows)
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = find_regressions(rows, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(regression, file=sys.stderr)
+        if len(regressions) > 0:
+            sys.exit(1)
@@ -0,0 +1,125 @@
+import os, sys, asyncio, argparse, importlib, time
+from collections import Counter
+from typing import Any
+# ベンチマークはMockChatCompletionClientで実行する。各スクリプトのimport前に設定する必要がある
+os.environ.setdefault("MOCK_MODEL_CLIENT", "1")
+# autogen
+from autogen_core import CancellationToken
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import BaseChatMessage
+
+import mock_model_client
+import selector_group_chat_test_00
+import selection_engine
+from termination import is_completed
+from benchmark_utils import percentile, mean, print_table, write_json
+from strategies import STRATEGIES
+
+# 全ての方法で共通のタスク
+TASKS: list[str] = [
+    """
+    宇宙について、以下の観点で情報をまとめてください
+    * 宇宙の成り立ち
+    * 哲学的な視点からの宇宙
+    * 宇宙に関するアニメ
+    """,
+    """
+    宇宙について、哲学的な視点から説明してください
+    """,
+    """
+    ブラックホールについて、科学的な仕組みと、ブラックホールが登場するアニメを教えてください
+    """,
+]
+
+async def reset_agents(module: Any):
+    # 前のタスクの会話履歴が残らないように作業用エージェントをリセット
+    registry = getattr(module, "worker_registry", None)
+    if registry is not None:
+        await registry.reset()
+    for agent in getattr(module, "worker_agents", []):
+        await agent.on_reset(CancellationToken())
+    # selector_group_chat_test_00の共有のplannerもリセットする
+    await selector_group_chat_test_00.get_planner().on_reset(CancellationToken())
+
+async def run_task(module: Any, kwargs: dict[str, Any], task: str) -> dict[str, Any]:
+    await reset_agents(module)
+    mock_model_client.reset_call_log()
+    selection_engine.total_stats.reset()
+    chat = module.create_chat(**kwargs)
+
+    turn_latencies: list[float] = []
+    stop_reason = None
+    start = time.perf_counter()
+    last = start
+    async for message in chat.run_stream(task=task):
+        if type(message) == TaskResult:
+            # TaskResultはストリームの最後に返されるため、breakせずにチャットの終了を待つ
+            stop_reason = message.stop_reason
+            continue
+        if isinstance(message, BaseChatMessage) and message.source != "user":
+            now = time.perf_counter()
+            turn_latencies.append(now - last)
+            last = now
+    elapsed = time.perf_counter() - start
+    await chat.reset()
+
+    calls = list(mock_model_client.call_log)
+    return {
+        "llm_calls": len(calls),
+        "selector_calls": len([call for call in calls if call.role == "selector"]),
+        # 役割(selector, planner, agent_selector, 作業用エージェント名)ごとの呼び出し回数
+        "calls_by_role": dict(Counter([call.role for call in calls])),
+        "prompt_tokens": sum([call.prompt_tokens for call in calls]),
+        "selections": selection_engine.total_stats.total,
+        "avoided_selections": selection_engine.total_stats.avoided_llm_calls,
+        "turns": len(turn_latencies),
+        "wall_clock": elapsed,
+        "turn_latencies": turn_latencies,
+        "completed": is_completed(stop_reason),
+        "stop_reason": stop_reason,
+    }
+
+async def run_strategy(name: str, repeat: int) -> dict[str, Any]:
+    module_name, kwargs = STRATEGIES[name]
+    module = importlib.import_module(module_name)
+    results = []
+    for _ in range(repeat):
+        for task in TASKS:
+            results.append(await run_task(module, kwargs, task))
+    selections = sum([result["selections"] for result in results])
+    turn_latencies = [latency for result in results for latency in result["turn_latencies"]]
+    return {
+        "strategy": name,
+        "tasks": len(results),
+        "completed": sum([1 for result in results if result["completed"]]),
+        "llm_calls/task": mean([result["llm_calls"] for result in results]),
+        "selector_calls/task": mean([result["selector_calls"] for result in results]),
+        # SelectionEngineのルールとキャッシュで決定した割合
+        "rule_hit_rate": sum([result["avoided_selections"] for result in results]) / selections if selections > 0 else 0.0,
+        "prompt_tokens/task": mean([result["prompt_tokens"] for result in results]),
+        "turns/task": mean([result["turns"] for result in results]),
+        "wall_clock/task": mean([result["wall_clock"] for result in results]),
+        "turn_p50": percentile(turn_latencies, 50),
+        "turn_p99": percentile(turn_latencies, 99),
+    }
+
+async def main(strategies: list[str], repeat: int, json_path: str | None):
+    summaries = []
+    for name in strategies:
+        summaries.append(await run_strategy(name, repeat))
+    # 1タスクあたりの実行時間が短い順に表示
+    summaries.sort(key=lambda summary: summary["wall_clock/task"])
+    print_table(summaries, list(summaries[0].keys()))
+    if json_path is not None:
+        write_json(json_path, summaries)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="エージェント選択方法ごとのLLM呼び出し回数、ターン数、実行時間を比較する")
+    parser.add_argument("--strategies", nargs="*", default=list(STRATEGIES.keys()), choices=list(STRATEGIES.keys()))
+    parser.add_argument("--repeat", type=int, default=1, help="各タスクの実行回数")
+    parser.add_argument("--latency", type=float, default=0.05, help="モデル呼び出し1回あたりの待ち時間(秒)")
+    parser.add_argument("--json", default=None, help="結果を出力するJSONファイル")
+    args = parser.parse_args()
+
+    os.environ["MOCK_MODEL_LATENCY"] = str(args.latency)
+    asyncio.run(main(args.strategies, args.repeat, args.json))
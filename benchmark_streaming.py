@@ -0,0 +1,62 @@
+import os, asyncio, argparse, importlib, time
+from typing import Any
+# ベンチマークはMockChatCompletionClientで実行する。各スクリプトのimport前に設定する必要がある
+os.environ.setdefault("MOCK_MODEL_CLIENT", "1")
+# autogen
+from autogen_agentchat.base import TaskResult
+
+from benchmark_strategies import STRATEGIES, TASKS
+from batch_runner import session_chat
+from streaming import TTFTRecorder
+from benchmark_utils import percentile, print_table, write_json
+
+# トークンストリーミングの有無で、エージェントごとの最初の出力までの時間(TTFT)と、メッセージが完成するまでの時間を比較する
+
+async def run_mode(name: str, streaming: bool) -> list[dict[str, Any]]:
+    # create_agentとcreate_agent_toolsは作成時にMODEL_CLIENT_STREAMを参照するため、セッションごとにエージェントを作成する
+    os.environ["MODEL_CLIENT_STREAM"] = "1" if streaming else "0"
+    module_name, kwargs = STRATEGIES[name]
+    module = importlib.import_module(module_name)
+    recorder = TTFTRecorder()
+    start = time.perf_counter()
+    for task in TASKS:
+        async with session_chat(module, kwargs, "fresh") as chat:
+            recorder.start()
+            async for message in chat.run_stream(task=task):
+                if not isinstance(message, TaskResult):
+                    recorder.observe(message)
+    wall_clock = time.perf_counter() - start
+    first_outputs = [value for stats in recorder.agents.values() for value in stats.first_output]
+    rows = [{
+        "strategy": name,
+        "streaming": streaming,
+        "agent": "(all)",
+        "turns": len(first_outputs),
+        "ttft_p50": percentile(first_outputs, 50),
+        "ttft_p99": percentile(first_outputs, 99),
+        "wall_clock/task": wall_clock / len(TASKS),
+    }]
+    for row in recorder.report():
+        rows.append({"strategy": name, "streaming": streaming, **row})
+    return rows
+
+async def main(strategies: list[str], json_path: str | None):
+    rows = []
+    for name in strategies:
+        rows.extend(await run_mode(name, False))
+        rows.extend(await run_mode(name, True))
+    columns = ["strategy", "streaming", "agent", "turns", "ttft_p50", "ttft_p99", "complete_p50", "complete_p99", "wall_clock/task"]
+    print_table(rows, columns)
+    if json_path is not None:
+        write_json(json_path, rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="トークンストリーミングの有無による、エージェントごとの最初の出力までの時間を比較する")
+    parser.add_argument("--strategies", nargs="*", default=["selector_func", "agent_selector_tools+parallel", "task_graph"],
+                        choices=list(STRATEGIES.keys()))
+    parser.add_argument("--latency", type=float, default=0.2, help="モデル呼び出し1回あたりの待ち時間(秒)")
+    parser.add_argument("--json", default=None, help="結果を出力するJSONファイル")
+    args = parser.parse_args()
+
+    os.environ["MOCK_MODEL_LATENCY"] = str(args.latency)
+    asyncio.run(main(args.strategies, args.json))
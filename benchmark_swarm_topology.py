@@ -0,0 +1,64 @@
+import os, asyncio, argparse, importlib
+from typing import Any
+# ベンチマークはMockChatCompletionClientで実行する。各スクリプトのimport前に設定する必要がある
+os.environ.setdefault("MOCK_MODEL_CLIENT", "1")
+
+from benchmark_strategies import STRATEGIES, TASKS, run_task
+from benchmark_utils import percentile, mean, print_table, write_json
+
+# Swarmの構成ごとに、1タスクあたりのLLM呼び出し回数(役割ごと)と実行時間を比較する
+# - swarm, swarm+parallel: planner -> agent_selector(list_agents, execute_agent(s)) -> planner
+# - swarm_direct: planner -> 作業用エージェント -> planner(エージェント一覧はplannerのsystem_messageに含める)
+
+ROLES = ["planner", "agent_selector", "workers"]
+
+async def run_topology(name: str, repeat: int) -> dict[str, Any]:
+    module_name, kwargs = STRATEGIES[name]
+    module = importlib.import_module(module_name)
+    results = []
+    for _ in range(repeat):
+        for task in TASKS:
+            results.append(await run_task(module, kwargs, task))
+
+    def role_calls(result: dict[str, Any], role: str) -> int:
+        calls: dict[str, int] = result["calls_by_role"]
+        if role == "workers":
+            return sum([count for name, count in calls.items() if name not in ("planner", "agent_selector", "selector")])
+        return calls.get(role, 0)
+
+    turn_latencies = [latency for result in results for latency in result["turn_latencies"]]
+    row: dict[str, Any] = {
+        "topology": name,
+        "tasks": len(results),
+        "completed": sum([1 for result in results if result["completed"]]),
+        "llm_calls/task": mean([result["llm_calls"] for result in results]),
+    }
+    for role in ROLES:
+        row[f"{role}_calls/task"] = mean([role_calls(result, role) for result in results])
+    row.update({
+        "prompt_tokens/task": mean([result["prompt_tokens"] for result in results]),
+        "wall_clock/task": mean([result["wall_clock"] for result in results]),
+        "turn_p50": percentile(turn_latencies, 50),
+        "turn_p99": percentile(turn_latencies, 99),
+    })
+    return row
+
+async def main(topologies: list[str], repeat: int, json_path: str | None):
+    rows = []
+    for name in topologies:
+        rows.append(await run_topology(name, repeat))
+    print_table(rows, list(rows[0].keys()))
+    if json_path is not None:
+        write_json(json_path, rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Swarmの構成ごとのLLM呼び出し回数と実行時間を比較する")
+    parser.add_argument("--topologies", nargs="*", default=["swarm", "swarm+parallel", "swarm_direct"],
+                        choices=[name for name in STRATEGIES.keys() if name.startswith("swarm")])
+    parser.add_argument("--repeat", type=int, default=1, help="各タスクの実行回数")
+    parser.add_argument("--latency", type=float, default=0.05, help="モデル呼び出し1回あたりの待ち時間(秒)")
+    parser.add_argument("--json", default=None, help="結果を出力するJSONファイル")
+    args = parser.parse_args()
+
+    os.environ["MOCK_MODEL_LATENCY"] = str(args.latency)
+    asyncio.run(main(args.topologies, args.repeat, args.json))
@@ -0,0 +1,87 @@
+import os, sys, asyncio, argparse, json, subprocess, time
+from typing import Any, Sequence
+
+from benchmark_utils import print_table, write_json
+
+# トレースの出力方法ごとに、同じタスクの実行時間を比較する
+# 出力先はネットワーク越しの送信を模して、1回の出力ごとに--export-latency秒待つ
+# TracerProviderはプロセスで1回しか設定できないため、方法ごとに新しいプロセスで実行する
+
+MODES = {
+    # (スパンの出力方法, サンプリング率)
+    "off": (None, 1.0),
+    # Traceloop.init(disable_batch=True)と同じく、スパンの終了ごとに同期で出力する
+    "sync": ("simple", 1.0),
+    "batch": ("batch", 1.0),
+    "batch+sampled": ("batch", 0.1),
+}
+
+async def run_child(mode: str, strategies: Sequence[str], repeat: int, export_latency: float) -> dict[str, Any]:
+    os.environ.setdefault("MOCK_MODEL_CLIENT", "1")
+    from opentelemetry import trace
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor
+    import tracing
+    from benchmark_strategies import run_strategy
+    from benchmark_utils import mean
+
+    class SlowCollector(tracing.SpanCollector):
+        def __init__(self):
+            super().__init__()
+            self.export_calls = 0
+
+        def export(self, spans):
+            time.sleep(export_latency)
+            self.export_calls += 1
+            return super().export(spans)
+
+    processor_type, sample_rate = MODES[mode]
+    collector = SlowCollector()
+    provider = None
+    if processor_type is not None:
+        provider = TracerProvider(sampler=tracing.create_sampler(sample_rate))
+        provider.add_span_processor(
+            SimpleSpanProcessor(collector) if processor_type == "simple" else BatchSpanProcessor(collector))
+        trace.set_tracer_provider(provider)
+
+    summaries = [await run_strategy(name, repeat) for name in strategies]
+    if provider is not None:
+        provider.force_flush()
+    return {
+        "mode": mode,
+        "completed": sum([summary["completed"] for summary in summaries]),
+        "tasks": sum([summary["tasks"] for summary in summaries]),
+        "wall_clock/task": mean([summary["wall_clock/task"] for summary in summaries]),
+        "turn_p99": max([summary["turn_p99"] for summary in summaries]),
+        "spans": len(collector.records()),
+        "export_calls": collector.export_calls,
+    }
+
+def run_mode(mode: str, strategies: Sequence[str], repeat: int, latency: float, export_latency: float) -> dict[str, Any]:
+    env = dict(os.environ)
+    env["MOCK_MODEL_CLIENT"] = "1"
+    env["MOCK_MODEL_LATENCY"] = str(latency)
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode, "--strategies", *strategies,
+         "--repeat", str(repeat), "--export-latency", str(export_latency)],
+        env=env, capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="トレースの出力方法(同期、バッチ、サンプリング)ごとの実行時間を比較する")
+    parser.add_argument("--modes", nargs="*", default=list(MODES.keys()), choices=list(MODES.keys()))
+    parser.add_argument("--strategies", nargs="*", default=["selector_func", "agent_selector_tools+parallel"])
+    parser.add_argument("--repeat", type=int, default=2, help="各タスクの実行回数")
+    parser.add_argument("--latency", type=float, default=0.02, help="モデル呼び出し1回あたりの待ち時間(秒)")
+    parser.add_argument("--export-latency", type=float, default=0.005, help="スパンの出力1回あたりの待ち時間(秒)")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--json", default=None, help="結果を出力するJSONファイル")
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(asyncio.run(run_child(args.child, args.strategies, args.repeat, args.export_latency))))
+        sys.exit(0)
+    rows = [run_mode(mode, args.strategies, args.repeat, args.latency, args.export_latency) for mode in args.modes]
+    print_table(rows, list(rows[0].keys()))
+    if args.json is not None:
+        write_json(args.json, rows)
@@ -0,0 +1,10 @@
+import json
+from typing import Any
+
+# ベンチマーク用の共通関数
+# 集計・表示の関数はstats_utilsに移したため、既存のベンチマークのためにここからもimportできるようにしている
+from stats_utils import percentile, mean, format_value, print_table
+
+def write_json(path: str, data: Any):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
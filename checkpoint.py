@@ -0,0 +1,299 @@
+import os, sys, asyncio, argparse, importlib, json, time
+from dataclasses import dataclass
+from typing import Any, Mapping, Sequence, Union
+# autogen
+from autogen_agentchat.base import TerminationCondition
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, MessageFactory, StopMessage
+
+from agent_metrics import metrics
+from termination import is_completed
+
+# チームの実行のチェックポイント(ターンごとのメッセージを追記するJSONLファイル)と再開
+# - 各ターンの終了時(マネージャーが終了条件を判定する時点)に、そのターンで追加されたチャットメッセージのみを1行として追記する。
+#   終了条件に渡されたメッセージは確定しているため、実行中のチームの状態(team.save_state())は参照しない
+# - JSONへの変換とファイルへの書き込みはバックグラウンドのスレッドで行い、ターンの処理を待たせない
+# - 再開時は記録したメッセージを順に読み込み、新しく作成したチームにタスクとして渡して(run_stream(task=メッセージの一覧))実行を続ける
+# 終了条件にも記録したメッセージが渡されるため、メッセージ数などは中断前から数え続ける(TimeoutTerminationなど時間の条件は最初から数え直す)
+
+CHECKPOINT_VERSION = 2
+
+def get_checkpoint_dir() -> Union[str, None]:
+    # 環境変数CHECKPOINT_DIRが設定されている場合は、実行ごとにチェックポイントファイルを作成する
+    return os.getenv("CHECKPOINT_DIR") or None
+
+def is_fsync_enabled() -> bool:
+    # 環境変数CHECKPOINT_FSYNC=1の場合は、1行ごとにfsyncする(OSの停止にも備える)。既定はflushのみ(プロセスの異常終了に備える)
+    return os.getenv("CHECKPOINT_FSYNC", "0") == "1"
+
+@dataclass
+class CheckpointStats:
+    # 書き込んだターン数、バイト数、それまでの全てのメッセージを毎ターン出力した場合のバイト数
+    turns: int = 0
+    bytes: int = 0
+    full_bytes: int = 0
+    # ターンの処理中にかかった時間(メッセージの複製)と、バックグラウンドでのJSONへの変換と書き込みの時間
+    capture_seconds: float = 0.0
+    max_capture_seconds: float = 0.0
+    write_seconds: float = 0.0
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "turns": self.turns,
+            "bytes": self.bytes,
+            "full_bytes": self.full_bytes,
+            "capture_ms/turn": self.capture_seconds / self.turns * 1000 if self.turns > 0 else 0.0,
+            "max_capture_ms": self.max_capture_seconds * 1000,
+            "write_ms/turn": self.write_seconds / self.turns * 1000 if self.turns > 0 else 0.0,
+        }
+
+    def reset(self):
+        self.turns = 0
+        self.bytes = 0
+        self.full_bytes = 0
+        self.capture_seconds = 0.0
+        self.max_capture_seconds = 0.0
+        self.write_seconds = 0.0
+
+# 全てのチェックポイントの集計
+total_stats = CheckpointStats()
+
+def _json_default(value: Any) -> Any:
+    # メッセージに含まれるdatetimeなど
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    return str(value)
+
+def _encode(record: Mapping[str, Any]) -> str:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+
+def load_checkpoint(path: str) -> tuple[dict[str, Any], list[dict[str, Any]], list[dict[str, Any]]]:
+    """
+    Read a checkpoint file and return (header, messages, records): the chat messages of all written turns
+    (as dumped by BaseChatMessage.dump()) and the turn/resume/end records in order.
+    A truncated last line (interrupted write) is ignored.
+    """
+    header: Union[dict[str, Any], None] = None
+    messages: list[dict[str, Any]] = []
+    records: list[dict[str, Any]] = []
+    with open(path, encoding="utf-8") as f:
+        lines = f.readlines()
+    for i, line in enumerate(lines):
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            if i == len(lines) - 1:
+                break
+            raise
+        if record["type"] == "header":
+            if record.get("version") != CHECKPOINT_VERSION:
+                raise ValueError(f"{path}: unsupported checkpoint version {record.get('version')}")
+            header = record
+            continue
+        if record["type"] == "turn":
+            messages.extend(record["messages"])
+        records.append(record)
+    if header is None:
+        raise ValueError(f"{path} is not a checkpoint file")
+    return header, messages, records
+
+def _truncate_partial_line(path: str):
+    with open(path, "rb+") as f:
+        data = f.read()
+        if len(data) > 0 and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+def is_checkpoint_completed(records: Sequence[Mapping[str, Any]]) -> bool:
+    # 最後のターンの終了理由、または最後の終了の記録が、終了メッセージまたは全タスクの完了の場合
+    turns = [record for record in records if record["type"] == "turn"]
+    if len(turns) > 0 and is_completed(turns[-1]["stop_reason"]):
+        return True
+    return len(records) > 0 and records[-1]["type"] == "end" and records[-1]["completed"]
+
+class CheckpointCondition(TerminationCondition):
+    """
+    Wraps the team's termination condition and checkpoints the turn on every call.
+    The group chat manager calls the termination condition after each turn with the messages the turn added;
+    only those messages are recorded, so nothing depends on the team's internal state while it is running.
+    The turn record includes the stop message of the wrapped condition, so a run that stopped is not resumed.
+    """
+    def __init__(self, checkpointer: "Checkpointer", condition: TerminationCondition):
+        self._checkpointer = checkpointer
+        self._condition = condition
+
+    @property
+    def terminated(self) -> bool:
+        return self._condition.terminated
+
+    async def __call__(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> StopMessage | None:
+        stop_message = await self._condition(messages)
+        await self._checkpointer.capture(messages, stop_message.content if stop_message is not None else None)
+        return stop_message
+
+    async def reset(self) -> None:
+        await self._condition.reset()
+
+class Checkpointer:
+    """
+    Append-only checkpoint of a team run.
+    Wrap the team's termination condition with condition(); each turn appends the chat messages it added.
+    close() waits for pending writes and records how the run ended.
+    messages holds the chat messages of all written turns, which resume_chat() replays as the task of a new run.
+    """
+    def __init__(self, path: str, script: str = "", task: Union[str, None] = None,
+                 kwargs: Union[Mapping[str, Any], None] = None, fsync: Union[bool, None] = None):
+        self.path = path
+        self.fsync = is_fsync_enabled() if fsync is None else fsync
+        self.stats = CheckpointStats()
+        self.turn = 0
+        self.messages: list[BaseChatMessage] = []
+        # 記録済みのメッセージのid(再開時にタスクとして渡したメッセージを再び記録しない)
+        self._recorded: set[str] = set()
+        # それまでの全てのメッセージを出力した場合のバイト数(統計用)
+        self._history_bytes = 0
+        self._queue: Union[asyncio.Queue[Union[tuple[int, str, Union[str, None], list[dict[str, Any]]], None]], None] = None
+        self._writer: Union[asyncio.Task[None], None] = None
+        self._file = None
+        if os.path.exists(path):
+            # 既存のファイルに追記して再開する。書き込み途中で停止した最後の行は削除する
+            _truncate_partial_line(path)
+            header, messages, records = load_checkpoint(path)
+            self.header = header
+            factory = MessageFactory()
+            self.messages = [factory.create(message) for message in messages] # type: ignore
+            self._recorded = {message.id for message in self.messages}
+            self._history_bytes = sum([len(_encode(message).encode("utf-8")) for message in messages])
+            self.turn = max([record["turn"] for record in records if record["type"] == "turn"], default=0)
+            self._append({"type": "resume", "turn": self.turn, "time": time.time()})
+        else:
+            directory = os.path.dirname(path)
+            if directory != "":
+                os.makedirs(directory, exist_ok=True)
+            self.header = {"type": "header", "version": CHECKPOINT_VERSION, "script": script, "task": task,
+                           "kwargs": dict(kwargs or {}), "time": time.time()}
+            self._append(self.header)
+
+    def condition(self, condition: TerminationCondition) -> CheckpointCondition:
+        return CheckpointCondition(self, condition)
+
+    async def capture(self, delta: Sequence[BaseAgentEvent | BaseChatMessage], stop_reason: Union[str, None] = None):
+        start = time.perf_counter()
+        # ターンで追加されたチャットメッセージ(再開時にタスクとして渡した記録済みのメッセージを除く)
+        messages = [message for message in delta if isinstance(message, BaseChatMessage) and message.id not in self._recorded]
+        if len(messages) == 0 and stop_reason is None:
+            return
+        self._recorded.update([message.id for message in messages])
+        self.messages.extend(messages)
+        dumped = [message.dump() for message in messages]
+        elapsed = time.perf_counter() - start
+        self.stats.capture_seconds += elapsed
+        self.stats.max_capture_seconds = max(self.stats.max_capture_seconds, elapsed)
+        total_stats.capture_seconds += elapsed
+        total_stats.max_capture_seconds = max(total_stats.max_capture_seconds, elapsed)
+        metrics.observe("checkpoint_capture_seconds", elapsed)
+
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._writer = asyncio.create_task(self._write_loop())
+        self.turn += 1
+        source = messages[-1].source if len(messages) > 0 else ""
+        self._queue.put_nowait((self.turn, source, stop_reason, dumped))
+
+    async def _write_loop(self):
+        assert self._queue is not None
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                break
+            await asyncio.to_thread(self._write_turn, *item)
+
+    def _write_turn(self, turn: int, source: str, stop_reason: Union[str, None], messages: list[dict[str, Any]]):
+        start = time.perf_counter()
+        self._history_bytes += sum([len(_encode(message).encode("utf-8")) for message in messages])
+        size = self._append({"type": "turn", "turn": turn, "source": source, "stop_reason": stop_reason, "time": time.time(), "messages": messages})
+        elapsed = time.perf_counter() - start
+        for stats in (self.stats, total_stats):
+            stats.turns += 1
+            stats.bytes += size
+            stats.full_bytes += self._history_bytes
+            stats.write_seconds += elapsed
+        metrics.inc("checkpoint_turns_total")
+        metrics.inc("checkpoint_bytes_total", size)
+        metrics.observe("checkpoint_write_seconds", elapsed)
+
+    def _append(self, record: Mapping[str, Any]) -> int:
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        line = _encode(record) + "\n"
+        self._file.write(line)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        return len(line.encode("utf-8"))
+
+    async def close(self, stop_reason: Union[str, None] = None):
+        # 書き込み待ちのターンを全て書き込んでから、終了の記録を追記する。終了メッセージまたは全タスクの完了以外で終了した場合は再開できる
+        if self._queue is not None and self._writer is not None:
+            self._queue.put_nowait(None)
+            await self._writer
+            self._queue = None
+            self._writer = None
+        self._append({"type": "end", "turn": self.turn, "stop_reason": stop_reason, "completed": is_completed(stop_reason), "time": time.time()})
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def create_checkpointer(
+        script: str, task: str, kwargs: Union[Mapping[str, Any], None] = None,
+        directory: Union[str, None] = None) -> Union[Checkpointer, None]:
+    # directory(既定はCHECKPOINT_DIR)が設定されていない場合はNone
+    # scriptは__file__。再開時にimportするモジュール名として記録する
+    directory = directory if directory is not None else get_checkpoint_dir()
+    if directory is None:
+        return None
+    module_name = os.path.splitext(os.path.basename(script))[0]
+    path = os.path.join(directory, f"{module_name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.jsonl")
+    return Checkpointer(path, module_name, task, kwargs)
+
+def resume_chat(path: str) -> tuple[Any, Checkpointer]:
+    """
+    Rebuild the team of a checkpoint file with the recorded script's create_chat(**kwargs),
+    keeping appending to the same file.
+    Continue the run with team.run_stream(task=checkpointer.messages, output_task_messages=False):
+    the participants and the termination condition receive the recorded messages, and the next speaker is selected from them.
+    """
+    checkpointer = Checkpointer(path)
+    module = importlib.import_module(checkpointer.header["script"])
+    chat = module.create_chat(**checkpointer.header["kwargs"], checkpoint=checkpointer)
+    return chat, checkpointer
+
+async def main(path: str):
+    from selector_group_chat_test_00 import run_team
+
+    _, _, records = load_checkpoint(path)
+    if is_checkpoint_completed(records):
+        print(f"{path}: the run has already completed")
+        return
+    chat, checkpointer = resume_chat(path)
+    print(f"resume {checkpointer.header['script']} from turn {checkpointer.turn}", file=sys.stderr)
+
+    # 記録したメッセージをタスクとして渡し、最後に書き込まれたターンの次から続ける
+    await run_team(chat, checkpointer.messages, checkpointer.header["script"], checkpointer)
+    print(checkpointer.stats.report(), file=sys.stderr)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="チェックポイントファイルから、最後に書き込まれたターンの次から実行を再開する")
+    parser.add_argument("path", help="チェックポイントファイル(CHECKPOINT_DIRに作成されたJSONL)")
+    parser.add_argument("--show", action="store_true", help="再開せずに、記録されたターンを表示する")
+    args = parser.parse_args()
+
+    if args.show:
+        header, _, records = load_checkpoint(args.path)
+        print(f"script: {header['script']}, task: {header['task']!r}")
+        for record in records:
+            print(record["type"], record["turn"], record.get("source", record.get("stop_reason", "")))
+    else:
+        from selector_group_chat_test_00 import init_trace
+        init_trace()
+        asyncio.run(main(args.path))
@@ -0,0 +1,313 @@
+import os, json, hashlib, sqlite3, threading, time, asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Callable, Mapping, Optional, Sequence, Union
+from pydantic import BaseModel
+# autogen
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage, ModelInfo, RequestUsage
+from autogen_core.tools import Tool, ToolSchema
+
+# 同じ入力に対するLLMの応答をSQLiteに保存し、2回目以降はLLMを呼び出さずに返す
+
+def is_cache_enabled() -> bool:
+    # 環境変数LLM_CACHEが設定されている場合にキャッシュを使用する
+    return os.getenv("LLM_CACHE", "") not in ("", "0", "false")
+
+@dataclass
+class CacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    # 件数の上限、有効期限により削除した件数
+    evictions: int = 0
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def reset(self):
+        self.memory_hits = self.disk_hits = self.misses = self.writes = self.evictions = 0
+
+def make_cache_key(payload: Mapping[str, Any]) -> str:
+    # payload(モデル名、メッセージ、ツールなど)をキーの順に並べたJSONのハッシュ
+    text = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class CompletionCache:
+    """
+    Two-tier completion cache: an in-memory LRU (hot tier) in front of a SQLite table.
+    Entries older than ttl seconds are treated as misses, and the least recently used entries
+    are evicted when the table grows past max_entries.
+    The SQLite file can be shared by several processes (WAL mode).
+    Use aget/aput from coroutines: they run the SQLite access in a worker thread instead of the event loop.
+    """
+    def __init__(
+            self, path: str = ".llm_cache.sqlite3", ttl: float = 7 * 24 * 3600,
+            max_entries: int = 10000, hot_size: int = 256):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hot_size = hot_size
+        self.stats = CacheStats()
+        self._hot: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access)")
+        self._entry_count = self._connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def _put_hot(self, key: str, created: float, value: str):
+        self._hot[key] = (created, value)
+        self._hot.move_to_end(key)
+        while len(self._hot) > self.hot_size:
+            self._hot.popitem(last=False)
+
+    def _get_hot(self, key: str, now: float) -> Union[str, None]:
+        entry = self._hot.get(key)
+        if entry is None or now - entry[0] > self.ttl:
+            return None
+        self._hot.move_to_end(key)
+        self.stats.memory_hits += 1
+        return entry[1]
+
+    def get(self, key: str) -> Union[str, None]:
+        now = time.time()
+        with self._lock:
+            value = self._get_hot(key, now)
+            if value is not None:
+                return value
+            row = self._connection.execute("SELECT value, created FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self._hot.pop(key, None)
+                self.stats.misses += 1
+                return None
+            self._connection.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, key))
+            self._put_hot(key, row[1], row[0])
+            self.stats.disk_hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            # 既存のキーは上書きし、新しく追加した行だけを件数に数える
+            inserted = self._connection.execute(
+                "INSERT OR IGNORE INTO completions (key, value, created, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)).rowcount > 0
+            if not inserted:
+                self._connection.execute(
+                    "UPDATE completions SET value = ?, created = ?, last_access = ? WHERE key = ?",
+                    (value, now, now, key))
+            self._put_hot(key, now, value)
+            self.stats.writes += 1
+            if inserted:
+                self._entry_count += 1
+                if self._entry_count > self.max_entries:
+                    self._evict(now)
+
+    async def aget(self, key: str) -> Union[str, None]:
+        # メモリ上のエントリはそのまま返し、SQLiteの読み込みは別スレッドで行う(イベントループを止めない)
+        with self._lock:
+            value = self._get_hot(key, time.time())
+        if value is not None:
+            return value
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, value: str):
+        await asyncio.to_thread(self.put, key, value)
+
+    def _evict(self, now: float):
+        # 期限切れのエントリと、上限を超えた分の古いエントリ(上限の1割多く)を削除する
+        deleted = self._connection.execute("DELETE FROM completions WHERE created < ?", (now - self.ttl,)).rowcount
+        count = self._connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        excess = count - int(self.max_entries * 0.9)
+        if excess > 0:
+            deleted += self._connection.execute(
+                "DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY last_access LIMIT ?)",
+                (excess,)).rowcount
+        self._entry_count = self._connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        self.stats.evictions += deleted
+        self._hot.clear()
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM completions")
+            self._hot.clear()
+            self._entry_count = 0
+
+    def __len__(self) -> int:
+        return self._entry_count
+
+    def close(self):
+        self._connection.close()
+
+# プロセス全体で共有するキャッシュ
+_completion_cache: Union[CompletionCache, None] = None
+
+def get_completion_cache() -> Union[CompletionCache, None]:
+    """
+    Return the process-wide CompletionCache, or None if LLM_CACHE is not set.
+    The cache is configured with LLM_CACHE_PATH, LLM_CACHE_TTL (seconds),
+    LLM_CACHE_MAX_ENTRIES and LLM_CACHE_HOT_SIZE.
+    """
+    global _completion_cache
+    if not is_cache_enabled():
+        return None
+    if _completion_cache is None:
+        _completion_cache = CompletionCache(
+            path=os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite3"),
+            ttl=float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000")),
+            hot_size=int(os.getenv("LLM_CACHE_HOT_SIZE", "256")),
+        )
+    return _completion_cache
+
+def _tool_schema(tool: Union[Tool, ToolSchema]) -> Any:
+    return tool.schema if isinstance(tool, Tool) else tool
+
+def _json_output_key(json_output: Any) -> Any:
+    # 構造化出力の場合はJSONスキーマをキーに含める
+    if isinstance(json_output, type) and issubclass(json_output, BaseModel):
+        return json_output.model_json_schema()
+    return json_output
+
+class CachedChatCompletionClient(ChatCompletionClient):
+    """
+    ChatCompletionClient wrapper that answers repeated requests from a CompletionCache.
+    The key is the model name, messages, tools, tool_choice, json_output and extra_create_args.
+    policy decides which requests are cached:
+    - "deterministic": only requests with temperature 0 (default)
+    - "always": every request (e.g. speaker selection, where the same history should give the same speaker)
+    - "never": no request
+    Cached results are returned with cached=True and zero usage.
+    """
+    def __init__(
+            self, client: ChatCompletionClient, cache: CompletionCache, model: str,
+            policy: str = "deterministic", temperature: Optional[float] = None):
+        self._client = client
+        self.cache = cache
+        self.model = model
+        self.policy = policy
+        # クライアント作成時に指定したtemperature(extra_create_argsで指定されていない場合に使用)
+        self.temperature = temperature
+
+    def is_cacheable(self, extra_create_args: Mapping[str, Any]) -> bool:
+        if self.policy == "always":
+            return True
+        if self.policy == "never":
+            return False
+        return extra_create_args.get("temperature", self.temperature) == 0
+
+    def cache_key(
+            self, messages: Sequence[LLMMessage], tools: Sequence[Tool | ToolSchema], tool_choice: Any,
+            json_output: Any, extra_create_args: Mapping[str, Any]) -> str:
+        return make_cache_key({
+            "model": self.model,
+            "messages": [message.model_dump(mode="json") for message in messages],
+            "tools": [_tool_schema(tool) for tool in tools],
+            "tool_choice": tool_choice.name if isinstance(tool_choice, Tool) else tool_choice,
+            "json_output": _json_output_key(json_output),
+            "extra_create_args": dict(extra_create_args),
+        })
+
+    async def _cached_result(self, key: str) -> Union[CreateResult, None]:
+        value = await self.cache.aget(key)
+        if value is None:
+            return None
+        result = CreateResult.model_validate_json(value)
+        result.cached = True
+        result.usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        return result
+
+    async def create(
+            self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = [],
+            tool_choice: Any = "auto", json_output: Optional[Any] = None,
+            extra_create_args: Mapping[str, Any] = {}, cancellation_token: Optional[CancellationToken] = None,
+            ) -> CreateResult:
+        key = None
+        if self.is_cacheable(extra_create_args):
+            key = self.cache_key(messages, tools, tool_choice, json_output, extra_create_args)
+            cached = await self._cached_result(key)
+            if cached is not None:
+                return cached
+        result = await self._client.create(
+            messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+            extra_create_args=extra_create_args, cancellation_token=cancellation_token)
+        if key is not None:
+            await self.cache.aput(key, result.model_dump_json())
+        return result
+
+    async def create_stream(
+            self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = [],
+            tool_choice: Any = "auto", json_output: Optional[Any] = None,
+            extra_create_args: Mapping[str, Any] = {}, cancellation_token: Optional[CancellationToken] = None,
+            ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        key = None
+        if self.is_cacheable(extra_create_args):
+            key = self.cache_key(messages, tools, tool_choice, json_output, extra_create_args)
+            cached = await self._cached_result(key)
+            if cached is not None:
+                # キャッシュの応答は1つのチャンクとして返す
+                if isinstance(cached.content, str) and len(cached.content) > 0:
+                    yield cached.content
+                yield cached
+                return
+        async for chunk in self._client.create_stream(
+                messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+                extra_create_args=extra_create_args, cancellation_token=cancellation_token):
+            if key is not None and isinstance(chunk, CreateResult):
+                await self.cache.aput(key, chunk.model_dump_json())
+            yield chunk
+
+    async def close(self) -> None:
+        await self._client.close()
+
+    def actual_usage(self) -> RequestUsage:
+        return self._client.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self._client.total_usage()
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self._client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self._client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> Any:
+        return self._client.capabilities # type: ignore
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._client.model_info
+
+async def cached_openai_completion_content(
+        openai_client: Any, cache: Union[CompletionCache, None],
+        on_usage: Union[Callable[[Any], None], None] = None, **create_args: Any) -> Union[str, None]:
+    """
+    Call openai_client.chat.completions.create(**create_args) and return the message content.
+    If cache is given, the content is cached with the create arguments as the key.
+    on_usage receives response.usage when the request was not answered from the cache.
+    """
+    key = make_cache_key({"openai_chat_completions": create_args}) if cache is not None else None
+    if key is not None:
+        cached = await cache.aget(key) # type: ignore
+        if cached is not None:
+            return json.loads(cached)
+    response = await openai_client.chat.completions.create(**create_args)
+    content: Union[str, None] = response.choices[0].message.content
+    if on_usage is not None and response.usage is not None:
+        on_usage(response.usage)
+    if key is not None:
+        await cache.aput(key, json.dumps(content, ensure_ascii=False)) # type: ignore
+    return content
@@ -0,0 +1,458 @@
+import os, asyncio, json, math, re, time, zlib
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Any, AsyncGenerator, Mapping, Optional, Sequence, Union
+# autogen
+from autogen_core import CancellationToken, FunctionCall
+from autogen_core.models import (
+    AssistantMessage, ChatCompletionClient, ChatCompletionTokenLogprob, CreateResult, FunctionExecutionResultMessage, LLMMessage,
+    ModelFamily, ModelInfo, RequestUsage, SystemMessage, UserMessage,
+)
+from autogen_core.tools import Tool, ToolSchema
+
+# OpenAIChatCompletionClientのオフライン版。ネットワークにアクセスせず、
+# シナリオに従って決まった応答を返す。ベンチマークやAPIキーなしでの動作確認に使用する。
+
+@dataclass
+class MockWorkerProfile:
+    # エージェント名
+    name: str
+    # system_message中でこのエージェントを識別する文字列
+    keyword: str
+    # このエージェントが担当するタスク
+    topic: str
+    # ユーザーのタスクにこのエージェントの担当が含まれるか判定するための文字列
+    task_keywords: list[str]
+    # 回答
+    answer: str
+
+    @property
+    def answer_marker(self) -> str:
+        return f"{self.name}の回答"
+
+DEFAULT_WORKER_PROFILES: list[MockWorkerProfile] = [
+    MockWorkerProfile(
+        name="science_researcher", keyword="科学研究者", topic="宇宙の成り立ち",
+        task_keywords=["成り立ち", "科学", "物理"],
+        answer="宇宙は約138億年前のビッグバンにより誕生し、インフレーションを経て膨張を続けています。",
+    ),
+    MockWorkerProfile(
+        name="philosophy_researcher", keyword="哲学研究者", topic="哲学的な視点からの宇宙",
+        task_keywords=["哲学"],
+        answer="宇宙論は「なぜ無ではなく何かがあるのか」という形而上学の問いと深く結びついています。",
+    ),
+    MockWorkerProfile(
+        name="anime_researcher", keyword="アニメ研究者", topic="宇宙に関するアニメ",
+        task_keywords=["アニメ"],
+        answer="宇宙を題材にしたアニメには「宇宙兄弟」「プラネテス」「銀河英雄伝説」などがあります。",
+    ),
+]
+
+# SelectorGroupChatのデフォルトのselector_prompt、および各スクリプトのselector_prompt中の文字列
+SELECTOR_PROMPT_MARKERS = ["select the next role", "適切なメンバーを"]
+
+# モデルごとの違い(model_tiers.pyで役割ごとにモデルを変えた場合の確認用)。表にないモデルはgpt-4o-miniと同じ
+# 待ち時間: latency(MOCK_MODEL_LATENCY)に掛ける係数
+MOCK_MODEL_LATENCY_FACTORS: dict[str, float] = {
+    "gpt-4.1-nano": 0.5, "gpt-4o-mini": 1.0, "gpt-4.1-mini": 1.2, "gpt-4o": 2.0, "gpt-4.1": 2.0,
+}
+# JSON出力とツール呼び出しの引数が不正なJSONになる割合
+MOCK_MODEL_ERROR_RATES: dict[str, float] = {
+    "gpt-4.1-nano": 0.15,
+}
+# logprobsを要求された場合の確信度(トークンの平均確率)の中央値。呼び出しごとに±0.15の範囲で変わる
+MOCK_MODEL_CONFIDENCE: dict[str, float] = {
+    "gpt-4.1-nano": 0.7, "gpt-4o-mini": 0.8, "gpt-4.1-mini": 0.85, "gpt-4o": 0.9, "gpt-4.1": 0.9,
+}
+
+def mock_draw(model: str, text: str, salt: str) -> float:
+    # プロンプトとモデルから決まる0以上1未満の値(同じ呼び出しは毎回同じ結果になる)
+    return zlib.crc32(f"{salt}:{model}:{text}".encode("utf-8")) % 10000 / 10000
+
+@dataclass
+class MockCallRecord:
+    # 呼び出し元の役割(selector, planner, agent_selector, 作業用エージェント名, default)
+    role: str
+    prompt_tokens: int
+    completion_tokens: int
+    started: float
+    finished: float
+    model: str = "gpt-4o-mini"
+
+    @property
+    def latency(self) -> float:
+        return self.finished - self.started
+
+# 全てのMockChatCompletionClientの呼び出し履歴
+call_log: list[MockCallRecord] = []
+
+def reset_call_log():
+    call_log.clear()
+
+# シナリオの応答。(テキスト, ツール呼び出し)はツール呼び出しと同時に返すテキスト(CreateResult.thought)
+MockResponse = Union[str, list[FunctionCall], tuple[str, list[FunctionCall]]]
+
+def message_text(message: LLMMessage) -> str:
+    # LLMMessageの内容を文字列として返す
+    if isinstance(message, FunctionExecutionResultMessage):
+        return "\n".join([result.content for result in message.content])
+    content = message.content
+    if isinstance(content, str):
+        return content
+    texts: list[str] = []
+    if isinstance(message, AssistantMessage) and message.thought is not None:
+        texts.append(message.thought)
+    for item in content:
+        if isinstance(item, str):
+            texts.append(item)
+        elif isinstance(item, FunctionCall):
+            texts.append(f"{item.name}({item.arguments})")
+    return "\n".join(texts)
+
+def tool_names(tools: Sequence[Tool | ToolSchema]) -> list[str]:
+    return [tool["name"] if isinstance(tool, dict) else tool.name for tool in tools]
+
+class MockScenario:
+    """
+    A deterministic scenario for the planner / worker team defined in selector_group_chat_test_00.py.
+    The role of each call is detected from the messages, and the reply follows the plan:
+    planner makes a plan, each worker answers its topic once, and planner terminates.
+    silent_handoffs: in a Swarm, each worker first hands back to the planner this many times without any text
+    (only the transfer_to_planner call), as real models sometimes do (default: MOCK_SILENT_HANDOFFS or 0).
+    """
+    def __init__(
+            self, workers: list[MockWorkerProfile] = DEFAULT_WORKER_PROFILES,
+            planner_name: str = "planner", agent_selector_name: str = "agent_selector",
+            silent_handoffs: Optional[int] = None):
+        self.workers = workers
+        self.planner_name = planner_name
+        self.agent_selector_name = agent_selector_name
+        self.silent_handoffs = silent_handoffs if silent_handoffs is not None else int(os.getenv("MOCK_SILENT_HANDOFFS", "0"))
+
+    def detect_role(self, messages: Sequence[LLMMessage]) -> str:
+        texts = [message_text(message) for message in messages]
+        if any(marker in text for marker in SELECTOR_PROMPT_MARKERS for text in texts):
+            return "selector"
+        system_text = "\n".join([text for message, text in zip(messages, texts) if isinstance(message, SystemMessage)])
+        for worker in self.workers:
+            if worker.keyword in system_text:
+                return worker.name
+        if "list_agents" in system_text:
+            return self.agent_selector_name
+        if "計画" in system_text:
+            return self.planner_name
+        return "default"
+
+    def respond(
+            self, role: str, messages: Sequence[LLMMessage], tools: Sequence[Tool | ToolSchema], json_output: bool
+            ) -> MockResponse:
+        if role == "selector":
+            return self._respond_selector(messages, json_output)
+        if role == self.planner_name:
+            return self._respond_planner(messages, tools)
+        if role == self.agent_selector_name:
+            return self._respond_agent_selector(messages, tools)
+        for worker in self.workers:
+            if role == worker.name:
+                answer = f"{worker.answer_marker}: {worker.answer}"
+                if f"transfer_to_{self.planner_name}" in tool_names(tools):
+                    # Swarmで直接呼び出された場合は、回答と同時にplannerに引き継ぐ
+                    # silent_handoffs回までは、テキストなしで引き継ぐ
+                    transfer = [FunctionCall(id=f"call_{len(messages)}", name=f"transfer_to_{self.planner_name}", arguments="{}")]
+                    transfers = sum([message_text(message).count(f"transfer_to_{self.planner_name}(") for message in messages])
+                    if transfers < self.silent_handoffs:
+                        return transfer
+                    return answer, transfer
+                return answer
+        return "了解しました。"
+
+    def required_workers(self, messages: Sequence[LLMMessage]) -> list[MockWorkerProfile]:
+        # ユーザーのタスクに含まれる観点を担当する作業用エージェント
+        task = self._task_text(messages)
+        workers = [worker for worker in self.workers if any(keyword in task for keyword in worker.task_keywords)]
+        return workers if len(workers) > 0 else list(self.workers)
+
+    def pending_workers(self, messages: Sequence[LLMMessage]) -> list[MockWorkerProfile]:
+        # まだ回答していない作業用エージェント
+        text = "\n".join([message_text(message) for message in messages])
+        return [worker for worker in self.required_workers(messages) if worker.answer_marker not in text]
+
+    def _task_text(self, messages: Sequence[LLMMessage]) -> str:
+        text = "\n".join([message_text(message) for message in messages])
+        # selectorのプロンプト(固定部分をsystem_messageに分けた場合を含む)自体はタスクではない
+        if not any(marker in text for marker in SELECTOR_PROMPT_MARKERS):
+            for message in messages:
+                if isinstance(message, UserMessage) and message.source == "user" and isinstance(message.content, str):
+                    return message.content
+        # selectorのプロンプトの場合は{history}中のuserの発言を取り出す
+        match = re.search(r"^\s*user: (.*?)(?=^\s*\w+: |\Z)", text, re.MULTILINE | re.DOTALL)
+        return match.group(1) if match else ""
+
+    def _last_speaker(self, text: str) -> Union[str, None]:
+        names = [worker.name for worker in self.workers] + [self.planner_name, self.agent_selector_name, "user"]
+        speakers = re.findall(r"^\s*(" + "|".join(map(re.escape, names)) + r"): ", text, re.MULTILINE)
+        return speakers[-1] if len(speakers) > 0 else None
+
+    def _respond_selector(self, messages: Sequence[LLMMessage], json_output: bool) -> str:
+        text = "\n".join([message_text(message) for message in messages])
+        pending = self.pending_workers(messages)
+        if self._last_speaker(text) != self.planner_name:
+            member = self.planner_name
+        elif len(pending) == 0:
+            member = self.planner_name
+        elif f"{pending[0].name}:" in text:
+            # 作業用エージェントがチームのメンバーの場合は直接選択する
+            member = pending[0].name
+        else:
+            member = self.agent_selector_name
+        if json_output or "JSON" in text:
+            return json.dumps({"member": member}, ensure_ascii=False)
+        return member
+
+    def _plan(self, messages: Sequence[LLMMessage]) -> str:
+        lines = [f"{i + 1}. {worker.topic}（担当: {worker.name}）" for i, worker in enumerate(self.required_workers(messages))]
+        return "以下の計画でタスクを実行します。\n" + "\n".join(lines) + "\n[計画作成完了]"
+
+    def _respond_planner(self, messages: Sequence[LLMMessage], tools: Sequence[Tool | ToolSchema]) -> MockResponse:
+        # system_messageには[計画作成完了]の指示が含まれるため、会話部分のみを確認する
+        text = "\n".join([message_text(message) for message in messages if not isinstance(message, SystemMessage)])
+        system_text = "\n".join([message_text(message) for message in messages if isinstance(message, SystemMessage)])
+        if "depends_on" in system_text:
+            # タスクグラフを作成するplanner(task_graph.py)
+            return self._respond_graph_planner(messages, text)
+        if "[計画作成完了]" not in text:
+            return self._plan(messages)
+        pending = self.pending_workers(messages)
+        if len(pending) == 0:
+            return "全てのタスクが完了しました。各エージェントの回答をまとめて報告します。[TERMINATE]"
+        names = tool_names(tools)
+        for target in [pending[0].name, self.agent_selector_name]:
+            if f"transfer_to_{target}" in names:
+                return [FunctionCall(id=f"call_{len(messages)}", name=f"transfer_to_{target}", arguments="{}")]
+        return f"次のタスク「{pending[0].topic}」を{pending[0].name}に依頼します。"
+
+    def _respond_graph_planner(self, messages: Sequence[LLMMessage], text: str) -> str:
+        if "タスクの実行結果" in text:
+            return "各タスクの結果をまとめて報告します。[TERMINATE]"
+        tasks = [
+            {"id": f"t{i + 1}", "agent_name": worker.name, "input": worker.topic, "depends_on": []}
+            for i, worker in enumerate(self.required_workers(messages))]
+        return json.dumps({"tasks": tasks}, ensure_ascii=False)
+
+    def _respond_agent_selector(self, messages: Sequence[LLMMessage], tools: Sequence[Tool | ToolSchema]) -> MockResponse:
+        names = tool_names(tools)
+        call_id = f"call_{len(messages)}"
+        last = messages[-1] if len(messages) > 0 else None
+        if isinstance(last, FunctionExecutionResultMessage) and any(result.name in ("execute_agent", "execute_agents") for result in last.content):
+            # エージェントの実行が完了したらplannerに戻る
+            if f"transfer_to_{self.planner_name}" in names:
+                return [FunctionCall(id=call_id, name=f"transfer_to_{self.planner_name}", arguments="{}")]
+            return "エージェントの実行が完了しました。"
+        listed = any(
+            isinstance(message, FunctionExecutionResultMessage) and any(result.name == "list_agents" for result in message.content)
+            for message in messages)
+        if not listed and "list_agents" in names:
+            return [FunctionCall(id=call_id, name="list_agents", arguments="{}")]
+        pending = self.pending_workers(messages)
+        if len(pending) > 1 and "execute_agents" in names:
+            # 残りのタスクをまとめて並列に実行する
+            tasks = [{"agent_name": worker.name, "initial_message": worker.topic} for worker in pending]
+            return [FunctionCall(id=call_id, name="execute_agents", arguments=json.dumps({"tasks": tasks}, ensure_ascii=False))]
+        if len(pending) == 0 or "execute_agent" not in names:
+            return "実行するタスクはありません。"
+        arguments = json.dumps({"agent_name": pending[0].name, "initial_message": pending[0].topic}, ensure_ascii=False)
+        return [FunctionCall(id=call_id, name="execute_agent", arguments=arguments)]
+
+class MockChatCompletionClient(ChatCompletionClient):
+    """
+    A deterministic stand-in for OpenAIChatCompletionClient.
+    - responses: scripted responses returned in order. If omitted, the scenario decides the response.
+    - latency: seconds to wait for each call, latency_per_token: seconds added per completion token.
+    - chars_per_token: used to estimate the token counts reported in RequestUsage.
+    - model: the latency, the rate of invalid JSON and the confidence reported in logprobs depend on the model
+      (MOCK_MODEL_*). MockOpenAI / MockAsyncOpenAI use the model of each request instead.
+    """
+    def __init__(
+            self, scenario: Optional[MockScenario] = None, responses: Optional[Sequence[MockResponse]] = None,
+            latency: float = 0.0, latency_per_token: float = 0.0, chars_per_token: float = 2.0,
+            model: str = "gpt-4o-mini"):
+        self.scenario = scenario if scenario is not None else MockScenario()
+        self._responses = list(responses) if responses is not None else None
+        self._response_index = 0
+        self.latency = latency
+        self.latency_per_token = latency_per_token
+        self.chars_per_token = chars_per_token
+        self.model = model
+        self._actual_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        self._total_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+
+    def _count_text_tokens(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def _next_response(
+            self, messages: Sequence[LLMMessage], tools: Sequence[Tool | ToolSchema], json_output: bool
+            ) -> tuple[str, MockResponse]:
+        role = self.scenario.detect_role(messages)
+        if self._responses is not None and len(self._responses) > 0:
+            content = self._responses[self._response_index % len(self._responses)]
+            self._response_index += 1
+            return role, content
+        return role, self.scenario.respond(role, messages, tools, json_output)
+
+    def _prepare(
+            self, messages: Sequence[LLMMessage], tools: Sequence[Tool | ToolSchema], json_output: Any,
+            model: Optional[str] = None, logprobs: bool = False) -> tuple[str, CreateResult, float]:
+        model = model if model is not None else self.model
+        role, response = self._next_response(messages, tools, bool(json_output))
+        thought, content = response if isinstance(response, tuple) else (None, response)
+        prompt_text = "\n".join([message_text(message) for message in messages])
+        if mock_draw(model, prompt_text, "error") < MOCK_MODEL_ERROR_RATES.get(model, 0.0):
+            # 途中で切れたJSONを返す
+            if isinstance(content, str) and json_output:
+                content = content[:len(content) // 2]
+            elif not isinstance(content, str):
+                content = [FunctionCall(id=call.id, arguments=call.arguments[:-1], name=call.name) for call in content]
+        token_logprobs = None
+        if logprobs:
+            confidence = MOCK_MODEL_CONFIDENCE.get(model, 0.8) + (mock_draw(model, prompt_text, "confidence") - 0.5) * 0.3
+            token_logprobs = [ChatCompletionTokenLogprob(token="", logprob=math.log(min(max(confidence, 0.01), 0.99)))]
+        prompt_tokens = self.count_tokens(messages, tools=tools)
+        completion_text = content if isinstance(content, str) else "\n".join([call.arguments for call in content])
+        completion_tokens = self._count_text_tokens((thought or "") + completion_text)
+        usage = RequestUsage(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        result = CreateResult(
+            finish_reason="stop" if isinstance(content, str) else "function_calls",
+            content=content, usage=usage, cached=False, thought=thought, logprobs=token_logprobs,
+        )
+        delay = (self.latency + self.latency_per_token * completion_tokens) * MOCK_MODEL_LATENCY_FACTORS.get(model, 1.0)
+        return role, result, delay
+
+    def _record(self, role: str, result: CreateResult, started: float, model: Optional[str] = None):
+        self._actual_usage = result.usage
+        self._total_usage = RequestUsage(
+            prompt_tokens=self._total_usage.prompt_tokens + result.usage.prompt_tokens,
+            completion_tokens=self._total_usage.completion_tokens + result.usage.completion_tokens,
+        )
+        call_log.append(MockCallRecord(
+            role=role, prompt_tokens=result.usage.prompt_tokens, completion_tokens=result.usage.completion_tokens,
+            started=started, finished=time.perf_counter(), model=model if model is not None else self.model))
+
+    async def create(
+            self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = [],
+            tool_choice: Any = "auto", json_output: Optional[Any] = None,
+            extra_create_args: Mapping[str, Any] = {}, cancellation_token: Optional[CancellationToken] = None,
+            ) -> CreateResult:
+        started = time.perf_counter()
+        role, result, delay = self._prepare(messages, tools, json_output, logprobs=bool(extra_create_args.get("logprobs")))
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._record(role, result, started)
+        return result
+
+    async def create_stream(
+            self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = [],
+            tool_choice: Any = "auto", json_output: Optional[Any] = None,
+            extra_create_args: Mapping[str, Any] = {}, cancellation_token: Optional[CancellationToken] = None,
+            ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        started = time.perf_counter()
+        role, result, delay = self._prepare(messages, tools, json_output, logprobs=bool(extra_create_args.get("logprobs")))
+        # ツール呼び出しと同時に返すテキストも、OpenAIのAPIと同様にチャンクで返す
+        text = result.content if isinstance(result.content, str) else (result.thought or "")
+        if len(text) > 0:
+            # 応答を数文字ずつのチャンクに分けて返す
+            chunk_size = max(1, int(self.chars_per_token))
+            chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+            for chunk in chunks:
+                await asyncio.sleep(delay / len(chunks))
+                yield chunk
+        elif delay > 0:
+            await asyncio.sleep(delay)
+        self._record(role, result, started)
+        yield result
+
+    async def close(self) -> None:
+        pass
+
+    def actual_usage(self) -> RequestUsage:
+        return self._actual_usage
+
+    def total_usage(self) -> RequestUsage:
+        return self._total_usage
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        text = "\n".join([message_text(message) for message in messages])
+        return self._count_text_tokens(text) + 50 * len(tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return 128000 - self.count_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> Any:
+        return self.model_info
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return ModelInfo(
+            vision=False, function_calling=True, json_output=True, family=ModelFamily.GPT_4O,
+            structured_output=True, multiple_system_messages=True,
+        )
+
+def _to_llm_messages(messages: Sequence[Mapping[str, Any]]) -> list[LLMMessage]:
+    # OpenAI形式のメッセージをLLMMessageに変換
+    llm_messages: list[LLMMessage] = []
+    for message in messages:
+        if message["role"] == "system":
+            llm_messages.append(SystemMessage(content=message["content"]))
+        elif message["role"] == "assistant":
+            llm_messages.append(AssistantMessage(content=message["content"], source="assistant"))
+        else:
+            llm_messages.append(UserMessage(content=message["content"], source="user"))
+    return llm_messages
+
+def _to_openai_response(result: CreateResult, model: str) -> Any:
+    # CreateResultをopenai.OpenAI.chat.completions.createの戻り値と同じ形に変換
+    content = result.content if isinstance(result.content, str) else json.dumps([call.model_dump() for call in result.content])
+    message = SimpleNamespace(role="assistant", content=content, tool_calls=None)
+    usage = SimpleNamespace(
+        prompt_tokens=result.usage.prompt_tokens, completion_tokens=result.usage.completion_tokens,
+        total_tokens=result.usage.prompt_tokens + result.usage.completion_tokens)
+    return SimpleNamespace(
+        model=model, choices=[SimpleNamespace(index=0, message=message, finish_reason=result.finish_reason)], usage=usage)
+
+class MockOpenAI:
+    """
+    A stand-in for openai.OpenAI that answers chat.completions.create with a MockChatCompletionClient.
+    """
+    def __init__(self, client: Optional[MockChatCompletionClient] = None):
+        self._client = client if client is not None else MockChatCompletionClient()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, *, model: str, messages: Sequence[Mapping[str, Any]], response_format: Any = None, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        json_output = response_format is not None and response_format.get("type") == "json_object"
+        role, result, delay = self._client._prepare(_to_llm_messages(messages), [], json_output, model)
+        if delay > 0:
+            # 同期クライアントなので、実際のAPI呼び出しと同様にスレッドをブロックする
+            time.sleep(delay)
+        self._client._record(role, result, started, model)
+        return _to_openai_response(result, model)
+
+class MockAsyncOpenAI:
+    """
+    A stand-in for openai.AsyncOpenAI that answers chat.completions.create with a MockChatCompletionClient.
+    """
+    def __init__(self, client: Optional[MockChatCompletionClient] = None):
+        self._client = client if client is not None else MockChatCompletionClient()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, *, model: str, messages: Sequence[Mapping[str, Any]], response_format: Any = None, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        json_output = response_format is not None and response_format.get("type") == "json_object"
+        role, result, delay = self._client._prepare(_to_llm_messages(messages), [], json_output, model)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._client._record(role, result, started, model)
+        return _to_openai_response(result, model)
+
+    async def close(self) -> None:
+        pass
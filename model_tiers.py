@@ -0,0 +1,360 @@
+import os, json, math, time
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Awaitable, Callable, Mapping, Optional, Sequence, TypeVar, Union
+# autogen
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage, ModelInfo, RequestUsage
+from autogen_core.tools import Tool, ToolSchema
+
+from agent_metrics import metrics, Histogram, MetricsRegistry
+
+# 役割(selector, planner, agent_selector, 作業用エージェント名)ごとのモデルの設定と、カスケード
+# 発言者の選択やルーティングのような小さな分類は安価で速いモデル、作業用エージェントの回答は大きいモデルのように、役割ごとにモデルを変える。
+# カスケードを設定した役割は、まず速いモデルで呼び出し、応答を使用できない場合(JSONやツール呼び出しの引数の解析エラー、
+# logprobsから求めた確信度が低い場合)のみ、次のモデルで呼び出し直す
+#
+# 設定は環境変数MODEL_CONFIG(JSONファイルのパス、またはJSON文字列)から、プロセスで1回だけ読み込む。
+#   {"default": "gpt-4o-mini",
+#    "selector": {"model": "gpt-4.1-nano", "escalate_to": "gpt-4o-mini"},
+#    "science_researcher": {"model": "gpt-4o-mini", "escalate_to": "gpt-4.1", "min_confidence": 0.7}}
+# 設定されていない役割はdefault(既定値はgpt-4o-mini)を使用する
+
+DEFAULT_MODEL = "gpt-4o-mini"
+DEFAULT_ROLE = "default"
+
+# モデルごとの100万トークンあたりの料金(USD)。(入力, 出力)
+MODEL_PRICES: dict[str, tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+}
+
+@dataclass(frozen=True)
+class RoleModelConfig:
+    # 最初に呼び出すモデル
+    model: str = DEFAULT_MODEL
+    # modelの応答を使用できない場合に呼び出し直すモデル。Noneの場合はカスケードしない
+    escalate_to: Union[str, None] = None
+    # 確信度(logprobsのトークンの平均確率)がこの値未満の場合も呼び出し直す。Noneの場合は確信度を判定しない
+    min_confidence: Union[float, None] = None
+
+    @property
+    def models(self) -> list[str]:
+        return [self.model] if self.escalate_to is None else [self.model, self.escalate_to]
+
+    @property
+    def cost_model(self) -> str:
+        # 推定コストの計算に使用するモデル。カスケードの応答のmodels_usageは各モデルの合計のため、料金の高いモデルで見積もる(上限)
+        # MODEL_PRICESにないモデルのみの場合はDEFAULT_MODEL
+        priced = [model for model in self.models if model in MODEL_PRICES]
+        return max(priced, key=lambda model: sum(MODEL_PRICES[model])) if len(priced) > 0 else DEFAULT_MODEL
+
+    @classmethod
+    def from_value(cls, value: Union[str, Mapping[str, Any]]) -> "RoleModelConfig":
+        # "gpt-4o-mini"のようにモデル名のみ、または{"model", "escalate_to", "min_confidence"}
+        if isinstance(value, str):
+            return cls(model=value)
+        unknown = set(value.keys()) - {"model", "escalate_to", "min_confidence"}
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown model config keys: {sorted(unknown)}")
+        min_confidence = value.get("min_confidence")
+        return cls(
+            model=value.get("model", DEFAULT_MODEL), escalate_to=value.get("escalate_to"),
+            min_confidence=float(min_confidence) if min_confidence is not None else None)
+
+class ModelTiers:
+    """
+    Per-role model configuration. Roles without their own entry use the "default" entry.
+    """
+    def __init__(self, roles: Mapping[str, RoleModelConfig] = {}):
+        self.roles = dict(roles)
+        self.default = self.roles.get(DEFAULT_ROLE, RoleModelConfig())
+
+    def role(self, name: Union[str, None]) -> RoleModelConfig:
+        return self.roles.get(name if name is not None else DEFAULT_ROLE, self.default)
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "ModelTiers":
+        return cls({role: RoleModelConfig.from_value(value) for role, value in data.items()})
+
+    def cost_models(self) -> dict[str, str]:
+        # 役割(エージェント名)ごとの推定コストのモデル。CostTerminationのsource_models
+        return {role: config.cost_model for role, config in self.roles.items() if role != DEFAULT_ROLE}
+
+    def to_dict(self) -> dict[str, Any]:
+        return {role: {"model": config.model, "escalate_to": config.escalate_to, "min_confidence": config.min_confidence}
+                for role, config in self.roles.items()}
+
+def load_model_tiers(source: Union[str, None] = None) -> ModelTiers:
+    # sourceはJSONファイルのパスまたはJSON文字列。Noneの場合は環境変数MODEL_CONFIG。設定がない場合は全ての役割でgpt-4o-mini
+    source = source if source is not None else os.getenv("MODEL_CONFIG")
+    if source is None or source.strip() == "":
+        return ModelTiers()
+    if source.lstrip().startswith("{"):
+        return ModelTiers.from_dict(json.loads(source))
+    with open(source, encoding="utf-8") as f:
+        return ModelTiers.from_dict(json.load(f))
+
+# プロセス全体の設定。最初に使用されたときに読み込む
+_model_tiers: Union[ModelTiers, None] = None
+
+def get_model_tiers() -> ModelTiers:
+    global _model_tiers
+    if _model_tiers is None:
+        _model_tiers = load_model_tiers()
+    return _model_tiers
+
+def estimate_model_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    # MODEL_PRICESにないモデルの料金は0とする
+    if model not in MODEL_PRICES:
+        return 0.0
+    input_price, output_price = MODEL_PRICES[model]
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+def record_model_call(
+        role: str, model: str, prompt_tokens: int, completion_tokens: int, elapsed: float, cached: bool = False,
+        registry: Union[MetricsRegistry, None] = None):
+    # 1回のモデル呼び出し(カスケードの場合は各モデルの呼び出し)を、役割とモデルごとに集計する
+    registry = registry if registry is not None else metrics
+    registry.inc("role_llm_calls_total", role=role, model=model, cached="true" if cached else "false")
+    registry.inc("role_llm_prompt_tokens_total", prompt_tokens, role=role, model=model)
+    registry.inc("role_llm_completion_tokens_total", completion_tokens, role=role, model=model)
+    registry.inc("role_llm_cost_usd_total", estimate_model_cost(model, prompt_tokens, completion_tokens), role=role, model=model)
+    registry.observe("role_llm_latency_seconds", elapsed, role=role, model=model)
+
+def record_escalation(role: str, model: str, reason: str, registry: Union[MetricsRegistry, None] = None):
+    (registry if registry is not None else metrics).inc("model_escalations_total", role=role, model=model, reason=reason)
+
+def result_confidence(result: CreateResult) -> Union[float, None]:
+    # logprobsのトークンの平均確率(幾何平均)。logprobsがない場合はNone
+    if result.logprobs is None or len(result.logprobs) == 0:
+        return None
+    return math.exp(sum([logprob.logprob for logprob in result.logprobs]) / len(result.logprobs))
+
+def escalation_reason(
+        result: CreateResult, tools: Sequence[Tool | ToolSchema], json_output: Any,
+        min_confidence: Union[float, None]) -> Union[str, None]:
+    # 応答を使用できない理由。使用できる場合はNone
+    if isinstance(result.content, str):
+        if json_output:
+            try:
+                json.loads(result.content)
+            except ValueError:
+                return "invalid_json"
+        elif result.content.strip() == "":
+            return "empty"
+    else:
+        names = {tool["name"] if isinstance(tool, dict) else tool.name for tool in tools}
+        for call in result.content:
+            if len(names) > 0 and call.name not in names and not call.name.startswith("transfer_to_"):
+                return "unknown_tool"
+            try:
+                json.loads(call.arguments or "{}")
+            except ValueError:
+                return "invalid_arguments"
+    if min_confidence is not None:
+        confidence = result_confidence(result)
+        if confidence is not None and confidence < min_confidence:
+            return "low_confidence"
+    return None
+
+def _add_usage(usage: RequestUsage, other: RequestUsage) -> RequestUsage:
+    return RequestUsage(
+        prompt_tokens=usage.prompt_tokens + other.prompt_tokens,
+        completion_tokens=usage.completion_tokens + other.completion_tokens)
+
+class TieredChatCompletionClient(ChatCompletionClient):
+    """
+    ChatCompletionClient for one role. Calls are recorded per role and model (role_llm_* metrics, with the estimated cost).
+    With a cascade (more than one tier), the first model is called first and the next one only when
+    escalation_reason() rejects the response; the returned usage is the sum of all the tiers that were called.
+    When streaming, the chunks of a tier that may still be escalated are held back until its response is accepted.
+    """
+    def __init__(
+            self, role: str, tiers: Sequence[tuple[str, ChatCompletionClient]], min_confidence: Union[float, None] = None,
+            registry: Union[MetricsRegistry, None] = None):
+        self.role = role
+        self.tiers = list(tiers)
+        self.min_confidence = min_confidence
+        self.registry = registry if registry is not None else metrics
+        self._actual_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+
+    def _tier_args(self, index: int, extra_create_args: Mapping[str, Any]) -> Mapping[str, Any]:
+        # 確信度で判定する場合は、最後以外のモデルでlogprobsを要求する
+        if self.min_confidence is not None and index < len(self.tiers) - 1:
+            return {**extra_create_args, "logprobs": True}
+        return extra_create_args
+
+    def _check(self, index: int, result: CreateResult, tools: Sequence[Tool | ToolSchema], json_output: Any) -> Union[str, None]:
+        if index == len(self.tiers) - 1:
+            return None
+        return escalation_reason(result, tools, json_output, self.min_confidence)
+
+    def _record(self, model: str, result: CreateResult, elapsed: float):
+        record_model_call(self.role, model, result.usage.prompt_tokens, result.usage.completion_tokens, elapsed, result.cached, self.registry)
+
+    def _finish(self, result: CreateResult, usage: RequestUsage, start: float) -> CreateResult:
+        self.registry.observe("role_latency_seconds", time.perf_counter() - start, role=self.role)
+        self._actual_usage = usage
+        return result if usage == result.usage else result.model_copy(update={"usage": usage})
+
+    async def create(
+            self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = [],
+            tool_choice: Any = "auto", json_output: Optional[Any] = None,
+            extra_create_args: Mapping[str, Any] = {}, cancellation_token: Optional[CancellationToken] = None,
+            ) -> CreateResult:
+        start = time.perf_counter()
+        usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        for index, (model, client) in enumerate(self.tiers):
+            tier_start = time.perf_counter()
+            result = await client.create(
+                messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+                extra_create_args=self._tier_args(index, extra_create_args), cancellation_token=cancellation_token)
+            self._record(model, result, time.perf_counter() - tier_start)
+            usage = _add_usage(usage, result.usage)
+            reason = self._check(index, result, tools, json_output)
+            if reason is None:
+                return self._finish(result, usage, start)
+            record_escalation(self.role, model, reason, self.registry)
+        raise AssertionError("unreachable")
+
+    async def create_stream(
+            self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = [],
+            tool_choice: Any = "auto", json_output: Optional[Any] = None,
+            extra_create_args: Mapping[str, Any] = {}, cancellation_token: Optional[CancellationToken] = None,
+            ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        start = time.perf_counter()
+        usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        for index, (model, client) in enumerate(self.tiers):
+            last = index == len(self.tiers) - 1
+            tier_start = time.perf_counter()
+            held: list[str] = []
+            async for chunk in client.create_stream(
+                    messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+                    extra_create_args=self._tier_args(index, extra_create_args), cancellation_token=cancellation_token):
+                if not isinstance(chunk, CreateResult):
+                    # 最後のモデルのチャンクはそのまま返す
+                    if last:
+                        yield chunk
+                    else:
+                        held.append(chunk)
+                    continue
+                self._record(model, chunk, time.perf_counter() - tier_start)
+                usage = _add_usage(usage, chunk.usage)
+                reason = self._check(index, chunk, tools, json_output)
+                if reason is None:
+                    for text in held:
+                        yield text
+                    yield self._finish(chunk, usage, start)
+                    return
+                record_escalation(self.role, model, reason, self.registry)
+
+    async def close(self) -> None:
+        for _, client in self.tiers:
+            await client.close()
+
+    def actual_usage(self) -> RequestUsage:
+        return self._actual_usage
+
+    def total_usage(self) -> RequestUsage:
+        total = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        for _, client in self.tiers:
+            total = _add_usage(total, client.total_usage())
+        return total
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self.tiers[0][1].count_tokens(messages, tools=tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        # カスケードの全てのモデルに収まるトークン数
+        return min([client.remaining_tokens(messages, tools=tools) for _, client in self.tiers])
+
+    @property
+    def capabilities(self) -> Any:
+        return self.model_info
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self.tiers[0][1].model_info
+
+def create_tiered_client(
+        role: Union[str, None], client_factory: Callable[[str], ChatCompletionClient],
+        tiers: Union[ModelTiers, None] = None) -> TieredChatCompletionClient:
+    # client_factory(モデル名)で、役割の設定の各モデルのクライアントを作成する
+    role = role if role is not None else DEFAULT_ROLE
+    config = (tiers if tiers is not None else get_model_tiers()).role(role)
+    return TieredChatCompletionClient(role, [(model, client_factory(model)) for model in config.models], config.min_confidence)
+
+T = TypeVar("T")
+
+async def run_cascade(
+        role: str, call: Callable[[str], Awaitable[T]], check: Callable[[T], Union[str, None]],
+        tiers: Union[ModelTiers, None] = None) -> T:
+    """
+    Cascade for callers that do not go through a ChatCompletionClient (e.g. the selector_func of
+    selector_group_chat_test_03.py that calls the OpenAI API directly). call(model) makes the request and parses it;
+    a ValueError (e.g. invalid JSON) or a reason returned by check() moves on to the next model.
+    The last model's result (or error) is returned as is.
+    """
+    config = (tiers if tiers is not None else get_model_tiers()).role(role)
+    models = config.models
+    start = time.perf_counter()
+    for index, model in enumerate(models):
+        last = index == len(models) - 1
+        try:
+            value = await call(model)
+        except ValueError:
+            if last:
+                raise
+            record_escalation(role, model, "parse_error")
+            continue
+        reason = None if last else check(value)
+        if reason is None:
+            metrics.observe("role_latency_seconds", time.perf_counter() - start, role=role)
+            return value
+        record_escalation(role, model, reason)
+    raise AssertionError("unreachable")
+
+def role_summary(registry: Union[MetricsRegistry, None] = None) -> list[dict[str, Any]]:
+    # 役割ごとの呼び出し回数、切り替え回数、呼び出し1回あたりの時間(カスケードを含む)、トークン数、推定コスト
+    registry = registry if registry is not None else metrics
+    rows: dict[str, dict[str, Any]] = {}
+
+    def row(role: str) -> dict[str, Any]:
+        return rows.setdefault(role, {
+            "role": role, "models": "", "calls": 0, "model_calls": 0, "escalations": 0,
+            "latency_mean": 0.0, "latency_p50": 0.0, "latency_p99": 0.0,
+            "llm_seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0})
+
+    models: dict[str, set[str]] = {}
+    for name, series in registry.counters.items():
+        for key, value in series.items():
+            labels = dict(key)
+            if "role" not in labels:
+                continue
+            if name == "role_llm_calls_total":
+                row(labels["role"])["model_calls"] += int(value)
+                models.setdefault(labels["role"], set()).add(labels["model"])
+            elif name == "role_llm_prompt_tokens_total":
+                row(labels["role"])["prompt_tokens"] += int(value)
+            elif name == "role_llm_completion_tokens_total":
+                row(labels["role"])["completion_tokens"] += int(value)
+            elif name == "role_llm_cost_usd_total":
+                row(labels["role"])["cost_usd"] += value
+            elif name == "model_escalations_total":
+                row(labels["role"])["escalations"] += int(value)
+    latencies: dict[str, Histogram] = {}
+    for key, histogram in registry.histograms.get("role_latency_seconds", {}).items():
+        role = dict(key)["role"]
+        latencies.setdefault(role, Histogram(histogram.buckets)).merge(histogram)
+    for key, histogram in registry.histograms.get("role_llm_latency_seconds", {}).items():
+        row(dict(key)["role"])["llm_seconds"] += histogram.sum
+    for role, histogram in latencies.items():
+        row(role).update(
+            calls=histogram.count, latency_mean=histogram.sum / histogram.count if histogram.count > 0 else 0.0,
+            latency_p50=histogram.quantile(0.5), latency_p99=histogram.quantile(0.99))
+    for role, names in models.items():
+        row(role)["models"] = ",".join(sorted(names))
+    return sorted(rows.values(), key=lambda item: item["role"])
@@ -0,0 +1,297 @@
+import os, sys, asyncio, gzip, io, json, shutil, time
+from dataclasses import dataclass, asdict
+from typing import Any, Sequence, TextIO, Union
+# autogen
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, ModelClientStreamingChunkEvent
+
+from streaming import StreamPrinter
+from agent_metrics import metrics
+
+# run_streamの出力先(シンク)
+# 各スクリプトのmainはメッセージをシンクに渡すだけで、表示やファイルへの書き込みは各シンクのバックグラウンドのタスクで行う。
+# シンクごとのキューには上限があり、遅いシンクはそのシンクのキューが一杯になった場合のみ呼び出し元を待たせる。
+# ファイルへの書き込みはスレッドで行うため、イベントループ(エージェントの実行)をブロックしない
+
+StreamMessage = Union[BaseAgentEvent, BaseChatMessage, TaskResult]
+
+def get_transcript_output_dir() -> Union[str, None]:
+    # 環境変数RUN_TRANSCRIPT_DIRが設定されている場合は、実行ごとの会話記録をJSONLファイルに出力する
+    # (TRANSCRIPT_DIRはexecute_agentで呼び出したエージェントの会話全体の保存先。result_compaction.py)
+    return os.getenv("RUN_TRANSCRIPT_DIR") or None
+
+def get_transcript_max_bytes() -> int:
+    # 1ファイルの最大バイト数。超えた場合は次のファイルに切り替える
+    return int(os.getenv("RUN_TRANSCRIPT_MAX_BYTES", str(64 * 1024 * 1024)))
+
+def is_transcript_compress_enabled() -> bool:
+    # 環境変数RUN_TRANSCRIPT_COMPRESS=1の場合は、書き込みを終えたファイルをgzipで圧縮する
+    return os.getenv("RUN_TRANSCRIPT_COMPRESS", "0") == "1"
+
+def get_output_queue_size() -> int:
+    # シンクごとのキューの上限(メッセージ数)
+    return int(os.getenv("OUTPUT_QUEUE_SIZE", "1000"))
+
+def is_console_output_enabled() -> bool:
+    # 環境変数OUTPUT_CONSOLE=0の場合はコンソールに表示しない(バッチ実行、サーバーなど)
+    return os.getenv("OUTPUT_CONSOLE", "1") != "0"
+
+@dataclass
+class SinkItem:
+    session: str
+    message: StreamMessage
+    # 受け取った時刻(time.time())と、最初の出力までの時間の計測用の時刻(time.perf_counter())
+    time: float
+    perf_time: float
+    # ストリーミングのチャンクの一部を破棄したメッセージ
+    chunks_dropped: bool = False
+
+def message_record(item: SinkItem) -> dict[str, Any]:
+    # 会話記録の1行。TaskResultは終了理由のみ
+    if isinstance(item.message, TaskResult):
+        return {"session": item.session, "time": item.time, "type": "TaskResult", "stop_reason": item.message.stop_reason}
+    return {"session": item.session, "time": item.time, **item.message.dump()}
+
+class OutputSink:
+    """
+    Destination of run_stream() output. write() receives the items in order, in batches, from the background
+    task of a BufferedSink. Blocking I/O should run in a thread (asyncio.to_thread).
+    """
+    name = "sink"
+
+    async def write(self, items: Sequence[SinkItem]):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+class ConsoleSink(OutputSink):
+    """
+    Prints the messages like StreamPrinter, with one printer per session.
+    Each batch is rendered in memory and written to the file with a single write in a thread.
+    """
+    name = "console"
+
+    def __init__(self, file: TextIO = sys.stdout, show_ttft: Union[bool, None] = None):
+        self.file = file
+        self.show_ttft = show_ttft
+        self._buffer = io.StringIO()
+        self._printers: dict[str, StreamPrinter] = {}
+
+    async def write(self, items: Sequence[SinkItem]):
+        for item in items:
+            if isinstance(item.message, TaskResult):
+                continue
+            printer = self._printers.setdefault(item.session, StreamPrinter(self._buffer))
+            if item.chunks_dropped:
+                printer.discard_streamed(item.message.id)
+            printer.print(item.message, item.perf_time)
+        await self._flush()
+
+    async def _flush(self):
+        text = self._buffer.getvalue()
+        if text == "":
+            return
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        await asyncio.to_thread(self._write_text, text)
+
+    def _write_text(self, text: str):
+        self.file.write(text)
+        self.file.flush()
+
+    async def close(self):
+        for printer in self._printers.values():
+            printer.finish(self.show_ttft)
+        await self._flush()
+
+class JsonlTranscriptSink(OutputSink):
+    """
+    Appends one JSON line per message to <directory>/<prefix>.<n>.jsonl (see message_record()).
+    When a file reaches max_bytes the next one is started; with compress, finished files are
+    gzip-compressed to .jsonl.gz. Streaming chunks are skipped unless include_chunks.
+    """
+    name = "transcript"
+
+    def __init__(self, directory: str, prefix: str, max_bytes: Union[int, None] = None,
+                 compress: Union[bool, None] = None, include_chunks: bool = False):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes if max_bytes is not None else get_transcript_max_bytes()
+        self.compress = compress if compress is not None else is_transcript_compress_enabled()
+        self.include_chunks = include_chunks
+        # 作成したファイル(圧縮した場合は.jsonl.gz)
+        self.paths: list[str] = []
+        self._file = None
+        self._size = 0
+        os.makedirs(directory, exist_ok=True)
+
+    async def write(self, items: Sequence[SinkItem]):
+        if not self.include_chunks:
+            items = [item for item in items if not isinstance(item.message, ModelClientStreamingChunkEvent)]
+        if len(items) > 0:
+            await asyncio.to_thread(self._append, items)
+
+    def _append(self, items: Sequence[SinkItem]):
+        for item in items:
+            if self._file is None:
+                self._open()
+            data = (json.dumps(message_record(item), ensure_ascii=False, default=str) + "\n").encode("utf-8")
+            self._file.write(data)
+            self._size += len(data)
+            if self._size >= self.max_bytes:
+                self._finish_file()
+        if self._file is not None:
+            self._file.flush()
+
+    def _open(self):
+        path = os.path.join(self.directory, f"{self.prefix}.{len(self.paths) + 1:04d}.jsonl")
+        self._file = open(path, "ab")
+        self._size = self._file.tell()
+        self.paths.append(path)
+
+    def _finish_file(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if self.compress:
+            path = self.paths[-1]
+            with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(path)
+            self.paths[-1] = path + ".gz"
+
+    async def close(self):
+        await asyncio.to_thread(self._finish_file)
+
+@dataclass
+class SinkStats:
+    emitted: int = 0
+    written: int = 0
+    # 破棄したストリーミングのチャンク数と、シンクのエラーで書き込めなかったメッセージ数
+    dropped: int = 0
+    errors: int = 0
+    batches: int = 0
+    max_queue_depth: int = 0
+    # キューが一杯で呼び出し元が待った時間と、シンクの書き込み時間
+    blocked_seconds: float = 0.0
+    write_seconds: float = 0.0
+
+class BufferedSink:
+    """
+    Runs an OutputSink in a background task behind a queue of at most max_queue messages.
+    When the queue is full, emit() waits for space (backpressure on the stream consumer only; the agents keep
+    running in the runtime). With overflow="drop_chunks" streaming chunks are dropped instead of waited for,
+    and the complete message is marked so that it is shown in full.
+    A sink that raises is reported once and its messages are counted as errors; the run continues.
+    """
+    def __init__(self, sink: OutputSink, max_queue: Union[int, None] = None, overflow: str = "block", max_batch: int = 100):
+        if overflow not in ("block", "drop_chunks"):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.sink = sink
+        self.overflow = overflow
+        self.max_batch = max_batch
+        self.stats = SinkStats()
+        self._queue: asyncio.Queue[Union[SinkItem, None]] = asyncio.Queue(max_queue if max_queue is not None else get_output_queue_size())
+        self._task: Union[asyncio.Task[None], None] = None
+        # チャンクを破棄したメッセージのid(full_message_id)
+        self._dropped_ids: set[str] = set()
+        self._failed = False
+
+    async def emit(self, message: StreamMessage, session: str = ""):
+        if self._task is None:
+            self._task = asyncio.create_task(self._drain())
+        self.stats.emitted += 1
+        item = SinkItem(session, message, time.time(), time.perf_counter())
+        if isinstance(message, ModelClientStreamingChunkEvent):
+            if self.overflow == "drop_chunks" and self._queue.full():
+                self.stats.dropped += 1
+                metrics.inc("output_sink_messages_total", sink=self.sink.name, outcome="dropped")
+                if message.full_message_id is not None:
+                    self._dropped_ids.add(message.full_message_id)
+                return
+        elif not isinstance(message, TaskResult) and message.id in self._dropped_ids:
+            self._dropped_ids.discard(message.id)
+            item.chunks_dropped = True
+        if self._queue.full():
+            start = time.perf_counter()
+            await self._queue.put(item)
+            blocked = time.perf_counter() - start
+            self.stats.blocked_seconds += blocked
+            metrics.inc("output_sink_blocked_seconds_total", blocked, sink=self.sink.name)
+        else:
+            self._queue.put_nowait(item)
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, self._queue.qsize())
+
+    async def _drain(self):
+        while True:
+            items: list[Union[SinkItem, None]] = [await self._queue.get()]
+            while len(items) < self.max_batch and not self._queue.empty():
+                items.append(self._queue.get_nowait())
+            batch = [item for item in items if item is not None]
+            if len(batch) > 0:
+                await self._write(batch)
+            if None in items:
+                break
+
+    async def _write(self, batch: list[SinkItem]):
+        if self._failed:
+            self.stats.errors += len(batch)
+            return
+        start = time.perf_counter()
+        try:
+            await self.sink.write(batch)
+        except Exception as e:
+            # 以降のメッセージは書き込まない
+            self._failed = True
+            self.stats.errors += len(batch)
+            print(f"output sink {self.sink.name} failed: {e!r}", file=sys.stderr)
+            return
+        elapsed = time.perf_counter() - start
+        self.stats.written += len(batch)
+        self.stats.batches += 1
+        self.stats.write_seconds += elapsed
+        metrics.inc("output_sink_messages_total", len(batch), sink=self.sink.name, outcome="written")
+        metrics.observe("output_sink_write_seconds", elapsed, sink=self.sink.name)
+
+    async def close(self):
+        # キューに残っているメッセージを全て書き込んでから、シンクを閉じる
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+        await self.sink.close()
+
+class FanoutSink:
+    """
+    Sends every message to several BufferedSinks, in order. Each sink has its own queue,
+    so a slow sink only delays emit() once its own queue is full.
+    """
+    def __init__(self, sinks: Sequence[BufferedSink]):
+        self.sinks = list(sinks)
+
+    async def emit(self, message: StreamMessage, session: str = ""):
+        for sink in self.sinks:
+            await sink.emit(message, session)
+
+    async def close(self):
+        await asyncio.gather(*[sink.close() for sink in self.sinks])
+
+    def report(self) -> list[dict[str, Any]]:
+        return [{"sink": sink.sink.name, **asdict(sink.stats)} for sink in self.sinks]
+
+def create_output_sink(
+        script: str, console: Union[bool, None] = None, transcript_dir: Union[str, None] = None) -> FanoutSink:
+    # コンソール(OUTPUT_CONSOLE=0で無効)と、RUN_TRANSCRIPT_DIRが設定されている場合はJSONLの会話記録
+    # scriptは__file__。会話記録のファイル名に使用する
+    sinks: list[BufferedSink] = []
+    if console if console is not None else is_console_output_enabled():
+        # 表示が追いつかない場合は、ストリーミングのチャンクを破棄して完成したメッセージを表示する
+        sinks.append(BufferedSink(ConsoleSink(), overflow="drop_chunks"))
+    transcript_dir = transcript_dir if transcript_dir is not None else get_transcript_output_dir()
+    if transcript_dir is not None:
+        module_name = os.path.splitext(os.path.basename(script))[0]
+        prefix = f"{module_name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        sinks.append(BufferedSink(JsonlTranscriptSink(transcript_dir, prefix)))
+    return FanoutSink(sinks)
@@ -0,0 +1,104 @@
+import os, asyncio, time
+from dataclasses import dataclass
+from typing import AsyncGenerator, Callable, Sequence, Union
+from pydantic import BaseModel, Field
+# autogen
+from autogen_agentchat.base import ChatAgent
+from autogen_agentchat.messages import BaseChatMessage, ModelClientStreamingChunkEvent
+
+from result_compaction import CompactionPolicy, TranscriptStore, compact_transcript
+
+# 複数の作業用エージェントを並列に実行する
+
+# 同時に実行するエージェント数の上限
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("EXECUTE_AGENTS_MAX_CONCURRENCY", "4"))
+
+class AgentTask(BaseModel):
+    agent_name: str = Field(description="Agent name")
+    initial_message: str = Field(description="Input text")
+
+class AgentTaskList(BaseModel):
+    tasks: list[AgentTask] = Field(description="List of tasks. Each task has agent_name and initial_message")
+
+@dataclass
+class AgentExecutionResult:
+    agent_name: str
+    initial_message: str
+    output_text: str
+    # 実行開始から終了までの時間(秒)。同時実行数の上限による待ち時間は含まない
+    elapsed: float
+    error: Union[str, None] = None
+
+async def run_agent_stream(
+        agent: ChatAgent, initial_message: str,
+        compaction: Union[CompactionPolicy, None] = None,
+        store: Union[TranscriptStore, None] = None) -> AsyncGenerator[Union[ModelClientStreamingChunkEvent, str], None]:
+    """
+    Run the agent and yield its streaming chunks as they arrive, then the output text last.
+    Chunks are only produced when the agent was created with model_client_stream=True.
+    The output text is the transcript compacted by compaction (default: get_compaction_policy()),
+    with the full transcript saved in store (see compact_transcript).
+    """
+    output_lines = []
+    async for message in agent.run_stream(task=initial_message):
+        if isinstance(message, ModelClientStreamingChunkEvent):
+            yield message
+        elif isinstance(message, BaseChatMessage):
+            output_lines.append(f"{message.source}(in agent selector): {message.content}") # type: ignore
+    yield compact_transcript(agent.name, output_lines, compaction, store).text
+
+async def run_agent(agent: ChatAgent, initial_message: str) -> str:
+    # エージェントを実行し、メッセージを連結して返す
+    return await run_agent_with_chunks(agent, initial_message)
+
+async def run_agent_with_chunks(
+        agent: ChatAgent, initial_message: str,
+        on_chunk: Union[Callable[[ModelClientStreamingChunkEvent], None], None] = None,
+        compaction: Union[CompactionPolicy, None] = None, store: Union[TranscriptStore, None] = None) -> str:
+    # run_agentと同じ。on_chunkが指定されている場合は、チャンクを受け取るたびに呼び出す
+    output_text = ""
+    async for item in run_agent_stream(agent, initial_message, compaction, store):
+        if isinstance(item, str):
+            output_text = item
+        elif on_chunk is not None:
+            on_chunk(item)
+    return output_text
+
+async def execute_agents_concurrently(
+        agents: Sequence[ChatAgent], tasks: Sequence[tuple[str, str]],
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        on_chunk: Union[Callable[[ModelClientStreamingChunkEvent], None], None] = None,
+        compaction: Union[CompactionPolicy, None] = None, store: Union[TranscriptStore, None] = None) -> list[AgentExecutionResult]:
+    """
+    Run (agent_name, initial_message) pairs concurrently, at most max_concurrency at a time.
+    Results are returned in the order of tasks. Tasks for the same agent run one after another,
+    because an agent keeps its conversation state and cannot run twice at the same time.
+    on_chunk receives the streaming chunks of all tasks as they arrive.
+    compaction and store are passed to run_agent_stream.
+    """
+    agent_dict = {agent.name: agent for agent in agents}
+    semaphore = asyncio.Semaphore(max_concurrency)
+    agent_locks = {name: asyncio.Lock() for name in agent_dict}
+
+    async def run_task(agent_name: str, initial_message: str) -> AgentExecutionResult:
+        agent = agent_dict.get(agent_name)
+        if agent is None:
+            return AgentExecutionResult(agent_name, initial_message, "", 0.0, "The specified agent does not exist.")
+        async with agent_locks[agent_name], semaphore:
+            start = time.perf_counter()
+            try:
+                output_text = await run_agent_with_chunks(agent, initial_message, on_chunk, compaction, store)
+                return AgentExecutionResult(agent_name, initial_message, output_text, time.perf_counter() - start)
+            except Exception as e:
+                return AgentExecutionResult(agent_name, initial_message, "", time.perf_counter() - start, str(e))
+
+    return list(await asyncio.gather(*[run_task(agent_name, initial_message) for agent_name, initial_message in tasks]))
+
+def format_execution_results(results: Sequence[AgentExecutionResult]) -> str:
+    # ツールの戻り値として、タスクの順に各エージェントの出力と実行時間を返す
+    texts = []
+    for i, result in enumerate(results):
+        header = f"[{i + 1}] {result.agent_name} ({result.elapsed:.2f}s)"
+        body = result.error if result.error is not None else result.output_text
+        texts.append(f"{header}\n{body}")
+    return "\n".join(texts)
@@ -0,0 +1,58 @@
+from typing import Any, Sequence, Union
+# autogen
+from autogen_agentchat.base import ChatAgent
+
+from agent_metrics import prefix_cache_tracker
+
+# プロンプトを、エージェントの構成から作成する固定部分(先頭)と、呼び出しごとに変わる部分(会話履歴など)に分ける
+# 固定部分はエージェントの構成ごとに1回だけ作成し、構成が変わるまで同じ文字列を再利用する。
+# 固定部分をsystem_messageとして先頭に置くことで、プロバイダのプロンプトキャッシュ(先頭部分の一致)の対象になる
+
+AgentSignature = tuple[tuple[str, str], ...]
+
+def agent_signature(agents: Sequence[ChatAgent]) -> AgentSignature:
+    return tuple([(agent.name, agent.description) for agent in agents])
+
+class PromptTemplate:
+    """
+    A prompt split into a static prefix and a variable part.
+    The prefix may use {agents_description} ("name: description" lines) and {participants} (comma separated names);
+    it is rendered once per agent set and reused byte-identically until the set changes.
+    The variable part is rendered on every call with the given variables.
+    """
+    def __init__(self, name: str, prefix: str, variable: str = "{history}"):
+        self.name = name
+        self.prefix_template = prefix
+        self.variable_template = variable
+        self._signature: Union[AgentSignature, None] = None
+        self._prefix = ""
+        # 固定部分を作成した回数(エージェントの構成が変わった回数)
+        self.compiled = 0
+
+    def prefix(self, agents: Sequence[ChatAgent]) -> str:
+        signature = agent_signature(agents)
+        if signature != self._signature:
+            self._prefix = self.prefix_template.format(
+                agents_description="\n".join([f"{name}: {description}" for name, description in signature]),
+                participants=", ".join([name for name, _ in signature]),
+            )
+            self._signature = signature
+            self.compiled += 1
+        return self._prefix
+
+    def render(self, **variables: Any) -> str:
+        return self.variable_template.format(**variables)
+
+    def messages(self, agents: Sequence[ChatAgent], agent_name: Union[str, None] = None, **variables: Any) -> list[dict[str, str]]:
+        """
+        OpenAI chat messages: the prefix as the system message, then the variable part as the user message.
+        If agent_name is given, the prompt is recorded in prefix_cache_tracker (for calls not made through
+        MeteredChatCompletionClient, which records its calls itself).
+        """
+        messages = [
+            {"role": "system", "content": self.prefix(agents)},
+            {"role": "user", "content": self.render(**variables)},
+        ]
+        if agent_name is not None:
+            prefix_cache_tracker.observe(agent_name, "\n".join([f"{message['role']}: {message['content']}" for message in messages]))
+        return messages
@@ -0,0 +1,116 @@
+import argparse, json, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+# レート制限の動作確認用の、OpenAI互換の/v1/chat/completionsを返すローカルサーバー
+# 1分あたりのリクエスト数がrpmを超えた場合は、Retry-Afterを付けて429を返す
+
+class StubState:
+    def __init__(self, rpm: float, latency: float, retry_after: float):
+        self.rpm = rpm
+        self.latency = latency
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        # rpm/60の速度で補充されるトークンバケット。容量は1秒分(最低1)
+        self.capacity = max(1.0, rpm / 60)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.requests = 0
+        self.rate_limited = 0
+
+    def try_acquire(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rpm / 60)
+            self.updated = now
+            self.requests += 1
+            if self.tokens < 1:
+                self.rate_limited += 1
+                return False
+            self.tokens -= 1
+            return True
+
+    def reset(self):
+        # 計測ごとに、カウントとバケットを初期状態に戻す
+        with self.lock:
+            self.tokens = self.capacity
+            self.updated = time.monotonic()
+            self.requests = 0
+            self.rate_limited = 0
+
+# OpenAIと同様に、日付付きのモデル名を返す
+RESOLVED_MODELS = {"gpt-4o-mini": "gpt-4o-mini-2024-07-18", "gpt-4o": "gpt-4o-2024-08-06"}
+
+def _completion(body: dict[str, Any]) -> dict[str, Any]:
+    messages = body.get("messages", [])
+    prompt_tokens = sum([len(str(message.get("content", ""))) for message in messages]) // 4
+    return {
+        "id": f"chatcmpl-stub-{time.time_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": RESOLVED_MODELS.get(body.get("model", ""), body.get("model", "gpt-4o-mini")),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "stub response"},
+            "finish_reason": "stop",
+            "logprobs": None,
+        }],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 2, "total_tokens": prompt_tokens + 2},
+    }
+
+def create_handler(state: StubState) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status: int, data: dict[str, Any], headers: dict[str, str] = {}):
+            payload = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", "0"))) or b"{}")
+            if not self.path.endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            if not state.try_acquire():
+                self._send_json(
+                    429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                    {"Retry-After": str(state.retry_after)})
+                return
+            time.sleep(state.latency)
+            self._send_json(200, _completion(body))
+
+        def log_message(self, format: str, *args: Any):
+            # リクエストごとのログは出力しない
+            pass
+
+    return Handler
+
+def start_stub_server(rpm: float = 120, latency: float = 0.05, retry_after: float = 1.0, port: int = 0) -> tuple[ThreadingHTTPServer, StubState, str]:
+    # バックグラウンドのスレッドでサーバーを起動し、(server, state, base_url)を返す。停止はserver.shutdown()
+    state = StubState(rpm, latency, retry_after)
+    server = ThreadingHTTPServer(("127.0.0.1", port), create_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="429を返すOpenAI互換のスタブサーバー")
+    parser.add_argument("--port", type=int, default=8429)
+    parser.add_argument("--rpm", type=float, default=120, help="1分あたりに受け付けるリクエスト数")
+    parser.add_argument("--latency", type=float, default=0.05, help="1リクエストあたりの応答時間(秒)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429応答のRetry-After(秒)")
+    args = parser.parse_args()
+
+    server, state, base_url = start_stub_server(args.rpm, args.latency, args.retry_after, args.port)
+    print(f"OPENAI_BASE_URL={base_url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,371 @@
+import os, asyncio, heapq, itertools, json, random, time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from types import SimpleNamespace
+from typing import Any, AsyncGenerator, Awaitable, Callable, Mapping, Optional, Sequence, TypeVar, Union
+# autogen
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage, ModelInfo, RequestUsage
+from autogen_core.tools import Tool, ToolSchema
+
+# プロセス内の全てのモデル呼び出しで共有するレート制限(リクエスト数/分、トークン数/分)と、429応答時の再試行
+
+# 優先度(小さいほど先に実行する)
+PRIORITY_SELECTOR = 0
+PRIORITY_PLANNER = 1
+PRIORITY_WORKER = 2
+
+T = TypeVar("T")
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute, holding at most capacity tokens.
+    """
+    def __init__(self, rate_per_minute: float, capacity: Union[float, None] = None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # amount個のトークンが使用可能になるまでの時間(秒)。容量を超える要求は容量分で判定する
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate_per_second
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+    def refund(self, amount: float):
+        # 見積もりと実際の使用量の差を戻す(負の場合は追加で消費する)
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+@dataclass
+class RateLimiterStats:
+    requests: int = 0
+    # レート制限またはconcurrencyの上限により待った回数と時間
+    throttled: int = 0
+    wait_seconds: float = 0.0
+    # 429応答の回数と再試行回数
+    rate_limited: int = 0
+    retries: int = 0
+    failures: int = 0
+
+class RateLimiter:
+    """
+    Process-wide limiter for model calls.
+    - requests/min and tokens/min token buckets shared by every caller
+    - adaptive concurrency: the in-flight limit is halved on a 429 and grows by 1/limit on each success (AIMD)
+    - a global pause when a 429 carries Retry-After, so that all callers back off together
+    - priority: waiting calls with a smaller priority value are admitted first (selector before planner before workers)
+    burst_seconds is the bucket capacity in seconds of the rate, so a minute's budget is not sent at once.
+    """
+    def __init__(
+            self, requests_per_minute: float = 500, tokens_per_minute: float = 200000,
+            max_concurrency: int = 32, min_concurrency: int = 1, burst_seconds: float = 1.0):
+        self.requests = TokenBucket(requests_per_minute, max(1.0, requests_per_minute / 60 * burst_seconds))
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60 * burst_seconds)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.stats = RateLimiterStats()
+        self._paused_until = 0.0
+        self._waiters: list[tuple[int, int, float, asyncio.Future[None]]] = []
+        self._sequence = itertools.count()
+        self._wakeup: Union[asyncio.TimerHandle, None] = None
+
+    def _admissible_after(self, tokens: float) -> float:
+        # 先頭の要求を実行できるまでの時間(秒)。concurrencyの上限に達している場合はinf
+        if self.in_flight >= int(self.concurrency_limit):
+            return float("inf")
+        pause = max(0.0, self._paused_until - time.monotonic())
+        return max(pause, self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def _dispatch(self):
+        # 優先度順に、実行可能な要求を開始する
+        self._wakeup = None
+        while len(self._waiters) > 0:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            delay = self._admissible_after(tokens)
+            if delay > 0:
+                if delay != float("inf"):
+                    self._wakeup = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self._start(tokens)
+            future.set_result(None)
+
+    def _start(self, tokens: float):
+        self.requests.consume(1)
+        self.tokens.consume(tokens)
+        self.in_flight += 1
+        self.stats.requests += 1
+
+    async def acquire(self, tokens: float, priority: int = PRIORITY_WORKER):
+        if len(self._waiters) == 0 and self._admissible_after(tokens) == 0:
+            self._start(tokens)
+            return
+        start = time.monotonic()
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), tokens, future))
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 開始済みの場合は枠を返す
+                self.release(0, 0, success=False)
+            raise
+        self.stats.throttled += 1
+        self.stats.wait_seconds += time.monotonic() - start
+
+    def release(self, estimated_tokens: float, actual_tokens: float, rate_limited: bool = False, success: bool = True):
+        # successがFalseの場合(キャンセル、429以外のエラー)はconcurrencyの上限を変えない
+        self.in_flight -= 1
+        self.tokens.refund(estimated_tokens - actual_tokens)
+        if rate_limited:
+            self.concurrency_limit = max(float(self.min_concurrency), self.concurrency_limit / 2)
+        elif success:
+            self.concurrency_limit = min(float(self.max_concurrency), self.concurrency_limit + 1 / self.concurrency_limit)
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._dispatch()
+
+    def pause(self, seconds: float):
+        # Retry-Afterの間、全ての呼び出しを止める
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+def _status_code(error: BaseException) -> Union[int, None]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+def retry_after_seconds(error: BaseException) -> Union[float, None]:
+    # 429応答のRetry-After(秒またはHTTP日付)、retry-after-ms
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers is None:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+def is_retryable(error: BaseException) -> bool:
+    status = _status_code(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    # 接続エラー、タイムアウト
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout")
+
+async def call_with_retry(
+        limiter: RateLimiter, call: Callable[[], Awaitable[T]], estimated_tokens: float,
+        priority: int = PRIORITY_WORKER, usage_tokens: Callable[[T], float] = lambda result: 0,
+        max_retries: int = 6, base_delay: float = 0.5, max_delay: float = 30.0, keep_slot: bool = False) -> T:
+    """
+    Run call() through the limiter. Retryable errors (429, 5xx, connection errors) are retried
+    with jittered exponential backoff, waiting at least Retry-After when the server sends it.
+    With keep_slot, the in-flight slot is not released when call() succeeds; the caller must call limiter.release().
+    """
+    attempt = 0
+    while True:
+        await limiter.acquire(estimated_tokens, priority)
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            limiter.release(estimated_tokens, 0, success=False)
+            raise
+        except Exception as e:
+            rate_limited = _status_code(e) == 429
+            limiter.release(estimated_tokens, 0, rate_limited=rate_limited, success=False)
+            if rate_limited:
+                limiter.stats.rate_limited += 1
+            if not is_retryable(e) or attempt >= max_retries:
+                limiter.stats.failures += 1
+                raise
+            retry_after = retry_after_seconds(e)
+            # フルジッターの指数バックオフ。Retry-Afterが指定されている場合はそれ以上待つ
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            if retry_after is not None:
+                limiter.pause(retry_after)
+                delay = max(delay, retry_after)
+            limiter.stats.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        if not keep_slot:
+            limiter.release(estimated_tokens, usage_tokens(result) or estimated_tokens)
+        return result
+
+def estimate_tokens(characters: int) -> int:
+    # 日本語を含むため、文字数の1/2をトークン数の見積もりとする(実際の使用量は応答後に補正する)
+    return characters // 2
+
+def is_rate_limit_enabled(default: bool = True) -> bool:
+    # 環境変数RATE_LIMITが設定されていない場合はdefault
+    value = os.getenv("RATE_LIMIT")
+    if value is None:
+        return default
+    return value not in ("", "0", "false")
+
+# プロセス全体で共有するRateLimiter
+_rate_limiter: Union[RateLimiter, None] = None
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    Return the process-wide RateLimiter configured with RATE_LIMIT_RPM (default: 500),
+    RATE_LIMIT_TPM (default: 200000) and RATE_LIMIT_MAX_CONCURRENCY (default: 32).
+    """
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter(
+            requests_per_minute=float(os.getenv("RATE_LIMIT_RPM", "500")),
+            tokens_per_minute=float(os.getenv("RATE_LIMIT_TPM", "200000")),
+            max_concurrency=int(os.getenv("RATE_LIMIT_MAX_CONCURRENCY", "32")),
+        )
+    return _rate_limiter
+
+class RateLimitedChatCompletionClient(ChatCompletionClient):
+    """
+    ChatCompletionClient wrapper that sends every request through a RateLimiter with a fixed priority.
+    The token cost is estimated from the message length plus expected_completion_tokens (or max_tokens),
+    and corrected with the actual usage when the response arrives.
+    A streaming request is retried only if it fails before the first chunk, and holds its in-flight slot
+    until the stream is exhausted or closed.
+    """
+    def __init__(
+            self, client: ChatCompletionClient, limiter: RateLimiter, priority: int = PRIORITY_WORKER,
+            expected_completion_tokens: int = 256):
+        self._client = client
+        self.limiter = limiter
+        self.priority = priority
+        self.expected_completion_tokens = expected_completion_tokens
+
+    def _estimate_tokens(self, messages: Sequence[LLMMessage], extra_create_args: Mapping[str, Any]) -> float:
+        # count_tokens()はtiktokenでイベントループを止めるため、文字数から概算する
+        return estimate_tokens(sum([len(str(message.content)) for message in messages])) + \
+            extra_create_args.get("max_tokens", self.expected_completion_tokens)
+
+    async def create(
+            self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = [],
+            tool_choice: Any = "auto", json_output: Optional[Any] = None,
+            extra_create_args: Mapping[str, Any] = {}, cancellation_token: Optional[CancellationToken] = None,
+            ) -> CreateResult:
+        return await call_with_retry(
+            self.limiter,
+            lambda: self._client.create(
+                messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+                extra_create_args=extra_create_args, cancellation_token=cancellation_token),
+            self._estimate_tokens(messages, extra_create_args), self.priority,
+            usage_tokens=lambda result: result.usage.prompt_tokens + result.usage.completion_tokens)
+
+    async def create_stream(
+            self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = [],
+            tool_choice: Any = "auto", json_output: Optional[Any] = None,
+            extra_create_args: Mapping[str, Any] = {}, cancellation_token: Optional[CancellationToken] = None,
+            ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        estimated_tokens = self._estimate_tokens(messages, extra_create_args)
+
+        async def open_stream() -> tuple[Any, Any]:
+            # 最初のチャンクを受け取るまでを再試行の対象とする
+            stream = self._client.create_stream(
+                messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+                extra_create_args=extra_create_args, cancellation_token=cancellation_token)
+            return stream, await stream.__anext__()
+
+        stream, first = await call_with_retry(self.limiter, open_stream, estimated_tokens, self.priority, keep_slot=True)
+        # 生成が終わるまで枠を保持し、最後まで受け取った場合のみ成功としてconcurrencyの上限を増やす
+        actual_tokens = estimated_tokens
+        success = False
+        try:
+            chunk = first
+            while True:
+                if isinstance(chunk, CreateResult):
+                    actual_tokens = chunk.usage.prompt_tokens + chunk.usage.completion_tokens
+                yield chunk
+                try:
+                    chunk = await stream.__anext__()
+                except StopAsyncIteration:
+                    break
+            success = True
+        finally:
+            if not success:
+                # 途中で閉じられた、キャンセルされた場合は、モデルの呼び出しも閉じる
+                await stream.aclose()
+            self.limiter.release(estimated_tokens, actual_tokens, success=success)
+
+    async def close(self) -> None:
+        await self._client.close()
+
+    def actual_usage(self) -> RequestUsage:
+        return self._client.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self._client.total_usage()
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self._client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self._client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> Any:
+        return self._client.capabilities # type: ignore
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._client.model_info
+
+class RateLimitedAsyncOpenAI:
+    """
+    Wraps an AsyncOpenAI client so that chat.completions.create goes through a RateLimiter with a fixed priority.
+    """
+    def __init__(self, client: Any, limiter: RateLimiter, priority: int = PRIORITY_SELECTOR, expected_completion_tokens: int = 64):
+        self._client = client
+        self.limiter = limiter
+        self.priority = priority
+        self.expected_completion_tokens = expected_completion_tokens
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs: Any) -> Any:
+        estimated_tokens = estimate_tokens(len(json.dumps(kwargs.get("messages", []), ensure_ascii=False))) + \
+            kwargs.get("max_tokens", self.expected_completion_tokens)
+
+        def usage_tokens(response: Any) -> float:
+            usage = getattr(response, "usage", None)
+            return getattr(usage, "total_tokens", 0) if usage is not None else 0
+
+        return await call_with_retry(
+            self.limiter, lambda: self._client.chat.completions.create(**kwargs), estimated_tokens, self.priority,
+            usage_tokens=usage_tokens)
+
+    async def close(self) -> None:
+        await self._client.close()
@@ -0,0 +1,220 @@
+import os, re, json, threading, uuid
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Any, Sequence, Union
+
+from rate_limiter import estimate_tokens
+from agent_metrics import metrics
+
+# execute_agentの戻り値(呼び出したエージェントの会話全体)を小さくして、agent_selectorとplannerのコンテキストの増加を抑える
+# 会話全体はTranscriptStoreに保存し、戻り値に含めた参照(get_transcriptツール)で取得できる
+# 圧縮方法と保存先はcreate_agent_toolsで1回だけ決定する(保存先はツールを作成したチャット(セッション)ごと)
+
+# 圧縮方法
+# - "full": 会話全体(以前の動作)
+# - "final": 最後のメッセージのみ
+# - "truncate": 会話全体の先頭と末尾をmax_tokensに収まるように残す
+# - "summary": 会話全体から重要な文を抽出して、max_tokensに収める
+COMPACTION_MODES = ("full", "final", "truncate", "summary")
+
+@dataclass
+class CompactionPolicy:
+    mode: str = "final"
+    # truncate, summaryの最大トークン数(finalの場合は最後のメッセージにも適用する)
+    max_tokens: int = 400
+    # truncateで先頭に残す割合(残りは末尾)
+    head_ratio: float = 0.5
+    # 圧縮した場合に、会話全体の参照を戻り値に含めるか
+    include_reference: bool = True
+
+def get_compaction_policy() -> CompactionPolicy:
+    # 環境変数RESULT_COMPACTION(既定値final)、RESULT_COMPACTION_MAX_TOKENS(既定値400)
+    mode = os.getenv("RESULT_COMPACTION", "final")
+    if mode not in COMPACTION_MODES:
+        raise ValueError(f"RESULT_COMPACTIONは{', '.join(COMPACTION_MODES)}のいずれかを指定してください: {mode}")
+    return CompactionPolicy(mode=mode, max_tokens=int(os.getenv("RESULT_COMPACTION_MAX_TOKENS", "400")))
+
+class TranscriptStore:
+    """
+    Keeps the full transcripts of nested agent executions, retrievable by reference.
+    The latest max_entries transcripts are kept in memory. If directory is given, each transcript
+    is also written to <directory>/<reference>.json and read back when it is no longer in memory.
+    Only the references put in this store can be read, so a store per session does not expose
+    the transcripts of other sessions sharing the directory.
+    """
+    def __init__(self, directory: Union[str, None] = None, max_entries: int = 1000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        # このストアに保存した参照(ファイルから読み込める参照)
+        self._references: set[str] = set()
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, reference: str) -> str:
+        return os.path.join(self.directory, f"{reference}.json") # type: ignore
+
+    def put(self, agent_name: str, transcript: str) -> str:
+        reference = f"transcript-{uuid.uuid4().hex[:12]}"
+        with self._lock:
+            self._entries[reference] = transcript
+            self._references.add(reference)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if self.directory is not None:
+            with open(self._path(reference), "w", encoding="utf-8") as f:
+                json.dump({"reference": reference, "agent_name": agent_name, "transcript": transcript}, f, ensure_ascii=False)
+        return reference
+
+    def get(self, reference: str) -> Union[str, None]:
+        with self._lock:
+            if reference in self._entries:
+                return self._entries[reference]
+            owned = reference in self._references
+        # 参照にパスの区切り文字を含めない
+        if self.directory is None or not owned or not re.fullmatch(r"transcript-[0-9a-f]+", reference):
+            return None
+        try:
+            with open(self._path(reference), encoding="utf-8") as f:
+                return json.load(f)["transcript"]
+        except FileNotFoundError:
+            return None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+def create_transcript_store() -> TranscriptStore:
+    # 環境変数TRANSCRIPT_DIRが設定されている場合は、会話全体をファイルにも保存する
+    return TranscriptStore(os.getenv("TRANSCRIPT_DIR") or None)
+
+@dataclass
+class CompactionStats:
+    results: int = 0
+    # 圧縮前、圧縮後のトークン数の見積もり
+    original_tokens: int = 0
+    compacted_tokens: int = 0
+
+    def record(self, original_tokens: int, compacted_tokens: int):
+        self.results += 1
+        self.original_tokens += original_tokens
+        self.compacted_tokens += compacted_tokens
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.compacted_tokens
+
+    @property
+    def saving_rate(self) -> float:
+        return self.saved_tokens / self.original_tokens if self.original_tokens > 0 else 0.0
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "results": self.results,
+            "original_tokens": self.original_tokens,
+            "compacted_tokens": self.compacted_tokens,
+            "saved_tokens": self.saved_tokens,
+            "saving_rate": self.saving_rate,
+        }
+
+    def reset(self):
+        self.results = 0
+        self.original_tokens = 0
+        self.compacted_tokens = 0
+
+# 全ての圧縮の集計
+total_stats = CompactionStats()
+
+def truncate_to_tokens(text: str, max_tokens: int, head_ratio: float = 0.5) -> str:
+    # estimate_tokensの見積もりでmax_tokensを超える場合は、先頭と末尾を残して中間を省略する
+    max_chars = max_tokens * 2
+    if len(text) <= max_chars:
+        return text
+    head_chars = int(max_chars * head_ratio)
+    tail_chars = max_chars - head_chars
+    omitted = len(text) - head_chars - tail_chars
+    return text[:head_chars] + f"\n…(中略: {omitted}文字)…\n" + (text[-tail_chars:] if tail_chars > 0 else "")
+
+def split_sentences(text: str) -> list[str]:
+    return [sentence.strip() for sentence in re.split(r"(?<=[。！？!?\.])\s*|\n+", text) if sentence.strip() != ""]
+
+def _bigrams(text: str) -> list[str]:
+    text = "".join(text.split())
+    return [text[i:i + 2] for i in range(len(text) - 1)]
+
+def extractive_summary(text: str, max_tokens: int, lead: str = "") -> str:
+    """
+    Select the sentences whose character bigrams are most frequent in the whole text,
+    until max_tokens is reached, and return them in their original order.
+    The sentences of lead (e.g. the start of the final message) are always selected first.
+    """
+    sentences = split_sentences(text)
+    if estimate_tokens(len(text)) <= max_tokens or len(sentences) == 0:
+        return text
+    frequencies = Counter(_bigrams(text))
+
+    def score(sentence: str) -> float:
+        bigrams = _bigrams(sentence)
+        return sum([frequencies[bigram] for bigram in set(bigrams)]) / (len(bigrams) + 1)
+
+    lead_sentences = set(split_sentences(lead))
+    ranked = sorted(range(len(sentences)), key=lambda i: (sentences[i] not in lead_sentences, -score(sentences[i])))
+    selected: list[int] = []
+    tokens = 0
+    selected_texts: set[str] = set()
+    for i in ranked:
+        sentence_tokens = estimate_tokens(len(sentences[i]))
+        # 同じ文は1回のみ含める
+        if tokens + sentence_tokens > max_tokens or sentences[i] in selected_texts:
+            continue
+        selected.append(i)
+        selected_texts.add(sentences[i])
+        tokens += sentence_tokens
+    if len(selected) == 0:
+        return truncate_to_tokens(sentences[ranked[0]], max_tokens)
+    return "\n".join([sentences[i] for i in sorted(selected)])
+
+@dataclass
+class CompactedResult:
+    text: str
+    # 会話全体の参照。圧縮しなかった場合はNone
+    reference: Union[str, None]
+    original_tokens: int
+    compacted_tokens: int
+
+def compact_transcript(
+        agent_name: str, lines: Sequence[str], policy: Union[CompactionPolicy, None] = None,
+        store: Union[TranscriptStore, None] = None) -> CompactedResult:
+    """
+    Build the execute_agent result from the nested transcript lines ("source(in agent selector): content").
+    When the result (with the reference) is smaller than the transcript, the transcript is saved in store
+    and its reference is appended; otherwise the transcript itself is returned.
+    Without a store (no get_transcript tool to read it), no reference is appended.
+    """
+    policy = policy if policy is not None else get_compaction_policy()
+    transcript = "".join([line + "\n" for line in lines])
+    if policy.mode == "final":
+        text = truncate_to_tokens(lines[-1], policy.max_tokens, policy.head_ratio) + "\n" if len(lines) > 0 else ""
+    elif policy.mode == "truncate":
+        text = truncate_to_tokens(transcript, policy.max_tokens, policy.head_ratio)
+    elif policy.mode == "summary":
+        # 最後のメッセージ(回答)の最初の文は必ず含める
+        final_sentences = split_sentences(lines[-1]) if len(lines) > 0 else []
+        text = extractive_summary(transcript, policy.max_tokens, final_sentences[0] if len(final_sentences) > 0 else "") + "\n"
+    else:
+        text = transcript
+
+    reference = None
+    # 参照の行を含めても会話全体より小さくならない場合(短い回答)は、会話全体を返す
+    include_reference = policy.include_reference and store is not None
+    reference_chars = len("[full transcript: get_transcript(\"transcript-000000000000\")]\n") if include_reference else 0
+    if len(text) + reference_chars >= len(transcript):
+        text = transcript
+    elif include_reference and store is not None:
+        reference = store.put(agent_name, transcript)
+        text += f"[full transcript: get_transcript(\"{reference}\")]\n"
+    result = CompactedResult(text, reference, estimate_tokens(len(transcript)), estimate_tokens(len(text)))
+    total_stats.record(result.original_tokens, result.compacted_tokens)
+    metrics.inc("compaction_original_tokens_total", result.original_tokens, agent=agent_name, mode=policy.mode)
+    metrics.inc("compaction_result_tokens_total", result.compacted_tokens, agent=agent_name, mode=policy.mode)
+    return result
@@ -0,0 +1,226 @@
+import hashlib, re, time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Awaitable, Callable, Sequence, Union
+# autogen
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage
+
+from agent_metrics import metrics
+
+if TYPE_CHECKING:
+    # agent_router(numpy)はrouterを使用する場合のみimportされる
+    from agent_router import AgentRouter
+
+# LLMによるエージェント選択の前に、簡単なルールとキャッシュで次の発言者を決定する
+
+Messages = Sequence[BaseAgentEvent | BaseChatMessage]
+LLMSelector = Callable[[Messages], Awaitable[Union[str, None]]]
+SelectionRule = Callable[["SelectionEngine", Messages], Union[str, None]]
+
+@dataclass
+class SelectionStats:
+    # 選択方法ごとの回数(rule:<ルール名>, router, cache, llm, none)
+    counts: dict[str, int] = field(default_factory=dict)
+
+    def record(self, method: str):
+        self.counts[method] = self.counts.get(method, 0) + 1
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    @property
+    def llm_calls(self) -> int:
+        return self.counts.get("llm", 0) + self.counts.get("none", 0)
+
+    @property
+    def avoided_llm_calls(self) -> int:
+        # ルールまたはキャッシュで決定したため、LLMの呼び出しが不要になった回数
+        return self.total - self.llm_calls
+
+    @property
+    def hit_rate(self) -> float:
+        return self.avoided_llm_calls / self.total if self.total > 0 else 0.0
+
+    def reset(self):
+        self.counts.clear()
+
+# 全てのSelectionEngineの集計
+total_stats = SelectionStats()
+
+class DecisionCache:
+    """
+    LRU cache of LLM speaker selections keyed by a hash of the agent names, the task and the recent messages.
+    Each SelectionEngine creates its own cache by default, so concurrent sessions never share decisions.
+    """
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, str] = OrderedDict()
+
+    def get(self, key: str) -> Union[str, None]:
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key: str, agent_name: str):
+        self._entries[key] = agent_name
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+def mention_positions(content: str, agent_names: Sequence[str]) -> dict[str, int]:
+    # contentの中で言及されたエージェント名と、最初に言及された位置(SelectorGroupChatと同様に、_の代わりに空白も許容する)
+    positions = {}
+    for name in agent_names:
+        regex = r"(?<![A-Za-z0-9_])(" + re.escape(name) + "|" + re.escape(name.replace("_", " ")) + r")(?![A-Za-z0-9_])"
+        match = re.search(regex, content)
+        if match is not None:
+            positions[name] = match.start()
+    return positions
+
+def mentioned_agents(content: str, agent_names: Sequence[str]) -> list[str]:
+    # contentの中で言及されたエージェント名(agent_namesの順)
+    return list(mention_positions(content, agent_names).keys())
+
+def planner_alternation_rule(engine: "SelectionEngine", messages: Messages) -> Union[str, None]:
+    # plannerと作業用エージェントが交互に発言する。planner以外の発言の後はplanner
+    if engine.planner_name is None or len(messages) == 0:
+        return None
+    if messages[-1].source != engine.planner_name:
+        return engine.planner_name
+    return None
+
+def mention_rule(engine: "SelectionEngine", messages: Messages) -> Union[str, None]:
+    # plannerの発言で作業用エージェントが1つだけ言及されている場合は、そのエージェント
+    if len(messages) == 0 or messages[-1].source != engine.planner_name:
+        return None
+    mentioned = mentioned_agents(messages[-1].to_text(), engine.worker_names)
+    return mentioned[0] if len(mentioned) == 1 else None
+
+def task_order_rule(engine: "SelectionEngine", messages: Messages) -> Union[str, None]:
+    # plannerの計画(複数のエージェントが言及された発言)の順に、まだ発言していないエージェントを選択
+    if len(messages) == 0 or messages[-1].source != engine.planner_name:
+        return None
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i].source != engine.planner_name:
+            continue
+        positions = mention_positions(messages[i].to_text(), engine.worker_names)
+        if len(positions) < 2:
+            continue
+        # 空白区切りの表記で言及された場合も、一致した位置の順にする
+        plan_order = sorted(positions.keys(), key=lambda name: positions[name])
+        spoken = set([message.source for message in messages[i + 1:]])
+        for name in plan_order:
+            if name not in spoken:
+                return name
+        return None
+    return None
+
+DEFAULT_RULES: list[tuple[str, SelectionRule]] = [
+    ("alternation", planner_alternation_rule),
+    ("mention", mention_rule),
+    ("task_order", task_order_rule),
+]
+
+class SelectionEngine:
+    """
+    Speaker selection that tries cheap rules first, then the local AgentRouter (if given),
+    then an LRU cache of previous LLM decisions of this engine (or of cache, if given),
+    and calls llm_selector only when none of them decides.
+    Pass engine.select as the selector_func of SelectorGroupChat.
+    If llm_selector is None, None is returned so that SelectorGroupChat falls back to its own model based selection;
+    the speaker it chose is read from the next call's messages and stored in the cache.
+    """
+    def __init__(
+            self, agent_names: Sequence[str], planner_name: Union[str, None] = "planner",
+            llm_selector: Union[LLMSelector, None] = None,
+            rules: list[tuple[str, SelectionRule]] = DEFAULT_RULES,
+            cache: Union[DecisionCache, None] = None, use_cache: bool = True, cache_window: int = 4,
+            router: Union["AgentRouter", None] = None, router_threshold: float = 0.5):
+        self.agent_names = list(agent_names)
+        self.planner_name = planner_name if planner_name in self.agent_names else None
+        self.worker_names = [name for name in self.agent_names if name != self.planner_name]
+        self.llm_selector = llm_selector
+        self.rules = rules
+        # cacheが指定されていない場合はこのエンジン(チーム)専用のキャッシュを作成する。use_cache=Falseの場合はキャッシュを使用しない
+        self.cache = (cache if cache is not None else DecisionCache()) if use_cache else None
+        # キャッシュのキーに使用する直近のメッセージ数
+        self.cache_window = cache_window
+        # routerの選択結果の確信度がrouter_threshold未満の場合は、キャッシュまたはLLMで選択する
+        self.router = router
+        self.router_threshold = router_threshold
+        self.stats = SelectionStats()
+        # llm_selectorがNoneの場合に、SelectorGroupChatの選択結果を待っているキャッシュのキー。(キー, メッセージ数, 最後のメッセージのid)
+        self._pending: Union[tuple[str, int, str], None] = None
+
+    def _observe_fallback(self, messages: Messages):
+        # 前回Noneを返した後の最初の新しいメッセージの発言者を、SelectorGroupChatが選択したエージェントとしてキャッシュする
+        # チームがリセットされた場合(前回の最後のメッセージが同じ位置にない場合)は破棄する
+        if self._pending is None:
+            return
+        key, count, last_id = self._pending
+        if len(messages) <= count:
+            return
+        self._pending = None
+        if messages[count - 1].id != last_id:
+            return
+        speaker = messages[count].source
+        if self.cache is not None and speaker in self.agent_names:
+            self.cache.put(key, speaker)
+
+    def _record(self, method: str, started: float):
+        self.stats.record(method)
+        total_stats.record(method)
+        # select()の開始からの時間を、選択方法ごとの選択処理の時間として集計する
+        metrics.observe("selector_latency_seconds", time.perf_counter() - started, method=method)
+
+    def cache_key(self, messages: Messages) -> str:
+        digest = hashlib.sha256()
+        digest.update("\0".join(self.agent_names).encode("utf-8"))
+        # 直近のメッセージが同じでも、タスク(最初のメッセージ)が異なる場合は別のキーにする
+        if len(messages) > 0:
+            digest.update(f"\0{messages[0].source}\0{messages[0].to_text()}".encode("utf-8"))
+        for message in messages[-self.cache_window:]:
+            digest.update(f"\0{message.source}\0{message.to_text()}".encode("utf-8"))
+        return digest.hexdigest()
+
+    async def select(self, messages: Messages) -> Union[str, None]:
+        started = time.perf_counter()
+        self._observe_fallback(messages)
+        for rule_name, rule in self.rules:
+            selected = rule(self, messages)
+            if selected is not None and selected in self.agent_names:
+                self._record(f"rule:{rule_name}", started)
+                return selected
+
+        if self.router is not None and len(messages) > 0:
+            route = self.router.route(messages[-1].to_text())
+            if (route is not None and route.confidence >= self.router_threshold
+                    and route.agent_name in self.agent_names and route.agent_name != messages[-1].source):
+                self._record("router", started)
+                return route.agent_name
+
+        key = self.cache_key(messages)
+        cached = self.cache.get(key) if self.cache is not None else None
+        if cached is not None:
+            self._record("cache", started)
+            return cached
+
+        if self.llm_selector is None:
+            self._record("none", started)
+            if self.cache is not None and len(messages) > 0:
+                self._pending = (key, len(messages), messages[-1].id)
+            return None
+
+        selected = await self.llm_selector(messages)
+        self._record("llm", started)
+        if self.cache is not None and selected is not None and selected in self.agent_names:
+            self.cache.put(key, selected)
+        return selected
@@ -1,63 +1,258 @@
-import os, sys
-from typing import Any
-from dotenv import load_dotenv
+import os, sys, atexit, functools
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Sequence, TypeVar, Union
 # autogen
-from autogen_ext.models.openai import OpenAIChatCompletionClient
-from autogen_core.tools import FunctionTool
+from autogen_core.models import ChatCompletionClient
+from autogen_core.tools import BaseTool
 from autogen_agentchat.agents import AssistantAgent
-from autogen_agentchat.conditions import MaxMessageTermination, TextMentionTermination, TimeoutTermination
+from autogen_agentchat.conditions import MaxMessageTermination, TextMentionTermination, TimeoutTermination, TokenUsageTermination
 from autogen_agentchat.teams import SelectorGroupChat
 from autogen_agentchat.ui import Console
-from autogen_agentchat.base import TaskResult, ChatAgent
+from autogen_agentchat.base import TaskResult, ChatAgent, TerminationCondition
 from autogen_agentchat.messages import BaseChatMessage
-from traceloop.sdk import Traceloop # type: ignore
+
+from agent_registry import AgentRegistry
+from agent_pool import AgentPoolGroup
+from rate_limiter import PRIORITY_SELECTOR, PRIORITY_WORKER
+from streaming import is_streaming_enabled
+from output_sinks import create_output_sink
+from agent_metrics import MeteredChatCompletionClient, RunMetrics, write_metrics_report
+from termination import CostTermination, NoProgressTermination, TaskCompletionTermination, get_token_budget, get_cost_budget, is_no_progress_check_enabled, is_task_completion_check_enabled
+from model_tiers import DEFAULT_MODEL, DEFAULT_ROLE, create_tiered_client, get_model_tiers
+
+# openai, autogen_ext, traceloop, dotenvはimportに時間がかかるため、使用する関数の中でimportする
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from speculation import SpeculativeExecutor
+    from checkpoint import Checkpointer
+
+def is_mock_mode() -> bool:
+    # 環境変数MOCK_MODEL_CLIENTが設定されている場合は、OpenAIの代わりにMockChatCompletionClientを使用する
+    return os.getenv("MOCK_MODEL_CLIENT", "") not in ("", "0", "false")
+
+# init_env()が完了したかどうか
+_env_initialized = False
 
 def init_env():
+    # .envファイルの読み込みはプロセスで1回のみ行う
+    global _env_initialized
+    if _env_initialized:
+        return
+
     # .envファイルから環境変数を読み込む
+    from dotenv import load_dotenv
     dotenv_path = os.environ.get("DOTENV_PATH", None)
     if dotenv_path is None:
         load_dotenv()
     else:
         load_dotenv(dotenv_path)
 
-    key = os.getenv("OPENAI_API_KEY")
-    if key is None:
-        raise ValueError("環境変数：OPENAI_API_KEYが設定されていません")
+    if not is_mock_mode():
+        key = os.getenv("OPENAI_API_KEY")
+        if key is None:
+            raise ValueError("環境変数：OPENAI_API_KEYが設定されていません")
 
-    key = os.getenv("TRACELOOP_API_KEY")
-    if key is None:
-        print("環境変数：TRACELOOP_API_KEYが設定されていません", file=sys.stderr)
+        key = os.getenv("TRACELOOP_API_KEY")
+        if key is None:
+            print("環境変数：TRACELOOP_API_KEYが設定されていません", file=sys.stderr)
+
+    _env_initialized = True
+
+# init_trace()で有効になったトレースの方法(traceloop, local)。無効の場合はNone
+_trace_mode: Union[str, None] = None
 
 def init_trace():
+    """
+    Enable tracing according to TRACE_MODE (see tracing.get_trace_mode()).
+    - traceloop: Traceloop with batched export and head sampling (TRACE_SAMPLE_RATE)
+    - local: spans are collected in memory (and TRACE_FILE) without network access,
+      and the per-agent and per-step latency breakdown is printed to stderr at exit
+    """
+    global _trace_mode
     init_env()
+    import tracing
+    mode = tracing.get_trace_mode()
+    if mode == "local":
+        tracing.init_local_tracing()
+        atexit.register(_print_local_trace)
+        _trace_mode = mode
+        return
     api_key = os.getenv("TRACELOOP_API_KEY")
-    if api_key is None:
+    if mode != "traceloop" or api_key is None:
         # traceloopのAPIキーが設定されていない場合は、トレースを無効にする
         return
 
+    from traceloop.sdk import Traceloop # type: ignore
+    # スパンはバックグラウンドのスレッドでまとめて送信する(キューがいっぱいの場合は破棄する)
     Traceloop.init(
-        disable_batch=True,
-        api_key=api_key
+        disable_batch=False,
+        api_key=api_key,
+        sampler=tracing.create_sampler(),
         )
+    _trace_mode = mode
+
+def _print_local_trace():
+    import tracing
+    tracing.flush_spans()
+    collector = tracing.get_span_collector()
+    if collector is not None:
+        tracing.print_latency_breakdown(collector.records(), file=sys.stderr)
+
+T = TypeVar("T")
+
+def workflow(name: str) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """
+    Lazy version of traceloop's workflow decorator for async functions.
+    traceloop is imported on the first call, and only if init_trace() enabled Traceloop,
+    so importing a script does not import traceloop. With TRACE_MODE=local the call is
+    recorded as a local "workflow <name>" span instead.
+    """
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        traced_func: Union[Callable[..., Awaitable[T]], None] = None
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            nonlocal traced_func
+            if traced_func is None:
+                if _trace_mode == "traceloop":
+                    from traceloop.sdk.decorators import workflow as traceloop_workflow # type: ignore
+                    traced_func = traceloop_workflow(name=name)(func)
+                elif _trace_mode == "local":
+                    import tracing
+                    async def local_traced_func(*args: Any, **kwargs: Any) -> T:
+                        with tracing.workflow_span(name):
+                            return await func(*args, **kwargs)
+                    traced_func = local_traced_func
+                else:
+                    traced_func = func
+            return await traced_func(*args, **kwargs) # type: ignore
+        return wrapper
+    return decorator
     
 # 指定したnameのLLMConfigをDBから取得して、llm_configを返す    
-def create_model_client() -> OpenAIChatCompletionClient:
+# cache_policy: 環境変数LLM_CACHEが設定されている場合に、応答をキャッシュする条件(llm_cache.CachedChatCompletionClientを参照)
+# 指定しない場合は環境変数LLM_CACHE_POLICY(既定値: deterministic)
+# priority: 共有のRateLimiterで待つときの優先度(rate_limiter.PRIORITY_*)。Noneの場合はレート制限しない
+# レート制限は実際のOpenAIでは既定で有効、MockChatCompletionClientでは環境変数RATE_LIMIT=1の場合のみ有効
+# role: selector, planner, agent_selector, 作業用エージェント名など。役割ごとのモデルとカスケードはmodel_tiers.py(環境変数MODEL_CONFIG)で設定する
+# enable_model_client_reuse()の後は、同じ引数で作成したモデルクライアント(OpenAIの接続プール)を再利用する
+def create_model_client(
+        cache_policy: Union[str, None] = None, priority: Union[int, None] = PRIORITY_WORKER,
+        role: Union[str, None] = None) -> ChatCompletionClient:
+    if _reused_model_clients is None:
+        return _create_model_client(cache_policy, priority, role)
+    key = (cache_policy, priority, role)
+    if key not in _reused_model_clients:
+        _reused_model_clients[key] = _create_model_client(cache_policy, priority, role)
+    return _reused_model_clients[key]
+
+# 引数ごとに再利用するモデルクライアント。Noneの場合は呼び出しごとに作成する
+_reused_model_clients: Union[dict[tuple[Union[str, None], Union[int, None], Union[str, None]], ChatCompletionClient], None] = None
+
+def enable_model_client_reuse():
+    # 常駐サービス(agent_service.py)で、チャットごとにモデルクライアントと接続プールを作成しないようにする
+    global _reused_model_clients
+    if _reused_model_clients is None:
+        _reused_model_clients = {}
+
+def _create_model_client(cache_policy: Union[str, None], priority: Union[int, None], role: Union[str, None]) -> ChatCompletionClient:
+    # 役割の設定の各モデル(カスケードの場合は複数)のクライアントを作成し、役割とモデルごとに呼び出しとコストを集計する
+    return create_tiered_client(role, lambda model: create_single_model_client(model, cache_policy, priority))
+
+def create_single_model_client(
+        model: str = DEFAULT_MODEL, cache_policy: Union[str, None] = None,
+        priority: Union[int, None] = PRIORITY_WORKER) -> ChatCompletionClient:
+    # 1つのモデルのクライアント(レート制限とキャッシュを含む)
     init_env()
-    api_key = os.getenv("OPENAI_API_KEY")
-    if api_key is None:
-        raise ValueError("環境変数：OPENAI_API_KEYが設定されていません")
+    from rate_limiter import is_rate_limit_enabled, get_rate_limiter, RateLimitedChatCompletionClient
+    rate_limited = priority is not None and is_rate_limit_enabled(default=not is_mock_mode())
+    client: ChatCompletionClient
+    if is_mock_mode():
+        # MOCK_MODEL_LATENCY: 1回の呼び出しあたりの待ち時間(秒)
+        from mock_model_client import MockChatCompletionClient
+        # モデルごとの待ち時間の違いはmock_model_client.MOCK_MODEL_LATENCY_FACTORS
+        client = MockChatCompletionClient(latency=float(os.getenv("MOCK_MODEL_LATENCY", "0")), model=model)
+    else:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if api_key is None:
+            raise ValueError("環境変数：OPENAI_API_KEYが設定されていません")
 
-    # print(f"autogen llm_config parameters:{parameters}")
-    client = OpenAIChatCompletionClient(
-        api_key=api_key,
-        model="gpt-4o-mini",
-    )
+        # print(f"autogen llm_config parameters:{parameters}")
+        from autogen_ext.models.openai import OpenAIChatCompletionClient
+        client = OpenAIChatCompletionClient(
+            api_key=api_key,
+            model=model,
+            # レート制限する場合は、再試行をRateLimiterで行う
+            max_retries=0 if rate_limited else 2,
+        )
+    if rate_limited:
+        client = RateLimitedChatCompletionClient(client, get_rate_limiter(), priority) # type: ignore
+
+    from llm_cache import get_completion_cache, CachedChatCompletionClient
+    cache = get_completion_cache()
+    if cache_policy is None:
+        cache_policy = os.getenv("LLM_CACHE_POLICY", "deterministic")
+    if cache is not None and cache_policy != "never":
+        return CachedChatCompletionClient(client, cache, model=model, policy=cache_policy)
     return client
 
+# 役割ごとにプロセス全体で共有するモデルクライアント
+_model_clients: dict[str, ChatCompletionClient] = {}
+# 全ての役割で共有する、モデルごとのクライアント(接続プール)
+_shared_model_clients: dict[str, ChatCompletionClient] = {}
+
+def get_model_client(role: Union[str, None] = None) -> ChatCompletionClient:
+    # 最初に使用されたときに、役割(Noneの場合はdefault)の設定のモデルで作成する
+    key = role if role is not None else DEFAULT_ROLE
+    if key not in _model_clients:
+        _model_clients[key] = create_tiered_client(key, _get_shared_model_client)
+    return _model_clients[key]
+
+def _get_shared_model_client(model: str) -> ChatCompletionClient:
+    if model not in _shared_model_clients:
+        _shared_model_clients[model] = create_single_model_client(model)
+    return _shared_model_clients[model]
+
+# プロセス全体で共有する非同期OpenAIクライアント
+_openai_client: Union["AsyncOpenAI", Any, None] = None
+
+def get_openai_client() -> "AsyncOpenAI":
+    """
+    Return the process-wide AsyncOpenAI client.
+    The client is created on first use and keeps one HTTP connection pool,
+    so TCP/TLS connections are reused by every caller on the event loop.
+    The pool size can be set with OPENAI_MAX_CONNECTIONS (default: 100).
+    Requests go through the shared RateLimiter with the selector priority when rate limiting is enabled.
+    """
+    global _openai_client
+    if _openai_client is None:
+        init_env()
+        from rate_limiter import is_rate_limit_enabled, get_rate_limiter, RateLimitedAsyncOpenAI
+        rate_limited = is_rate_limit_enabled(default=not is_mock_mode())
+        if is_mock_mode():
+            from mock_model_client import MockAsyncOpenAI
+            _openai_client = MockAsyncOpenAI(create_single_model_client(cache_policy="never", priority=None)) # type: ignore
+        else:
+            import httpx
+            from openai import AsyncOpenAI
+            max_connections = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            )
+            _openai_client = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=http_client,
+                max_retries=0 if rate_limited else 2,
+            )
+        if rate_limited:
+            _openai_client = RateLimitedAsyncOpenAI(_openai_client, get_rate_limiter(), PRIORITY_SELECTOR)
+    return _openai_client # type: ignore
+
 # 指定したnameのAgentをDBから取得して、Agentを返す
 def create_agent(
         name: str, description: str, system_message:str, 
-        model_client: OpenAIChatCompletionClient, tools: list[FunctionTool] = [], handoffs=[] ) -> AssistantAgent:
+        model_client: ChatCompletionClient, tools: Sequence[BaseTool] = [], handoffs=[],
+        model_client_stream: Union[bool, None] = None, speculation: Union["SpeculativeExecutor", None] = None) -> AssistantAgent:
+    # model_client_streamがNoneの場合は、環境変数MODEL_CLIENT_STREAMが設定されている場合にトークンをストリーミングする
     # AssistantAgentの引数用の辞書を作成
     params: dict[str, Any] = {}
     params["name"] = name
@@ -66,81 +261,185 @@ def create_agent(
     # code_executionがFalseの場合は、AssistantAgentを作成
     params["system_message"] = system_message
     # llm_config_nameが指定されている場合は、llm_config_dictを作成
-    params["model_client"] = model_client
+    # speculationが指定されている場合は、発言者の選択中に投機的に実行した呼び出しの結果を使用できるようにする
+    if speculation is not None:
+        model_client = speculation.wrap(name, model_client)
+    # モデル呼び出しの時間とトークン数を、エージェント名ごとに集計する
+    params["model_client"] = MeteredChatCompletionClient(model_client, name)
     if len(tools) > 0:
         params["tools"] = tools
     if len(handoffs) > 0:
         params["handoffs"] = handoffs
+    params["model_client_stream"] = model_client_stream if model_client_stream is not None else is_streaming_enabled()
 
     return AssistantAgent(**params)
 
-def create_termination_condition(termination_msg: str, max_msg: int, timeout: int):
+def create_termination_condition(
+        termination_msg: str, max_msg: int, timeout: int,
+        worker_names: Union[Sequence[str], None] = None, planner_name: Union[str, None] = "planner",
+        checkpoint: Union["Checkpointer", None] = None) -> TerminationCondition:
     # 終了条件を設定
     # 最大メッセージ数、特定のテキストメッセージ、タイムアウトのいずれかが満たされた場合に終了
     max_msg_termination = MaxMessageTermination(max_messages=max_msg)
     text_termination = TextMentionTermination(termination_msg)
     time_terminarion = TimeoutTermination(timeout)
     combined_termination = max_msg_termination | text_termination | time_terminarion
+    # 環境変数TERMINATION_MAX_TOKENS, TERMINATION_MAX_COSTが設定されている場合は、トークン数、推定コストの上限で終了
+    max_tokens = get_token_budget()
+    if max_tokens is not None:
+        combined_termination |= TokenUsageTermination(max_total_token=max_tokens)
+    max_cost = get_cost_budget()
+    if max_cost is not None:
+        # 推定コストは発言者の役割のモデル(model_tiers.py)の料金で計算する
+        tiers = get_model_tiers()
+        combined_termination |= CostTermination(max_cost, tiers.default.cost_model, tiers.cost_models())
+    # 環境変数TERMINATION_NO_PROGRESSが設定されている場合は、同じ発言者の連続、同じ内容の発言の繰り返し(plannerによる割り当ての再確認など)で終了
+    if is_no_progress_check_enabled():
+        combined_termination |= NoProgressTermination()
+    # plannerが計画した全てのタスクに回答があれば、plannerの次の発言(まとめ)で終了。planner_nameがNoneの場合は判定しない
+    # 計画作成の完了([計画作成完了])前の作業用エージェントの発言は、割り当ての確認への返答として回答に含めない
+    # worker_namesが指定されていない場合は、WORKER_AGENT_SPECSの作業用エージェント
+    # 環境変数TERMINATION_TASK_COMPLETIONが設定されている場合のみ判定する
+    if planner_name is not None and is_task_completion_check_enabled():
+        if worker_names is None:
+            worker_names = [name for name, _, _ in WORKER_AGENT_SPECS]
+        combined_termination |= TaskCompletionTermination(worker_names, planner_name)
+    # checkpointが指定されている場合は、終了条件の判定(ターンの終了)ごとにターンのメッセージと終了理由を保存する
+    if checkpoint is not None:
+        return checkpoint.condition(combined_termination)
     return combined_termination
 
-# モデルクライアントを作成
-model_client = create_model_client()
-
-# テスト用エージェントを作成
-science_researcher = create_agent(
-    name="science_researcher",
-    description="科学知識に関する質問に答えるエージェント",
-    system_message="あなたは科学研究者です。科学に関する質問に答えることができます。",
-    model_client=model_client,
-)
-philosophy_researcher = create_agent(
-    name="philosophy_researcher",
-    description="哲学に関する質問に答えるエージェント",
-    system_message="あなたは哲学研究者です。哲学に関する質問に答えることができます。",
-    model_client=model_client,
-)
-anime_researcher = create_agent(
-    name="anime_researcher",
-    description="アニメに関する質問に答えるエージェント",
-    system_message="あなたはアニメ研究者です。アニメに関する質問に答えることができます。",
-    model_client=model_client,
-)
-
-# plannerエージェント
-planner = create_agent(
-    name="planner",
-    description="ユーザーの要求を達成するための計画を考えて、各エージェントと協力して要求を達成しますト",
-    system_message=""""
-    ユーザーの要求を達成するための計画を考えて、各エージェントと協力して要求を達成します
-    - ユーザーの要求を達成するための計画を作成してタスク一覧を作成します。
-    - タスクの割り当てに問題ないか？もっと効率的な計画およびタスク割り当てがないか？については対象エージェントに確認します。
-    - 計画に基づき、対象のエージェントにタスクを割り当てます。
-    - 計画作成が完了したら[計画作成完了]と返信してください
-    その後、計画に基づきタスクを実行します。全てのタスクが完了したら、[TERMINATE]と返信してください。
-    """,
-    model_client=model_client,
-)
-
-# 作業用エージェントリスト
-worker_agents: list[ChatAgent] =  [science_researcher, philosophy_researcher, anime_researcher]
+async def run_team(
+        chat: Any, task: Union[str, Sequence[BaseChatMessage]], script: str,
+        checkpoint: Union["Checkpointer", None] = None) -> Union[str, None]:
+    """
+    Run a team (or TaskGraphRunner) on task and return the stop reason.
+    Messages go to the output sink of script and to RunMetrics. The sink and the checkpoint are closed
+    even if the run fails, so buffered transcript lines and the checkpoint's end record are written.
+    With a list of messages (checkpoint.py), the run continues from them without emitting them again.
+    """
+    stream = chat.run_stream(task=task) if isinstance(task, str) else chat.run_stream(task=list(task), output_task_messages=False)
+    # 出力はシンク(コンソール、RUN_TRANSCRIPT_DIRが設定されている場合はJSONLの会話記録)のバックグラウンドのタスクで書き込む
+    # ストリーミングが有効な場合は、チャンクを受け取った順に表示する
+    sink = create_output_sink(script)
+    # エージェントごとのトークン数と処理時間を集計する
+    run_metrics = RunMetrics()
+    stop_reason = None
+    try:
+        async for message in stream:
+            run_metrics.observe(message)
+            await sink.emit(message)
+            if type(message) == TaskResult:
+                # TaskResultの場合はチャット終了
+                stop_reason = message.stop_reason
+                break
+    finally:
+        # 終了条件、キャンセル、例外のいずれで終了した場合も、実行中の投機的な呼び出しを破棄する
+        from speculation import cancel_speculation
+        cancel_speculation(chat)
+        # 書き込み待ちのメッセージを全て書き込む
+        await sink.close()
+        if checkpoint is not None:
+            # 書き込み待ちのターンを書き込み、終了理由を記録する
+            await checkpoint.close(stop_reason)
+    # METRICS_OUTPUTが設定されている場合は、集計をJSONとPrometheusのテキスト形式で出力する
+    write_metrics_report()
+    return stop_reason
+
+# テスト用の作業用エージェントの定義(name, description, system_message)
+WORKER_AGENT_SPECS: list[tuple[str, str, str]] = [
+    ("science_researcher", "科学知識に関する質問に答えるエージェント", "あなたは科学研究者です。科学に関する質問に答えることができます。"),
+    ("philosophy_researcher", "哲学に関する質問に答えるエージェント", "あなたは哲学研究者です。哲学に関する質問に答えることができます。"),
+    ("anime_researcher", "アニメに関する質問に答えるエージェント", "あなたはアニメ研究者です。アニメに関する質問に答えることができます。"),
+]
+
+# テスト用の作業用エージェントを作成
+def create_worker_agents(model_client: ChatCompletionClient) -> list[ChatAgent]:
+    return [
+        create_agent(name=name, description=description, system_message=system_message, model_client=model_client)
+        for name, description, system_message in WORKER_AGENT_SPECS
+    ]
+
+# テスト用の作業用エージェントを登録したAgentRegistryを作成。エージェントとモデルクライアントは最初に使用されたときに作成する
+# handoffsが指定されている場合は、回答と同時に指定したエージェントに引き継ぐ(Swarmで作業用エージェントを直接呼び出す場合)
+# model_client_factoryが指定されていない場合は、エージェント名を役割としたget_model_client(name)を使用する
+def create_worker_registry(
+        model_client_factory: Union[Callable[[], ChatCompletionClient], None] = None, handoffs: Sequence[str] = [],
+        speculation: Union["SpeculativeExecutor", None] = None) -> AgentRegistry:
+    registry = AgentRegistry()
+    for name, description, system_message in WORKER_AGENT_SPECS:
+        if len(handoffs) > 0:
+            system_message += f"回答したら、同じ応答で{'または'.join(handoffs)}に引き継いでください。"
+        registry.register(name, description, lambda name=name, description=description, system_message=system_message: create_agent(
+            name=name, description=description, system_message=system_message, model_client=model_client_factory() if model_client_factory is not None else get_model_client(name),
+            handoffs=list(handoffs), speculation=speculation))
+    return registry
+
+# plannerエージェントを作成
+def create_planner(model_client: ChatCompletionClient, speculation: Union["SpeculativeExecutor", None] = None) -> AssistantAgent:
+    return create_agent(
+        name="planner",
+        description="ユーザーの要求を達成するための計画を考えて、各エージェントと協力して要求を達成しますト",
+        system_message=""""
+        ユーザーの要求を達成するための計画を考えて、各エージェントと協力して要求を達成します
+        - ユーザーの要求を達成するための計画を作成してタスク一覧を作成します。
+        - タスクの割り当てに問題ないか？もっと効率的な計画およびタスク割り当てがないか？については対象エージェントに確認します。
+        - 計画に基づき、対象のエージェントにタスクを割り当てます。
+        - 計画作成が完了したら[計画作成完了]と返信してください
+        その後、計画に基づきタスクを実行します。全てのタスクが完了したら、[TERMINATE]と返信してください。
+        """,
+        model_client=model_client,
+        speculation=speculation,
+    )
+
+# テスト用エージェントを登録(エージェントは最初に使用されたときに作成する)
+worker_registry = create_worker_registry()
+
+# execute_agentで使用する作業用エージェントのプール。呼び出しごとにリセットしたエージェントを貸し出す
+worker_pools = AgentPoolGroup(worker_registry)
+
+# プロセス全体で共有するplannerエージェント
+_planner: Union[AssistantAgent, None] = None
+
+def get_planner() -> AssistantAgent:
+    global _planner
+    if _planner is None:
+        _planner = create_planner(get_model_client("planner"))
+    return _planner
+
+# import時には作成せず、モジュール属性として最初に参照されたときに作成するオブジェクト
+_LAZY_ATTRIBUTES: dict[str, Callable[[], Any]] = {
+    # モデルクライアント
+    "model_client": get_model_client,
+    # テスト用エージェント
+    "science_researcher": lambda: worker_registry.get("science_researcher"),
+    "philosophy_researcher": lambda: worker_registry.get("philosophy_researcher"),
+    "anime_researcher": lambda: worker_registry.get("anime_researcher"),
+    # plannerエージェント
+    "planner": get_planner,
+    # 作業用エージェントリスト
+    "worker_agents": worker_registry.agents,
+}
+
+def __getattr__(name: str) -> Any:
+    # from selector_group_chat_test_00 import worker_agents, plannerなどの場合に呼び出される
+    factory = _LAZY_ATTRIBUTES.get(name)
+    if factory is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = factory()
+    # 2回目以降は通常の属性として参照される
+    globals()[name] = value
+    return value
 
 async def main(input_message: str):
     # plannerとworker_agentsによるSelectorGroupChatを作成
     chat = SelectorGroupChat(
-            [science_researcher, philosophy_researcher, anime_researcher, planner],
-            model_client=model_client,
+            worker_registry.agents() + [get_planner()],
+            # 次の発言者の選択に使用したモデル呼び出しは、agent="selector"として集計する
+            model_client=MeteredChatCompletionClient(get_model_client("selector"), "selector"),
             termination_condition=create_termination_condition("[TERMINATE]", 10, 120),
             )
 
     # グループチャットを実行
-    stream = chat.run_stream(task=input_message)
-    # await Console(stream)
-    async for message in stream:
-        if type(message) == TaskResult:
-            # TaskResultの場合はチャット終了
-            break
-        if isinstance(message, BaseChatMessage):
-            # メッセージが返された場合、エージェント名とメッセージを表示
-            message_str = f"{message.source}: {message.content}"
-            print(message_str)
+    await run_team(chat, input_message, __file__)
 
@@ -1,38 +1,62 @@
 import os, sys, asyncio
-from typing import Any
+from typing import Any, Union
 # autogen
+from autogen_agentchat.agents import AssistantAgent
 from autogen_agentchat.teams import SelectorGroupChat
 from autogen_agentchat.ui import Console
 from autogen_agentchat.base import TaskResult
 from autogen_agentchat.messages import BaseChatMessage
-from traceloop.sdk.decorators import workflow # type: ignore
-from selector_group_chat_test_00 import create_model_client, create_termination_condition, init_trace, init_env
-from selector_group_chat_test_00 import worker_agents, planner
+from selector_group_chat_test_00 import create_model_client, create_termination_condition, init_trace, init_env, workflow, run_team
+from selector_group_chat_test_00 import worker_registry, get_planner, get_model_client, create_worker_registry, create_planner
+from rate_limiter import PRIORITY_SELECTOR
+from checkpoint import Checkpointer, create_checkpointer
+from agent_metrics import MeteredChatCompletionClient
+from agent_registry import AgentRegistry
+from speculation import SpeculativeExecutor
 
-@workflow(name=__file__)
-async def main(input_message: str):
-     
-    model_client = create_model_client()
-    agents = worker_agents + [planner]
+def create_chat(
+        registry: Union[AgentRegistry, None] = None, planner: Union[AssistantAgent, None] = None,
+        speculative: bool = False,
+        checkpoint: Union[Checkpointer, None] = None) -> SelectorGroupChat:
+    # speculativeがTrueの場合は、発言者の選択中に予測した次の発言者のモデル呼び出しを開始する
+    # 投機的に実行した結果を受け取れるように、チャット専用のエージェントを作成する
+    # 指定されたエージェントは投機的実行用のクライアントで作成されていないため、registry, plannerとは同時に指定できない
+    if speculative and (registry is not None or planner is not None):
+        raise ValueError("speculative=True builds its own agents; registry and planner cannot be given.")
+    speculation = SpeculativeExecutor() if speculative else None
+    if speculation is not None:
+        registry = create_worker_registry(speculation=speculation)
+        planner = create_planner(get_model_client("planner"), speculation=speculation)
+    # registry, plannerが指定されていない場合は、selector_group_chat_test_00.pyの共有のエージェントを使用
+    registry = registry if registry is not None else worker_registry
+    planner = planner if planner is not None else get_planner()
+    # モデルクライアントを作成。エージェント選択のみに使用するため、LLM_CACHEが設定されている場合は常にキャッシュする
+    model_client = create_model_client(cache_policy="always", priority=PRIORITY_SELECTOR, role="selector")
+    agents = registry.agents() + [planner]
+    if speculation is not None:
+        speculation.attach(agents)
 
     # SelectorGroupChatを作成
     chat = SelectorGroupChat(
             agents,
-            model_client=model_client,
-            termination_condition=create_termination_condition("[TERMINATE]", 10, 120),
+            # 次の発言者の選択に使用したモデル呼び出しは、agent="selector"として集計する
+            model_client=MeteredChatCompletionClient(model_client, "selector"),
+            termination_condition=create_termination_condition("[TERMINATE]", 10, 120, checkpoint=checkpoint),
+            # 投機的実行を開始した後、Noneを返してモデルで選択する
+            selector_func=speculation.selector() if speculation is not None else None,
             )
+    if speculation is not None:
+        speculation.bind(chat)
+    return chat
+
+@workflow(name=__file__)
+async def main(input_message: str):
+    # CHECKPOINT_DIRが設定されている場合は、ターンごとのメッセージを保存する(python checkpoint.py <ファイル>で再開できる)
+    checkpoint = create_checkpointer(__file__, input_message)
+    chat = create_chat(checkpoint=checkpoint)
 
     # グループチャットを実行
-    stream = chat.run_stream(task=input_message)
-    # await Console(stream)
-    async for message in stream:
-        if type(message) == TaskResult:
-            # TaskResultの場合はチャット終了
-            break
-        if isinstance(message, BaseChatMessage):
-            # メッセージが返された場合、エージェント名とメッセージを表示
-            message_str = f"{message.source}: {message.content}"
-            print(message_str)
+    await run_team(chat, input_message, __file__, checkpoint)
 
 if __name__ == '__main__':
     input_message: str = """
@@ -1,52 +1,74 @@
 import os, sys, asyncio
-from typing import Any
-from dotenv import load_dotenv
+from typing import Any, Union
 # autogen
+from autogen_agentchat.agents import AssistantAgent
 from autogen_agentchat.teams import SelectorGroupChat
 from autogen_agentchat.ui import Console
 from autogen_agentchat.base import TaskResult
 from autogen_agentchat.messages import BaseChatMessage
-from traceloop.sdk.decorators import workflow # type: ignore
+from selector_history import HistoryPolicy, SelectorHistoryContext
+from selection_engine import SelectionEngine
 
-from selector_group_chat_test_00 import create_model_client, create_termination_condition, init_trace, init_env
-from selector_group_chat_test_00 import worker_agents, planner
+from selector_group_chat_test_00 import create_model_client, create_termination_condition, init_trace, init_env, workflow, run_team
+from selector_group_chat_test_00 import worker_registry, get_planner
+from rate_limiter import PRIORITY_SELECTOR
+from checkpoint import Checkpointer, create_checkpointer
+from agent_metrics import MeteredChatCompletionClient
+from agent_registry import AgentRegistry
 
-@workflow(name=__file__)
-async def main(input_message: str):
-    # モデルクライアントを作成
-    model_client = create_model_client()
+def create_chat(
+        history_policy: HistoryPolicy | None = HistoryPolicy(), use_selection_engine: bool = False,
+        registry: Union[AgentRegistry, None] = None, planner: Union[AssistantAgent, None] = None,
+        checkpoint: Union[Checkpointer, None] = None) -> SelectorGroupChat:
+    # registry, plannerが指定されていない場合は、selector_group_chat_test_00.pyの共有のエージェントを使用
+    registry = registry if registry is not None else worker_registry
+    planner = planner if planner is not None else get_planner()
+    # モデルクライアントを作成。エージェント選択のみに使用するため、LLM_CACHEが設定されている場合は常にキャッシュする
+    model_client = create_model_client(cache_policy="always", priority=PRIORITY_SELECTOR, role="selector")
+    worker_agents = registry.agents()
     agents = worker_agents + [planner]
 
     # selector_promptでエージェント選択処理をカスタマイズ
+    # {roles}は全てのメンバーで毎回同じになるため、先頭部分が一致するように呼び出しごとに変わる{history}と{participants}(直前の発言者を除く)は末尾に置く
     selector_prompt: str = """
     以下の会話は、ユーザーからの指示に基づいてplannerが計画したタスクを遂行するチームのチャットです。
     チームのメンバー名とその役割は次の通りです。{roles} 
 
-    以下の会話を読んでください。タスクの遂行状況を確認して、次のタスクを遂行するために適切なメンバーを{participants}から選んでください。
+    会話を読んでください。タスクの遂行状況を確認して、次のタスクを遂行するために適切なメンバーを選んでください。
     メンバー名のみを返答してください。
 
         {history}
 
+    上記の会話の次のタスクを遂行するために適切なメンバーを{participants}から選んでください。
     """ 
+    selector_func = None
+    if use_selection_engine:
+        # agent_router(numpy)のimportに時間がかかるため、使用する場合のみimportする
+        from agent_router import AgentRouter
+        selector_func = SelectionEngine([agent.name for agent in agents], router=AgentRouter(registry)).select
+
     # SelectorGroupChatを作成。selector_promptを設定する。
     chat = SelectorGroupChat(
             agents,
-            model_client=model_client,
-            termination_condition=create_termination_condition("[TERMINATE]", 10, 120),
-            selector_prompt=selector_prompt
+            # 次の発言者の選択に使用したモデル呼び出しは、agent="selector"として集計する
+            model_client=MeteredChatCompletionClient(model_client, "selector"),
+            termination_condition=create_termination_condition("[TERMINATE]", 10, 120, checkpoint=checkpoint),
+            selector_prompt=selector_prompt,
+            # {history}に含めるメッセージをhistory_policyで制限する。Noneの場合は全てのメッセージを含める
+            model_context=SelectorHistoryContext(history_policy) if history_policy is not None else None,
+            # ルールとキャッシュで決定できない場合のみ、selector_promptによるLLMの選択を行う
+            selector_func=selector_func,
             )
+    return chat
+
+@workflow(name=__file__)
+async def main(input_message: str):
+    # CHECKPOINT_DIRが設定されている場合は、ターンごとのメッセージを保存する(python checkpoint.py <ファイル>で再開できる)
+    checkpoint = create_checkpointer(__file__, input_message)
+    chat = create_chat(checkpoint=checkpoint)
 
     # グループチャットを実行
-    stream = chat.run_stream(task=input_message)
-    # await Console(stream)
-    async for message in stream:
-        if type(message) == TaskResult:
-            # TaskResultの場合はチャット終了
-            break
-        if isinstance(message, BaseChatMessage):
-           # メッセージが返された場合、エージェント名とメッセージを表示
-            message_str = f"{message.source}: {message.content}"
-            print(message_str)
+    await run_team(chat, input_message, __file__, checkpoint)
 
 if __name__ == '__main__':
     input_message: str = """
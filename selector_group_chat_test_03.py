@@ -1,25 +1,66 @@
-import os, sys, asyncio, json
+import os, sys, asyncio, json, time
 from typing import Any, Sequence, Union
-# openai
-from openai import OpenAI
 # autogen
+from autogen_agentchat.agents import AssistantAgent
 from autogen_agentchat.teams import SelectorGroupChat
 from autogen_agentchat.ui import Console
 from autogen_agentchat.base import TaskResult, ChatAgent
 from autogen_agentchat.messages import BaseChatMessage, ChatMessage, AgentEvent
-from traceloop.sdk.decorators import workflow # type: ignore
 
-from selector_group_chat_test_00 import create_model_client, create_termination_condition, init_trace, init_env
-from selector_group_chat_test_00 import worker_agents, planner
+from selector_group_chat_test_00 import create_model_client, create_single_model_client, create_termination_condition, init_trace, init_env, is_mock_mode, get_openai_client, workflow, run_team
+from selector_group_chat_test_00 import worker_registry, get_planner, get_model_client, create_worker_registry, create_planner
+from rate_limiter import PRIORITY_SELECTOR
+from checkpoint import Checkpointer, create_checkpointer
+from agent_metrics import MeteredChatCompletionClient, prefix_cache_tracker
+from agent_registry import AgentRegistry
+from selector_history import HistoryPolicy, SelectorHistory
+from selection_engine import SelectionEngine
+from llm_cache import get_completion_cache, cached_openai_completion_content
+from agent_router import AgentRouter
+from speculation import SpeculativeExecutor
+from prompt_templates import PromptTemplate
+from model_tiers import get_model_tiers, record_model_call, run_cascade
 
 
-def select_worker_agent(agents: list[ChatAgent], messages: Sequence[AgentEvent | ChatMessage]) -> Union[str, None]:
+# エージェント選択用プロンプト。メンバーと指示の固定部分をsystem_message、会話履歴をuserメッセージにする
+# 固定部分はエージェントの構成が変わるまで再作成しないため、毎回同じ先頭部分になる(プロンプトキャッシュの対象)
+SELECTOR_PROMPT = PromptTemplate(
+    "selector",
+    prefix="""
+    以下の会話は、ユーザーからの指示に基づいてplannerが計画したタスクを遂行するチームのチャットです。
+    チームのメンバー名とその役割は次の通りです。
+{agents_description}
+
+    会話を読んでください。タスクの遂行状況を確認して、次のタスクを遂行するために適切なメンバーを{participants}から選んでください。
+    出力形式はJSONで、{{'member': 'メンバー名'}}としてください。
+    """,
+    variable="""
+    会話:
+        {history}
+    """,
+)
+
+def create_selector_history(
+        messages: Sequence[AgentEvent | ChatMessage], history_cache: Union[SelectorHistory, None] = None) -> str:
+    if history_cache is None:
+        return "\n".join([f"{message.source}: {message.content}" for message in messages])
+    # HistoryPolicyに従って、直近のメッセージと要約のみを含める
+    return history_cache.update(messages)
+
+def create_selector_messages(
+        agents: list[ChatAgent], messages: Sequence[AgentEvent | ChatMessage],
+        history_cache: Union[SelectorHistory, None] = None) -> list[dict[str, str]]:
+    return SELECTOR_PROMPT.messages(agents, "selector", history=create_selector_history(messages, history_cache))
+
+def create_selector_prompt(
+        agents: list[ChatAgent], messages: Sequence[AgentEvent | ChatMessage], history_cache: Union[SelectorHistory, None] = None) -> str:
     """
-    Select the worker agent to respond to the user message.
+    The previous single user message prompt, rebuilt on every call with the history in the middle.
+    It is kept for comparison (stable_prefix=False) in benchmark_prompt_prefix.py and benchmark_selector_history.py.
     """
     roles = "\n".join([agent.name + ":" + agent.description for agent in agents])
     participants = ", ".join([agent.name for agent in agents])
-    history = "\n".join([f"{message.source}: {message.content}" for message in messages])
+    history = create_selector_history(messages, history_cache)
     json_format_sample = {"member": "メンバー名"}
     prompt = f"""
     以下の会話は、ユーザーからの指示に基づいてplannerが計画したタスクを遂行するチームのチャットです。
@@ -30,13 +71,74 @@ def select_worker_agent(agents: list[ChatAgent], messages: Sequence[AgentEvent |
 
         {history}
     """
+    return prompt
+
+def parse_selected_member(content: Union[str, None]) -> Union[str, None]:
+    if content is None:
+        return None
+
+    return json.loads(content).get("member", None)
+
+async def select_worker_agent(
+        agents: list[ChatAgent], messages: Sequence[AgentEvent | ChatMessage],
+        history_cache: Union[SelectorHistory, None] = None, stable_prefix: bool = True) -> Union[str, None]:
+    """
+    Select the worker agent to respond to the user message.
+    The request is awaited on the shared AsyncOpenAI client, so the event loop is not blocked.
+    If history_cache is given, the history in the prompt is bounded by its HistoryPolicy.
+    With stable_prefix, the static part of the prompt is sent first as a system message (SELECTOR_PROMPT).
+    The model is the one configured for the "selector" role (model_tiers.py); with a cascade, invalid JSON
+    or a member that is not one of the agents is retried with the next model.
+    """
+    if stable_prefix:
+        selector_messages = create_selector_messages(agents, messages, history_cache)
+    else:
+        prompt = create_selector_prompt(agents, messages, history_cache)
+        selector_messages = [{"role": "user", "content": prompt}]
+        prefix_cache_tracker.observe("selector", f"user: {prompt}")
+    openai_client = get_openai_client()
+    names = [agent.name for agent in agents]
+
+    async def select_with_model(model: str) -> Union[str, None]:
+        start = time.perf_counter()
+        usages: list[Any] = []
+        # LLM_CACHEが設定されている場合は、同じプロンプトに対する選択結果をキャッシュから返す
+        content = await cached_openai_completion_content(
+            openai_client, get_completion_cache(),
+            on_usage=usages.append,
+            model=model,
+            messages=selector_messages,
+            response_format={"type": "json_object"}
+        )
+        # 役割(selector)とモデルごとに呼び出しとコストを集計する。キャッシュから返した場合はトークン数0
+        prompt_tokens, completion_tokens = (usages[0].prompt_tokens, usages[0].completion_tokens) if len(usages) > 0 else (0, 0)
+        record_model_call("selector", model, prompt_tokens, completion_tokens, time.perf_counter() - start, cached=len(usages) == 0)
+        return parse_selected_member(content)
+
+    # JSONの解析エラー(ValueError)、メンバー以外の名前の場合は、カスケードの次のモデルで選択し直す
+    return await run_cascade(
+        "selector", select_with_model, lambda member: None if member in names else "unknown_member")
+
+def select_worker_agent_sync(
+        agents: list[ChatAgent], messages: Sequence[AgentEvent | ChatMessage],
+        history_cache: Union[SelectorHistory, None] = None) -> Union[str, None]:
+    """
+    Select the worker agent with a blocking OpenAI client.
+    This blocks the event loop during the request. It is kept for comparison in benchmark_event_loop.py.
+    """
+    prompt = create_selector_prompt(agents, messages, history_cache)
     init_env()
-    openai_client = OpenAI(
-        api_key=os.getenv("OPENAI_API_KEY")
-    )
+    if is_mock_mode():
+        from mock_model_client import MockOpenAI
+        openai_client = MockOpenAI(create_single_model_client(cache_policy="never", priority=None)) # type: ignore
+    else:
+        from openai import OpenAI
+        openai_client = OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY")
+        )
 
     response = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
+        model=get_model_tiers().role("selector").model,
         messages=[
             {"role": "user", "content": prompt}
         ],
@@ -44,50 +146,90 @@ def select_worker_agent(agents: list[ChatAgent], messages: Sequence[AgentEvent |
     )
 
     content: Union[str, None] = response.choices[0].message.content
-    if content is None:
-        return None
-
-    return json.loads(content).get("member", None)
+    return parse_selected_member(content)
 
-@workflow(name=__file__)
-async def main(input_message: str):
-    # モデルクライアントを作成
-    model_client = create_model_client()
-    agents = worker_agents + [planner]
+def create_chat(
+        agents: Union[list[ChatAgent], None] = None, blocking_selector: bool = False,
+        history_policy: Union[HistoryPolicy, None] = HistoryPolicy(),
+        use_selection_engine: bool = False,
+        registry: Union[AgentRegistry, None] = None, planner: Union[AssistantAgent, None] = None,
+        speculative: bool = False, stable_prefix: bool = True,
+        checkpoint: Union[Checkpointer, None] = None) -> SelectorGroupChat:
+    # モデルクライアントを作成。エージェント選択のみに使用するため、LLM_CACHEが設定されている場合は常にキャッシュする
+    model_client = create_model_client(cache_policy="always", priority=PRIORITY_SELECTOR, role="selector")
+    # speculativeがTrueの場合は、LLMによる選択中に予測した次の発言者のモデル呼び出しを開始する
+    # 投機的に実行した結果を受け取れるように、チャット専用のエージェントを作成する
+    # 指定されたエージェントは投機的実行用のクライアントで作成されていないため、agents, registry, plannerとは同時に指定できない
+    if speculative and (agents is not None or registry is not None or planner is not None):
+        raise ValueError("speculative=True builds its own agents; agents, registry and planner cannot be given.")
+    speculation = SpeculativeExecutor() if speculative else None
+    if speculation is not None:
+        registry = create_worker_registry(speculation=speculation)
+        planner = create_planner(get_model_client("planner"), speculation=speculation)
+    # create_planner()で作成したplannerの名前
+    planner_name = "planner"
+    # agentsが指定されていない場合は、registryとplanner(指定されていない場合はselector_group_chat_test_00.pyの共有のエージェント)を使用
+    if agents is None:
+        registry = registry if registry is not None else worker_registry
+        agents = registry.agents() + [planner if planner is not None else get_planner()]
+    else:
+        # ルーティングの索引には、指定されたagentsのplanner以外のエージェントを使用する
+        registry = AgentRegistry.from_agents([agent for agent in agents if agent.name != planner_name])
+    selector_agents = agents
+    # エージェント選択用の履歴。history_policyがNoneの場合は全てのメッセージをプロンプトに含める
+    history_cache = SelectorHistory(history_policy) if history_policy is not None else None
     
+    async def llm_selector(messages: Sequence[AgentEvent | ChatMessage]) -> str | None:
+        if blocking_selector:
+            return select_worker_agent_sync(selector_agents, messages, history_cache)
+        return await select_worker_agent(selector_agents, messages, history_cache, stable_prefix)
+    # ルールなどで決定できずにLLMで選択する場合のみ、投機的実行を開始する
+    if speculation is not None:
+        speculation.attach(agents)
+        llm_selector = speculation.selector(llm_selector)
+
+    # ルール(plannerとの交互発言、エージェント名の言及、計画の順序)、TF-IDFによるルーティング、
+    # キャッシュで決定できない場合のみLLMで選択
+    selection_engine = SelectionEngine(
+        [agent.name for agent in agents], planner_name, llm_selector,
+        router=AgentRouter(registry)) if use_selection_engine else None
+
     # selector_funcでエージェント選択処理をカスタマイズ
 
-    def selector_func(messages: Sequence[AgentEvent | ChatMessage]) -> str | None:
+    async def selector_func(messages: Sequence[AgentEvent | ChatMessage]) -> str | None:
+        if selection_engine is not None:
+            selected_agent_name = await selection_engine.select(messages)
         # 最後のメッセージがplannerからのものでない場合、plannerを選択
-        if messages[-1].source != planner.name:
-            return planner.name
+        elif messages[-1].source != planner_name:
+            return planner_name
         else:
-            selected_agent_name = select_worker_agent(agents, messages)
-            # エージェントが選択されなかった場合、plannerを選択
-            if selected_agent_name is None:
-                return planner.name
+            selected_agent_name = await llm_selector(messages)
+        # エージェントが選択されなかった場合、plannerを選択
+        if selected_agent_name is None:
+            return planner_name
 
-            return selected_agent_name
+        return selected_agent_name
 
     # SelectorGroupChatを作成。selector_funcを設定する。
     chat = SelectorGroupChat(
             agents,
-            model_client=model_client,
-            termination_condition=create_termination_condition("[TERMINATE]", 10, 120),
+            # 次の発言者の選択に使用したモデル呼び出しは、agent="selector"として集計する
+            model_client=MeteredChatCompletionClient(model_client, "selector"),
+            termination_condition=create_termination_condition("[TERMINATE]", 10, 120, checkpoint=checkpoint),
             selector_func=selector_func
             )
+    if speculation is not None:
+        speculation.bind(chat)
+    return chat
+
+@workflow(name=__file__)
+async def main(input_message: str):
+    # CHECKPOINT_DIRが設定されている場合は、ターンごとのメッセージを保存する(python checkpoint.py <ファイル>で再開できる)
+    checkpoint = create_checkpointer(__file__, input_message)
+    chat = create_chat(checkpoint=checkpoint)
 
     # グループチャットを実行
-    stream = chat.run_stream(task=input_message)
-    # await Console(stream)
-    async for message in stream:
-        if type(message) == TaskResult:
-            # TaskResultの場合はチャット終了
-            break
-        if isinstance(message, BaseChatMessage):
-            # メッセージが返された場合、エージェント名とメッセージを表示
-            message_str = f"{message.source}: {message.content}"
-            print(message_str)
+    await run_team(chat, input_message, __file__, checkpoint)
 
 if __name__ == '__main__':
     input_message: str = """
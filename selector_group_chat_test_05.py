@@ -1,28 +1,25 @@
 import os, sys, asyncio
-from typing import Any
-from dotenv import load_dotenv
+from typing import Any, Union
 # autogen
 from autogen_agentchat.teams import SelectorGroupChat
 from autogen_agentchat.ui import Console
 from autogen_agentchat.base import TaskResult
 from autogen_agentchat.messages import BaseChatMessage
-from traceloop.sdk.decorators import workflow # type: ignore
+from selector_history import HistoryPolicy, SelectorHistoryContext
+from selection_engine import SelectionEngine
 
-from selector_group_chat_test_00 import create_model_client, create_termination_condition, init_trace, create_agent
-from selector_group_chat_test_00 import worker_agents
+from selector_group_chat_test_00 import create_model_client, create_termination_condition, init_trace, create_agent, workflow, run_team
+from selector_group_chat_test_00 import worker_registry
+from rate_limiter import PRIORITY_PLANNER, PRIORITY_SELECTOR
+from checkpoint import Checkpointer, create_checkpointer
+from agent_metrics import MeteredChatCompletionClient
+from agent_registry import AgentRegistry
+from prompt_templates import PromptTemplate
 
-
-@workflow(name=__file__)
-async def main(input_message: str):
-    # モデルクライアントを作成
-    model_client = create_model_client()
-
-    # plannerエージェント worker_agentsの情報をsystem_messageに追加
-    agents_description = "\n".join([f"{agent.name}: {agent.description}" for agent in worker_agents])
-    planner = create_agent(
-        name="planner",
-        description="ユーザーの要求を達成するための計画を考えて、各エージェントと協力して要求を達成しますト",
-        system_message=f""""
+# plannerのsystem_message。作業用エージェントの一覧は、エージェントの構成が変わった場合のみ作成し直す
+PLANNER_PROMPT = PromptTemplate(
+    "planner",
+    prefix=""""
         ユーザーの要求を達成するための計画を考えて、各エージェントと協力して要求を達成します
         - エージェントが以下の役割を担当します。  
         {agents_description}
@@ -32,6 +29,26 @@ async def main(input_message: str):
         - 計画作成が完了したら[計画作成完了]と返信してください
         その後、計画に基づきタスクを実行します。全てのタスクが完了したら、[TERMINATE]と返信してください。
         """,
+    variable="",
+)
+
+
+def create_chat(
+        history_policy: HistoryPolicy | None = HistoryPolicy(), use_selection_engine: bool = False,
+        registry: Union[AgentRegistry, None] = None,
+        checkpoint: Union[Checkpointer, None] = None) -> SelectorGroupChat:
+    # registryが指定されていない場合は、selector_group_chat_test_00.pyの共有のエージェントを使用
+    registry = registry if registry is not None else worker_registry
+    # plannerと発言者の選択のモデルクライアントを作成(役割ごとのモデルはmodel_tiers.py)
+    model_client = create_model_client(priority=PRIORITY_PLANNER, role="planner")
+    selector_model_client = create_model_client(priority=PRIORITY_SELECTOR, role="selector")
+
+    worker_agents = registry.agents()
+    # plannerエージェント worker_agentsの情報をsystem_messageに追加
+    planner = create_agent(
+        name="planner",
+        description="ユーザーの要求を達成するための計画を考えて、各エージェントと協力して要求を達成しますト",
+        system_message=PLANNER_PROMPT.prefix(worker_agents),
         model_client=model_client,
     )
 
@@ -49,24 +66,33 @@ async def main(input_message: str):
 
     """ 
     
+    selector_func = None
+    if use_selection_engine:
+        # agent_router(numpy)のimportに時間がかかるため、使用する場合のみimportする
+        from agent_router import AgentRouter
+        selector_func = SelectionEngine([agent.name for agent in agents], router=AgentRouter(registry)).select
+
     chat = SelectorGroupChat(
             agents,
-            model_client=model_client,
-            termination_condition=create_termination_condition("[TERMINATE]", 10, 120),
-            selector_prompt=selector_prompt
+            # 次の発言者の選択に使用したモデル呼び出しは、agent="selector"として集計する
+            model_client=MeteredChatCompletionClient(selector_model_client, "selector"),
+            termination_condition=create_termination_condition("[TERMINATE]", 10, 120, checkpoint=checkpoint),
+            selector_prompt=selector_prompt,
+            # {history}に含めるメッセージをhistory_policyで制限する。Noneの場合は全てのメッセージを含める
+            model_context=SelectorHistoryContext(history_policy) if history_policy is not None else None,
+            # ルールとキャッシュで決定できない場合のみ、selector_promptによるLLMの選択を行う
+            selector_func=selector_func,
             )
+    return chat
+
+@workflow(name=__file__)
+async def main(input_message: str):
+    # CHECKPOINT_DIRが設定されている場合は、ターンごとのメッセージを保存する(python checkpoint.py <ファイル>で再開できる)
+    checkpoint = create_checkpointer(__file__, input_message)
+    chat = create_chat(checkpoint=checkpoint)
 
     # グループチャットを実行
-    stream = chat.run_stream(task=input_message)
-    # await Console(stream)
-    async for message in stream:
-        if type(message) == TaskResult:
-            # TaskResultの場合はチャット終了
-            break
-        if isinstance(message, BaseChatMessage):
-           # メッセージが返された場合、エージェント名とメッセージを表示
-            message_str = f"{message.source}: {message.content}"
-            print(message_str)
+    await run_team(chat, input_message, __file__, checkpoint)
 
 if __name__ == '__main__':
     input_message: str = """
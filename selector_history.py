@@ -0,0 +1,163 @@
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, List, Mapping, Sequence
+# autogen
+from autogen_core.model_context import ChatCompletionContext
+from autogen_core.models import FunctionExecutionResultMessage, LLMMessage, SystemMessage, UserMessage
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage
+
+# エージェント選択用プロンプトの{history}を一定の大きさに抑えるための履歴管理
+
+@dataclass
+class HistoryPolicy:
+    # そのまま含める直近のメッセージ数
+    window: int = 10
+    # 常に含める先頭のメッセージ数(ユーザーのタスク)
+    keep_first: int = 1
+    # 1メッセージあたりの最大文字数。超えた部分は省略する
+    max_message_chars: int = 500
+    # ウィンドウから外れたメッセージを要約に含めるか
+    summary: bool = True
+    # 要約に含める1メッセージあたりの文字数
+    summary_chars_per_message: int = 80
+    # 要約全体の最大文字数。超えた場合は古いものから削除する
+    max_summary_chars: int = 1000
+
+def truncate_text(text: str, max_chars: int) -> str:
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    return text[:max_chars] + f"…(以下{len(text) - max_chars}文字省略)"
+
+class SelectorHistory:
+    """
+    The conversation history used in the speaker selection prompt.
+    Messages are appended one by one. The first messages and the last `window` messages are kept
+    (each truncated to `max_message_chars`), and older messages are folded into a rolling summary.
+    The formatted text is cached and updated incrementally, so each call only processes the new messages
+    instead of re-joining the whole thread.
+    """
+    def __init__(self, policy: HistoryPolicy = HistoryPolicy()):
+        self.policy = policy
+        self.clear()
+
+    def clear(self):
+        # 先頭の固定メッセージ
+        self._first: list[tuple[str, str]] = []
+        # 直近のメッセージと、その整形済みテキスト
+        self._window: deque[tuple[str, str]] = deque()
+        self._window_lines: deque[str] = deque()
+        self._window_text = ""
+        # ウィンドウから外れたメッセージの要約
+        self._summary_lines: deque[str] = deque()
+        self._summary_chars = 0
+        self._summary_text: str | None = ""
+        self.omitted_count = 0
+        self.summarized_count = 0
+        # update()で処理済みのメッセージ数と、最後に処理したメッセージのid
+        self._consumed = 0
+        self._last_id: str | None = None
+
+    def append(self, source: str, text: str):
+        entry = (source, truncate_text(text, self.policy.max_message_chars))
+        if len(self._first) < self.policy.keep_first:
+            self._first.append(entry)
+            return
+        line = f"{entry[0]}: {entry[1]}\n"
+        self._window.append(entry)
+        self._window_lines.append(line)
+        self._window_text += line
+        while len(self._window) > self.policy.window:
+            evicted = self._window.popleft()
+            evicted_line = self._window_lines.popleft()
+            self._window_text = self._window_text[len(evicted_line):]
+            self._add_to_summary(evicted)
+
+    def _add_to_summary(self, entry: tuple[str, str]):
+        if not self.policy.summary:
+            self.omitted_count += 1
+            return
+        source, text = entry
+        head = " ".join(text.split())[:self.policy.summary_chars_per_message]
+        line = f"- {source}: {head}\n"
+        self._summary_lines.append(line)
+        self._summary_chars += len(line)
+        self.summarized_count += 1
+        while self._summary_chars > self.policy.max_summary_chars and len(self._summary_lines) > 0:
+            self._summary_chars -= len(self._summary_lines.popleft())
+            self.omitted_count += 1
+        # 要約のテキストは次にformat()が呼ばれたときに作成する
+        self._summary_text = None
+
+    def summary(self) -> str:
+        if self._summary_text is None:
+            header = f"(これまでの会話の要約: {self.summarized_count}件"
+            if self.omitted_count > 0:
+                header += f"、うち古い{self.omitted_count}件は省略"
+            self._summary_text = header + ")\n" + "".join(self._summary_lines)
+        return self._summary_text
+
+    def format(self) -> str:
+        first_text = "".join([f"{source}: {text}\n" for source, text in self._first])
+        return first_text + self.summary() + self._window_text
+
+    def update(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> str:
+        # messagesはselector_funcに渡されるスレッド全体。前回から追加されたメッセージのみを処理する
+        # 前回最後に処理したメッセージが同じ位置にない場合は、チームがリセットされて新しいタスクのスレッドになっているため作り直す
+        # (リセット後の次の呼び出しまでに、スレッドが前回より長くなっている場合がある)
+        if self._consumed > 0 and (len(messages) < self._consumed or messages[self._consumed - 1].id != self._last_id):
+            self.clear()
+        for message in messages[self._consumed:]:
+            self.append(message.source, message.to_text())
+        self._consumed = len(messages)
+        self._last_id = messages[-1].id if len(messages) > 0 else None
+        return self.format()
+
+    def first_entries(self) -> list[tuple[str, str]]:
+        return list(self._first)
+
+    def window_entries(self) -> list[tuple[str, str]]:
+        return list(self._window)
+
+def _llm_message_text(message: LLMMessage) -> str:
+    if isinstance(message, FunctionExecutionResultMessage):
+        return "\n".join([result.content for result in message.content])
+    return message.content if isinstance(message.content, str) else str(message.content)
+
+class SelectorHistoryContext(ChatCompletionContext):
+    """
+    A model context for SelectorGroupChat that applies a HistoryPolicy to the {history} of selector_prompt.
+    Pass it as the model_context argument of SelectorGroupChat.
+    """
+    def __init__(self, policy: HistoryPolicy = HistoryPolicy(), initial_messages: List[LLMMessage] | None = None):
+        super().__init__(initial_messages)
+        self._history = SelectorHistory(policy)
+        for message in self._messages:
+            self._append_to_history(message)
+
+    def _append_to_history(self, message: LLMMessage):
+        if isinstance(message, SystemMessage):
+            return
+        source = getattr(message, "source", "tool")
+        self._history.append(source, _llm_message_text(message))
+
+    async def add_message(self, message: LLMMessage) -> None:
+        await super().add_message(message)
+        self._append_to_history(message)
+
+    async def get_messages(self) -> List[LLMMessage]:
+        messages: List[LLMMessage] = [
+            UserMessage(content=text, source=source) for source, text in self._history.first_entries()]
+        if self._history.summarized_count > 0:
+            messages.append(UserMessage(content=self._history.summary(), source="summary"))
+        messages.extend([UserMessage(content=text, source=source) for source, text in self._history.window_entries()])
+        return messages
+
+    async def clear(self) -> None:
+        await super().clear()
+        self._history.clear()
+
+    async def load_state(self, state: Mapping[str, Any]) -> None:
+        await super().load_state(state)
+        self._history.clear()
+        for message in self._messages:
+            self._append_to_history(message)
@@ -0,0 +1,365 @@
+import asyncio, time, weakref
+from importlib.metadata import version
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Awaitable, Callable, Mapping, Optional, Sequence, Union
+# autogen
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage, ModelInfo, RequestUsage
+from autogen_core.tools import Tool, ToolSchema
+from autogen_agentchat.agents import AssistantAgent
+from autogen_agentchat.base import ChatAgent
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, HandoffMessage
+
+from llm_cache import make_cache_key, _tool_schema, _json_output_key
+from selection_engine import SelectionEngine
+from agent_metrics import metrics
+
+# SelectorGroupChatの次の発言者の投機的実行
+# 発言者の選択(LLM呼び出し)と並行して、予測した次の発言者のモデル呼び出しを開始する。
+# 選択された発言者が予測と一致し、かつ実際のリクエストが投機的に実行したリクエストと完全に一致する場合のみ結果を使用し、
+# それ以外の場合は投機的な呼び出しをキャンセルして破棄する(会話の内容は投機的実行の有無で変わらない)
+
+Messages = Sequence[BaseAgentEvent | BaseChatMessage]
+
+# 投機的なリクエストの作成に使用するAssistantAgentの内部の属性(autogen-agentchat 0.7。requirements.txtでバージョンを固定している)
+ASSISTANT_AGENT_ATTRIBUTES = ("_system_messages", "_workbench", "_handoff_tools", "_output_content_type")
+
+def check_assistant_agent(agent: AssistantAgent):
+    # autogen-agentchatの更新で内部の属性が変わった場合は、リクエストが一致しないまま投機的な呼び出しを続けないようにエラーにする
+    missing = [name for name in ASSISTANT_AGENT_ATTRIBUTES if not hasattr(agent, name)]
+    if not callable(getattr(AssistantAgent, "_get_compatible_context", None)):
+        missing.append("_get_compatible_context")
+    if len(missing) > 0:
+        raise RuntimeError(
+            f"SpeculativeExecutor does not support autogen-agentchat {version('autogen-agentchat')}: "
+            f"AssistantAgent has no {', '.join(missing)}.")
+
+@dataclass
+class SpeculationStats:
+    # 投機的に開始した呼び出し数、使用した数、破棄した数、予測できずに開始しなかった数
+    speculations: int = 0
+    hits: int = 0
+    misses: int = 0
+    skipped: int = 0
+    # 破棄した呼び出しのトークン数(キャンセルした場合の出力は0。入力は見積もり)
+    wasted_prompt_tokens: int = 0
+    wasted_completion_tokens: int = 0
+    # 使用した呼び出しで、選択の完了を待たずに開始したことで短縮した時間
+    saved_seconds: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        resolved = self.hits + self.misses
+        return self.hits / resolved if resolved > 0 else 0.0
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "speculations": self.speculations,
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "hit_rate": self.hit_rate,
+            "wasted_prompt_tokens": self.wasted_prompt_tokens,
+            "wasted_completion_tokens": self.wasted_completion_tokens,
+            "saved_seconds": self.saved_seconds,
+        }
+
+    def reset(self):
+        self.speculations = 0
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.wasted_prompt_tokens = 0
+        self.wasted_completion_tokens = 0
+        self.saved_seconds = 0.0
+
+# 全ての投機的実行の集計
+total_stats = SpeculationStats()
+
+class TransitionHistory:
+    """
+    Counts the observed speaker transitions (previous speaker -> next speaker)
+    and predicts the most frequent next speaker.
+    """
+    def __init__(self):
+        self._counts: dict[str, Counter[str]] = {}
+
+    def record(self, previous: str, next_speaker: str):
+        self._counts.setdefault(previous, Counter())[next_speaker] += 1
+
+    def predict(self, previous: str) -> Union[str, None]:
+        counts = self._counts.get(previous)
+        if counts is None or len(counts) == 0:
+            return None
+        return counts.most_common(1)[0][0]
+
+    def clear(self):
+        self._counts.clear()
+
+# チャット間で共有する発言者の遷移の履歴
+shared_transition_history = TransitionHistory()
+
+# チームごとのSpeculativeExecutor(SpeculativeExecutor.bind()で登録する)
+_team_executors: "weakref.WeakKeyDictionary[Any, SpeculativeExecutor]" = weakref.WeakKeyDictionary()
+
+def cancel_speculation(team: Any):
+    # チームの実行が終了した場合(終了条件、タイムアウト、キャンセル、例外)に、実行中の投機的な呼び出しを破棄する
+    executor = _team_executors.get(team)
+    if executor is not None:
+        executor.cancel()
+
+def request_key(
+        messages: Sequence[LLMMessage], tools: Sequence[Tool | ToolSchema], tool_choice: Any,
+        json_output: Any, extra_create_args: Mapping[str, Any]) -> str:
+    return make_cache_key({
+        "messages": [message.model_dump(mode="json") for message in messages],
+        "tools": [_tool_schema(tool) for tool in tools],
+        "tool_choice": tool_choice.name if isinstance(tool_choice, Tool) else tool_choice,
+        "json_output": _json_output_key(json_output),
+        "extra_create_args": dict(extra_create_args),
+    })
+
+def messages_since_last_turn(agent_name: str, thread: Messages) -> list[BaseChatMessage]:
+    # ChatAgentContainerがエージェントに渡すメッセージ(エージェントの前回の発言以降の、他の発言者のチャットメッセージ)
+    new_messages: list[BaseChatMessage] = []
+    for message in reversed(thread):
+        if not isinstance(message, BaseChatMessage):
+            continue
+        if message.source == agent_name:
+            break
+        new_messages.append(message)
+    return list(reversed(new_messages))
+
+@dataclass
+class _Speculation:
+    agent_name: str
+    key: str
+    started: float
+    prompt_tokens: int
+    task: Union["asyncio.Task[CreateResult]", None] = None
+    # 投機的な呼び出しが完了した時刻
+    finished: Union[float, None] = None
+
+    async def run(self, client: ChatCompletionClient, messages: list[LLMMessage], tools: list[Tool | ToolSchema], json_output: Any) -> CreateResult:
+        result = await client.create(messages, tools=tools, json_output=json_output)
+        self.finished = time.perf_counter()
+        return result
+
+class SpeculativeChatCompletionClient(ChatCompletionClient):
+    """
+    ChatCompletionClient wrapper of one agent, created by SpeculativeExecutor.wrap().
+    A request identical to the running speculative request of the agent takes its result;
+    any other request cancels the speculation and is sent to the wrapped client.
+    """
+    def __init__(self, client: ChatCompletionClient, agent_name: str, executor: "SpeculativeExecutor"):
+        self._client = client
+        self.agent_name = agent_name
+        self.executor = executor
+
+    async def create(
+            self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = [],
+            tool_choice: Any = "auto", json_output: Optional[Any] = None,
+            extra_create_args: Mapping[str, Any] = {}, cancellation_token: Optional[CancellationToken] = None,
+            ) -> CreateResult:
+        key = request_key(messages, tools, tool_choice, json_output, extra_create_args)
+        result = await self.executor.claim(self.agent_name, key)
+        if result is not None:
+            return result
+        return await self._client.create(
+            messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+            extra_create_args=extra_create_args, cancellation_token=cancellation_token)
+
+    async def create_stream(
+            self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = [],
+            tool_choice: Any = "auto", json_output: Optional[Any] = None,
+            extra_create_args: Mapping[str, Any] = {}, cancellation_token: Optional[CancellationToken] = None,
+            ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        key = request_key(messages, tools, tool_choice, json_output, extra_create_args)
+        result = await self.executor.claim(self.agent_name, key)
+        if result is not None:
+            # 投機的に実行した応答は1つのチャンクとして返す
+            text = result.content if isinstance(result.content, str) else (result.thought or "")
+            if len(text) > 0:
+                yield text
+            yield result
+            return
+        async for chunk in self._client.create_stream(
+                messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+                extra_create_args=extra_create_args, cancellation_token=cancellation_token):
+            yield chunk
+
+    async def close(self) -> None:
+        await self._client.close()
+
+    def actual_usage(self) -> RequestUsage:
+        return self._client.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self._client.total_usage()
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self._client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self._client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> Any:
+        return self._client.capabilities # type: ignore
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._client.model_info
+
+class SpeculativeExecutor:
+    """
+    Starts the model call of the predicted next speaker while the speaker selection is running.
+    The next speaker is predicted with the SelectionEngine rules, then with the transition history.
+    Agents must be created with a client from wrap(), and registered with attach().
+    Register the team with bind() so that cancel_speculation(team) discards the running speculation when the run ends.
+    Only one speculation runs at a time; it is resolved by the next model call of any wrapped client.
+    """
+    def __init__(
+            self, planner_name: Union[str, None] = "planner",
+            history: TransitionHistory = shared_transition_history, stats: Union[SpeculationStats, None] = None):
+        self.planner_name = planner_name
+        self.history = history
+        self.stats = stats if stats is not None else SpeculationStats()
+        self._clients: dict[str, SpeculativeChatCompletionClient] = {}
+        self._agents: dict[str, AssistantAgent] = {}
+        self._engine: Union[SelectionEngine, None] = None
+        self._pending: Union[_Speculation, None] = None
+        # 投機的実行を開始した時点の最後の発言者(遷移の履歴の記録に使用する)
+        self._previous_speaker: Union[str, None] = None
+
+    def wrap(self, agent_name: str, client: ChatCompletionClient) -> SpeculativeChatCompletionClient:
+        wrapped = SpeculativeChatCompletionClient(client, agent_name, self)
+        self._clients[agent_name] = wrapped
+        return wrapped
+
+    def attach(self, agents: Sequence[ChatAgent]):
+        # wrap()したクライアントを使用するAssistantAgentのみ投機的に実行する
+        self._agents = {
+            agent.name: agent for agent in agents if isinstance(agent, AssistantAgent) and agent.name in self._clients}
+        for agent in self._agents.values():
+            check_assistant_agent(agent)
+        self._engine = SelectionEngine([agent.name for agent in agents], self.planner_name, use_cache=False)
+
+    def bind(self, team: Any):
+        _team_executors[team] = self
+
+    def predict(self, thread: Messages) -> Union[str, None]:
+        chat_messages = [message for message in thread if isinstance(message, BaseChatMessage)]
+        if self._engine is not None:
+            for _, rule in self._engine.rules:
+                selected = rule(self._engine, chat_messages)
+                if selected is not None:
+                    return selected
+        if len(chat_messages) == 0:
+            return None
+        return self.history.predict(chat_messages[-1].source)
+
+    async def _build_request(self, agent: AssistantAgent, thread: Messages) -> tuple[list[LLMMessage], list[Tool | ToolSchema], Any]:
+        # AssistantAgent._call_llm()と同じリクエストを作成する(autogen-agentchat 0.7のAssistantAgentの内部の属性を参照する。attach()で確認済み)
+        # 作成方法が異なる場合はリクエストが一致せず、投機的な呼び出しが破棄されるのみ
+        context = list(await agent.model_context.get_messages())
+        for message in messages_since_last_turn(agent.name, thread):
+            if isinstance(message, HandoffMessage):
+                context.extend(message.context)
+            context.append(message.to_model_message())
+        messages = list(AssistantAgent._get_compatible_context(self._clients[agent.name], agent._system_messages + context))
+        tools: list[Tool | ToolSchema] = [tool for workbench in agent._workbench for tool in await workbench.list_tools()]
+        tools += agent._handoff_tools
+        return messages, tools, agent._output_content_type
+
+    async def start(self, thread: Messages):
+        # 前回の投機的実行が残っている場合は破棄する
+        self.cancel()
+        chat_messages = [message for message in thread if isinstance(message, BaseChatMessage)]
+        self._previous_speaker = chat_messages[-1].source if len(chat_messages) > 0 else None
+        predicted = self.predict(thread)
+        agent = self._agents.get(predicted) if predicted is not None else None
+        if agent is None:
+            self.stats.skipped += 1
+            total_stats.skipped += 1
+            return
+        messages, tools, json_output = await self._build_request(agent, thread)
+        client = self._clients[agent.name]
+        speculation = _Speculation(
+            agent.name, request_key(messages, tools, "auto", json_output, {}),
+            time.perf_counter(), client.count_tokens(messages, tools=tools))
+        speculation.task = asyncio.create_task(speculation.run(client._client, messages, tools, json_output))
+        self._pending = speculation
+        self.stats.speculations += 1
+        total_stats.speculations += 1
+
+    async def claim(self, agent_name: str, key: str) -> Union[CreateResult, None]:
+        # wrap()したクライアントのモデル呼び出し。発言者の選択が完了して、agent_nameが発言している
+        if self._previous_speaker is not None:
+            self.history.record(self._previous_speaker, agent_name)
+            self._previous_speaker = None
+        speculation = self._pending
+        if speculation is None:
+            return None
+        self._pending = None
+        if speculation.agent_name != agent_name or speculation.key != key:
+            self._discard(speculation)
+            return None
+        claimed = time.perf_counter()
+        try:
+            result = await speculation.task # type: ignore
+        except Exception:
+            # 投機的な呼び出しが失敗した場合は、通常の呼び出しを行う
+            self._record_miss(speculation, None)
+            return None
+        # 通常はclaimedから呼び出しを開始するため、開始から完了(またはclaimed)までの時間を短縮した
+        saved = min(claimed, speculation.finished or claimed) - speculation.started
+        self.stats.hits += 1
+        self.stats.saved_seconds += saved
+        total_stats.hits += 1
+        total_stats.saved_seconds += saved
+        metrics.inc("speculation_total", agent=agent_name, outcome="hit")
+        metrics.inc("speculation_saved_seconds_total", saved, agent=agent_name)
+        return result
+
+    def _discard(self, speculation: _Speculation):
+        result = None
+        task = speculation.task
+        if task is not None and task.done() and not task.cancelled() and task.exception() is None:
+            result = task.result()
+        elif task is not None:
+            task.cancel()
+        self._record_miss(speculation, result)
+
+    def _record_miss(self, speculation: _Speculation, result: Union[CreateResult, None]):
+        # キャンセルした場合も入力のトークンは消費したとみなす
+        prompt_tokens = result.usage.prompt_tokens if result is not None else speculation.prompt_tokens
+        completion_tokens = result.usage.completion_tokens if result is not None else 0
+        for stats in (self.stats, total_stats):
+            stats.misses += 1
+            stats.wasted_prompt_tokens += prompt_tokens
+            stats.wasted_completion_tokens += completion_tokens
+        metrics.inc("speculation_total", agent=speculation.agent_name, outcome="miss")
+        metrics.inc("speculation_wasted_tokens_total", prompt_tokens + completion_tokens, agent=speculation.agent_name)
+
+    def cancel(self):
+        # 実行中の投機的な呼び出しを破棄する(チャットの終了時など)
+        if self._pending is not None:
+            self._discard(self._pending)
+            self._pending = None
+
+    def selector(
+            self, selector: Union[Callable[[Messages], Awaitable[Union[str, None]]], None] = None,
+            ) -> Callable[[Messages], Awaitable[Union[str, None]]]:
+        """
+        Wrap a selector (e.g. an LLM based selector) so that the speculation starts before it runs.
+        Without selector, the returned function returns None, so SelectorGroupChat selects with its model;
+        pass it as selector_func.
+        """
+        async def speculative_selector(messages: Messages) -> Union[str, None]:
+            await self.start(messages)
+            if selector is None:
+                return None
+            return await selector(messages)
+        return speculative_selector
@@ -0,0 +1,33 @@
+import sys, math
+from typing import Any, Sequence, TextIO
+
+# 集計結果を表示するための共通関数(ライブラリとベンチマークの両方から使う)
+
+def percentile(values: Sequence[float], p: float) -> float:
+    # 線形補間によるパーセンタイル(pは0〜100)
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    if lower == upper:
+        return ordered[lower]
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def mean(values: Sequence[float]) -> float:
+    return sum(values) / len(values) if len(values) > 0 else 0.0
+
+def format_value(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.4f}"
+    return str(value)
+
+def print_table(rows: list[dict[str, Any]], columns: list[str], file: TextIO = sys.stdout):
+    # rowsをcolumnsの順に表形式で表示
+    cells = [[format_value(row.get(column, "")) for column in columns] for row in rows]
+    widths = [max([len(column)] + [len(cell[i]) for cell in cells]) for i, column in enumerate(columns)]
+    print("  ".join([column.ljust(width) for column, width in zip(columns, widths)]), file=file)
+    print("  ".join(["-" * width for width in widths]), file=file)
+    for cell in cells:
+        print("  ".join([value.ljust(width) for value, width in zip(cell, widths)]), file=file)
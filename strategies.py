@@ -0,0 +1,23 @@
+from typing import Any
+
+# オーケストレーション方法の一覧(benchmark_strategies.py, agent_service.pyで使用)
+# 各スクリプトのimportは行わないため、MOCK_MODEL_CLIENTなどの環境変数を設定する前にimportできる
+
+# エージェント選択方法ごとのスクリプトとcreate_chat()の引数。各スクリプトはcreate_chat()を定義している
+STRATEGIES: dict[str, tuple[str, dict[str, Any]]] = {
+    "default_selector": ("selector_group_chat_test_01", {}),
+    "default_selector+speculative": ("selector_group_chat_test_01", {"speculative": True}),
+    "selector_prompt": ("selector_group_chat_test_02", {}),
+    "selector_prompt+rules": ("selector_group_chat_test_02", {"use_selection_engine": True}),
+    "selector_func": ("selector_group_chat_test_03", {"use_selection_engine": False}),
+    "selector_func+speculative": ("selector_group_chat_test_03", {"use_selection_engine": False, "speculative": True}),
+    "selector_func+rules": ("selector_group_chat_test_03", {"use_selection_engine": True}),
+    "agent_selector_tools": ("selector_group_chat_test_04", {"parallel_execution": False}),
+    "agent_selector_tools+parallel": ("selector_group_chat_test_04", {"parallel_execution": True}),
+    "prebriefed_planner": ("selector_group_chat_test_05", {}),
+    "prebriefed_planner+rules": ("selector_group_chat_test_05", {"use_selection_engine": True}),
+    "swarm": ("swarm_test_01", {"parallel_execution": False}),
+    "swarm+parallel": ("swarm_test_01", {"parallel_execution": True}),
+    "swarm_direct": ("swarm_test_02", {}),
+    "task_graph": ("task_graph_test_01", {}),
+}
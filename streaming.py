@@ -0,0 +1,144 @@
+import os, sys, time
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Callable, TextIO, Type, Union
+from pydantic import BaseModel
+# autogen
+from autogen_core import CancellationToken
+from autogen_core.tools import BaseStreamTool
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, ModelClientStreamingChunkEvent, ThoughtEvent
+
+from stats_utils import percentile, print_table
+
+# モデルクライアントのトークンストリーミングを、run_streamの呼び出し元まで伝える
+
+def is_streaming_enabled() -> bool:
+    # 環境変数MODEL_CLIENT_STREAMが設定されている場合は、create_agentで作成するエージェントの応答をストリーミングする
+    return os.getenv("MODEL_CLIENT_STREAM", "") not in ("", "0", "false")
+
+@dataclass
+class AgentTTFT:
+    # ターンの開始から、最初の出力(チャンクまたはメッセージ)までの時間(秒)
+    first_output: list[float] = field(default_factory=list)
+    # ターンの開始から、メッセージが完成するまでの時間(秒)
+    complete: list[float] = field(default_factory=list)
+
+class TTFTRecorder:
+    """
+    Measures time-to-first-output per agent from a run_stream() message sequence.
+    A turn starts at the previous non-chunk event (the previous message, a tool call request, ...) or at start(),
+    and its first output is the first ModelClientStreamingChunkEvent of a message or the complete message.
+    Chunks are grouped by full_message_id, so concurrent nested streams are measured separately.
+    Without streaming the first output is the complete message, so both modes can be compared.
+    """
+    def __init__(self):
+        self.agents: dict[str, AgentTTFT] = {}
+        self.start()
+
+    def start(self):
+        self._last_boundary = time.perf_counter()
+        # ストリーミング中のメッセージのidと、そのターンの開始時刻
+        self._started: dict[str, float] = {}
+
+    def observe(self, message: BaseAgentEvent | BaseChatMessage, now: Union[float, None] = None):
+        # nowはメッセージを受け取った時刻(time.perf_counter())。バッファ付きのシンクで後から表示する場合に指定する
+        now = now if now is not None else time.perf_counter()
+        if isinstance(message, ModelClientStreamingChunkEvent):
+            key = message.full_message_id or message.source
+            if key not in self._started:
+                self._started[key] = self._last_boundary
+                self.agents.setdefault(message.source, AgentTTFT()).first_output.append(now - self._last_boundary)
+            return
+        if isinstance(message, BaseChatMessage) and message.source != "user":
+            stats = self.agents.setdefault(message.source, AgentTTFT())
+            started = self._started.pop(message.id, self._started.pop(message.source, None))
+            if started is None:
+                # ストリーミングしていないメッセージ
+                started = self._last_boundary
+                stats.first_output.append(now - started)
+            stats.complete.append(now - started)
+        self._last_boundary = now
+
+    def report(self) -> list[dict[str, Any]]:
+        return [{
+            "agent": name,
+            "turns": len(stats.first_output),
+            "ttft_p50": percentile(stats.first_output, 50),
+            "ttft_p99": percentile(stats.first_output, 99),
+            # 完成したメッセージが届かないエージェント(execute_agentから呼び出されたエージェント)は空欄
+            "complete_p50": percentile(stats.complete, 50) if len(stats.complete) > 0 else "",
+            "complete_p99": percentile(stats.complete, 99) if len(stats.complete) > 0 else "",
+        } for name, stats in self.agents.items()]
+
+class StreamPrinter:
+    """
+    Prints run_stream() output: streaming chunks as they arrive, and complete messages
+    only if their text was not already printed as chunks (matched by full_message_id).
+    """
+    def __init__(self, file: TextIO = sys.stdout):
+        self.file = file
+        self.ttft = TTFTRecorder()
+        # チャンクを表示中の発言者
+        self._streaming_source: Union[str, None] = None
+        # チャンクで表示済みのメッセージのid
+        self._streamed_ids: set[str] = set()
+
+    def _end_line(self):
+        if self._streaming_source is not None:
+            print(file=self.file, flush=True)
+            self._streaming_source = None
+
+    def discard_streamed(self, message_id: str):
+        # チャンクの一部を表示していないメッセージ(OutputSinkで破棄した場合)は、完成したメッセージを表示する
+        self._streamed_ids.discard(message_id)
+
+    def print(self, message: BaseAgentEvent | BaseChatMessage, now: Union[float, None] = None):
+        self.ttft.observe(message, now)
+        if isinstance(message, ModelClientStreamingChunkEvent):
+            if message.source != self._streaming_source:
+                self._end_line()
+                print(f"{message.source}: ", end="", file=self.file)
+                self._streaming_source = message.source
+            print(message.content, end="", file=self.file, flush=True)
+            if message.full_message_id is not None:
+                self._streamed_ids.add(message.full_message_id)
+        elif isinstance(message, (BaseChatMessage, ThoughtEvent)):
+            # ThoughtEventはツール呼び出しと同時に返されたテキスト(Swarmで回答と同時に引き継ぐ場合など)
+            self._end_line()
+            if message.id in self._streamed_ids:
+                # チャンクで表示済み
+                self._streamed_ids.discard(message.id)
+                return
+            # メッセージが返された場合、エージェント名とメッセージを表示
+            print(f"{message.source}: {message.content}", file=self.file) # type: ignore
+
+    def finish(self, show_ttft: Union[bool, None] = None):
+        # show_ttftがNoneの場合は、ストリーミングが有効な場合のみ最初の出力までの時間を標準エラーに表示する
+        self._end_line()
+        if show_ttft is None:
+            show_ttft = is_streaming_enabled()
+        rows = self.ttft.report()
+        if show_ttft and len(rows) > 0:
+            print_table(rows, list(rows[0].keys()), file=sys.stderr)
+
+class StreamFunctionTool(BaseStreamTool[BaseModel, BaseAgentEvent | BaseChatMessage, str]):
+    """
+    Tool backed by an async generator function that takes the validated arguments model,
+    yields events while it runs and yields the return text last.
+    AssistantAgent forwards the events to its own run_stream() while the tool is running.
+    """
+    def __init__(
+            self, func: Callable[[Any], AsyncGenerator[Union[BaseAgentEvent, BaseChatMessage, str], None]],
+            args_type: Type[BaseModel], name: str, description: str):
+        self._func = func
+        super().__init__(args_type=args_type, return_type=str, name=name, description=description)
+
+    async def run(self, args: BaseModel, cancellation_token: CancellationToken) -> str:
+        result = ""
+        async for item in self._func(args):
+            if isinstance(item, str):
+                result = item
+        return result
+
+    async def run_stream(self, args: BaseModel, cancellation_token: CancellationToken) -> AsyncGenerator[Union[BaseAgentEvent, BaseChatMessage, str], None]:
+        async for item in self._func(args):
+            yield item
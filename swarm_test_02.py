@@ -0,0 +1,46 @@
+import os, sys, asyncio
+from typing import Union
+
+
+# autogen
+from autogen_agentchat.teams import Swarm
+from autogen_agentchat.ui import Console
+from autogen_agentchat.base import TaskResult
+
+from selector_group_chat_test_00 import get_model_client, create_termination_condition, create_worker_registry, init_trace, workflow, run_team
+from checkpoint import Checkpointer, create_checkpointer
+from swarm_topology import create_direct_swarm_participants
+
+
+def create_chat(checkpoint: Union[Checkpointer, None] = None) -> Swarm:
+    # 作業用エージェントは回答後にplannerに引き継ぐため、共有のworker_registryではなくチャットごとに作成する
+    registry = create_worker_registry(handoffs=["planner"])
+    # plannerのモデルクライアントを取得(作業用エージェントはエージェント名の役割のモデル)
+    model_client = get_model_client("planner")
+
+    # plannerと作業用エージェントが直接引き継ぐSwarmを作成
+    chat = Swarm(
+        participants=create_direct_swarm_participants(registry, model_client),
+        termination_condition=create_termination_condition("TERMINATE", 100, 300, worker_names=registry.names(), checkpoint=checkpoint)
+    )
+    return chat
+
+@workflow(name=__file__)
+async def main(input_message: str):
+    # CHECKPOINT_DIRが設定されている場合は、ターンごとのメッセージを保存する(python checkpoint.py <ファイル>で再開できる)
+    checkpoint = create_checkpointer(__file__, input_message)
+    chat = create_chat(checkpoint=checkpoint)
+
+    # グループチャットを実行
+    await run_team(chat, input_message, __file__, checkpoint)
+
+if __name__ == '__main__':
+    input_message: str = """
+    宇宙について、以下の観点で情報をまとめてください
+    * 宇宙の成り立ち
+    * 哲学的な視点からの宇宙
+    * 宇宙に関するアニメ
+    """
+    init_trace()
+
+    asyncio.run(main(input_message))
@@ -0,0 +1,57 @@
+import weakref
+from typing import Sequence
+# autogen
+from autogen_core.models import ChatCompletionClient
+from autogen_agentchat.base import ChatAgent, Handoff
+
+from agent_registry import AgentRegistry
+from selector_group_chat_test_00 import create_agent
+
+# Swarmの参加者を、plannerと登録された作業用エージェントの直接の引き継ぎで構成する
+# agent_selectorを経由しない(list_agents, execute_agentの呼び出しと、agent_selectorへの引き継ぎが不要になる)
+
+PLANNER_SYSTEM_MESSAGE = """
+ユーザーの要求を達成するための計画を考えて、各エージェントにタスクを引き継いで要求を達成します
+- 引き継ぎ可能なエージェントは以下の通りです。
+{agent_directory}
+- ユーザーの要求を達成するための計画を作成してタスク一覧を作成します。各タスクの担当エージェントを記載してください。
+- 計画作成が完了したら[計画作成完了]と返信してください
+その後、計画に基づき、タスクを担当するエージェントに1つずつ引き継ぎます。エージェントは回答後にあなたに引き継ぎます。
+全てのタスクが完了したら、各エージェントの回答をまとめて[TERMINATE]と返信してください。
+"""
+
+# registryごとのエージェント一覧のテキスト。(registry.version, テキスト)
+_directory_cache: "weakref.WeakKeyDictionary[AgentRegistry, tuple[int, str]]" = weakref.WeakKeyDictionary()
+
+def format_agent_directory(registry: AgentRegistry) -> str:
+    # list_agentsの戻り値と同じ内容を、plannerのsystem_messageに含めるテキストにする。registryが変更されるまで再作成しない
+    cached = _directory_cache.get(registry)
+    if cached is not None and cached[0] == registry.version:
+        return cached[1]
+    text = "\n".join([f"  - {spec['name']}: {spec['description']}" for spec in registry.descriptions()])
+    _directory_cache[registry] = (registry.version, text)
+    return text
+
+def create_planner_handoffs(registry: AgentRegistry) -> list[Handoff]:
+    # 登録された作業用エージェントごとの引き継ぎ(transfer_to_<name>)
+    return [
+        Handoff(target=spec["name"], description=f"{spec['description']}({spec['name']})にタスクを引き継ぎます。")
+        for spec in registry.descriptions()
+    ]
+
+def create_direct_swarm_participants(
+        registry: AgentRegistry, model_client: ChatCompletionClient, planner_name: str = "planner",
+        planner_system_message: str = PLANNER_SYSTEM_MESSAGE) -> Sequence[ChatAgent]:
+    """
+    Build the Swarm participants [planner, *workers] with direct handoffs between the planner and the registered workers.
+    The planner's system message contains the agent directory, so no list_agents call is needed.
+    The workers must be registered with handoffs=[planner_name] (create_worker_registry(handoffs=...)).
+    """
+    planner = create_agent(
+        name=planner_name,
+        description="ユーザーの要求を達成するための計画を考えて、各エージェントにタスクを引き継ぎます",
+        system_message=planner_system_message.format(agent_directory=format_agent_directory(registry)),
+        model_client=model_client,
+        handoffs=create_planner_handoffs(registry),
+    )
+    return [planner, *registry.agents()]
@@ -0,0 +1,214 @@
+import asyncio, json, re, time
+from dataclasses import dataclass
+from typing import AsyncGenerator, Sequence, Union
+from pydantic import BaseModel, Field
+# autogen
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient
+from autogen_agentchat.agents import AssistantAgent
+from autogen_agentchat.base import ChatAgent, TaskResult
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, ModelClientStreamingChunkEvent, TextMessage
+
+from selector_group_chat_test_00 import create_agent
+from parallel_execution import DEFAULT_MAX_CONCURRENCY
+
+# plannerが作成したタスクグラフ(タスクと依存関係)を、LLMによるエージェント選択なしで実行する
+
+class GraphTask(BaseModel):
+    id: str = Field(description="Task id")
+    agent_name: str = Field(description="Name of the worker agent that executes the task")
+    input: str = Field(description="Input text for the worker agent")
+    depends_on: list[str] = Field(default_factory=list, description="Ids of the tasks whose outputs this task needs")
+
+class TaskGraph(BaseModel):
+    tasks: list[GraphTask]
+
+    def validate_graph(self, agent_names: Sequence[str]):
+        # タスクidの重複、存在しないエージェント、存在しない依存先、循環依存を確認
+        ids = [task.id for task in self.tasks]
+        if len(ids) != len(set(ids)):
+            raise ValueError("タスクidが重複しています")
+        for task in self.tasks:
+            if task.agent_name not in agent_names:
+                raise ValueError(f"存在しないエージェントが指定されています: {task.agent_name}")
+            for dependency in task.depends_on:
+                if dependency not in ids:
+                    raise ValueError(f"存在しないタスクが依存先に指定されています: {task.id} -> {dependency}")
+        resolved: set[str] = set()
+        remaining = list(self.tasks)
+        while len(remaining) > 0:
+            ready = [task for task in remaining if all(dependency in resolved for dependency in task.depends_on)]
+            if len(ready) == 0:
+                raise ValueError("タスクの依存関係が循環しています: " + ", ".join([task.id for task in remaining]))
+            resolved.update([task.id for task in ready])
+            remaining = [task for task in remaining if task.id not in resolved]
+
+def parse_task_graph(content: str) -> TaskGraph:
+    # コードブロックなどで囲まれている場合も、最初の{から最後の}までをJSONとして読み込む
+    match = re.search(r"\{.*\}", content, re.DOTALL)
+    if match is None:
+        raise ValueError(f"タスクグラフのJSONが見つかりません: {content}")
+    return TaskGraph.model_validate(json.loads(match.group(0)))
+
+@dataclass
+class TaskOutcome:
+    task: GraphTask
+    output_text: str
+    # タスクの実行時間(秒)
+    elapsed: float
+    error: Union[str, None] = None
+
+class TaskGraphScheduler:
+    """
+    Executes a TaskGraph against worker agents.
+    Tasks whose dependencies are done run concurrently (at most max_concurrency at a time),
+    and each task receives only the outputs of its own dependencies.
+    """
+    def __init__(self, agents: Sequence[ChatAgent], max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        self.agents = {agent.name: agent for agent in agents}
+        self.max_concurrency = max_concurrency
+
+    def create_task_input(self, task: GraphTask, outcomes: dict[str, TaskOutcome]) -> str:
+        if len(task.depends_on) == 0:
+            return task.input
+        dependency_texts = []
+        for dependency in task.depends_on:
+            outcome = outcomes[dependency]
+            text = outcome.output_text if outcome.error is None else f"(失敗: {outcome.error})"
+            dependency_texts.append(f"[{dependency}] {text}")
+        return task.input + "\n\n以下は前提となるタスクの結果です。\n" + "\n".join(dependency_texts)
+
+    async def _run_task(
+            self, task: GraphTask, task_input: str, semaphore: asyncio.Semaphore, agent_lock: asyncio.Lock) -> TaskOutcome:
+        agent = self.agents[task.agent_name]
+        # 同じエージェントのタスクは同時に実行しない
+        async with agent_lock, semaphore:
+            start = time.perf_counter()
+            try:
+                result = await agent.run(task=task_input)
+                output_text = result.messages[-1].to_text() if len(result.messages) > 0 else ""
+                return TaskOutcome(task, output_text, time.perf_counter() - start)
+            except Exception as e:
+                return TaskOutcome(task, "", time.perf_counter() - start, str(e))
+
+    async def run(self, graph: TaskGraph) -> AsyncGenerator[TaskOutcome, None]:
+        # タスクが完了した順に結果を返す
+        graph.validate_graph(list(self.agents.keys()))
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        agent_locks = {name: asyncio.Lock() for name in self.agents}
+        pending = {task.id: task for task in graph.tasks}
+        outcomes: dict[str, TaskOutcome] = {}
+        running: dict[asyncio.Task[TaskOutcome], GraphTask] = {}
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                ready = [task for task in pending.values() if all(dependency in outcomes for dependency in task.depends_on)]
+                for task in ready:
+                    del pending[task.id]
+                    task_input = self.create_task_input(task, outcomes)
+                    running[asyncio.create_task(
+                        self._run_task(task, task_input, semaphore, agent_locks[task.agent_name]))] = task
+                done, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    outcome = future.result()
+                    outcomes[task.id] = outcome
+                    yield outcome
+        finally:
+            for future in running.keys():
+                future.cancel()
+
+def create_graph_planner(model_client: ChatCompletionClient, worker_agents: Sequence[ChatAgent]) -> AssistantAgent:
+    agents_description = "\n".join([f"        {agent.name}: {agent.description}" for agent in worker_agents])
+    json_format_sample = json.dumps(
+        {"tasks": [{"id": "t1", "agent_name": "エージェント名", "input": "エージェントへの入力", "depends_on": []}]},
+        ensure_ascii=False)
+    return create_agent(
+        name="planner",
+        description="ユーザーの要求を達成するためのタスクグラフを作成し、タスクの結果をまとめるエージェント",
+        system_message=f"""
+        ユーザーの要求を達成するための計画を考えて、作業用エージェントに割り当てるタスクグラフを作成します。
+        - 作業用エージェントは以下の通りです。
+{agents_description}
+        - 出力はJSONのみとし、次の形式としてください。
+        {json_format_sample}
+        - 互いに依存しないタスクはdepends_onを空にしてください。他のタスクの結果が必要な場合のみ、そのタスクのidをdepends_onに指定してください。
+        - タスクの実行結果が渡されたら、結果をまとめてユーザーへの回答を作成し、最後に[TERMINATE]と返信してください。
+        """,
+        model_client=model_client,
+    )
+
+class TaskGraphRunner:
+    """
+    Runs a task with a planner that emits a TaskGraph and a TaskGraphScheduler.
+    The planner is called twice (task graph and final synthesis); worker agents are called once per task.
+    run_stream() yields messages in the same way as the teams, so it can be used in place of SelectorGroupChat.
+    """
+    def __init__(
+            self, planner: AssistantAgent, worker_agents: Sequence[ChatAgent],
+            max_concurrency: int = DEFAULT_MAX_CONCURRENCY, termination_text: str = "[TERMINATE]"):
+        self.planner = planner
+        self.worker_agents = list(worker_agents)
+        self.scheduler = TaskGraphScheduler(self.worker_agents, max_concurrency)
+        self.termination_text = termination_text
+
+    async def _run_planner_stream(self, task: str) -> AsyncGenerator[ModelClientStreamingChunkEvent | TaskResult, None]:
+        # plannerのストリーミングのチャンクを返し、最後にTaskResultを返す
+        async for message in self.planner.run_stream(task=task):
+            if isinstance(message, (ModelClientStreamingChunkEvent, TaskResult)):
+                yield message
+
+    async def run_stream(self, task: str) -> AsyncGenerator[BaseAgentEvent | BaseChatMessage | TaskResult, None]:
+        messages: list[BaseAgentEvent | BaseChatMessage] = []
+        user_message = TextMessage(source="user", content=task)
+        messages.append(user_message)
+        yield user_message
+
+        # plannerがタスクグラフを作成
+        async for planner_result in self._run_planner_stream(task):
+            if not isinstance(planner_result, TaskResult):
+                yield planner_result
+        graph_message = planner_result.messages[-1]
+        messages.append(graph_message)
+        yield graph_message
+        try:
+            graph = parse_task_graph(graph_message.to_text())
+            graph.validate_graph([agent.name for agent in self.worker_agents])
+        except Exception as e:
+            yield TaskResult(messages=messages, stop_reason=f"タスクグラフの作成に失敗しました: {e}")
+            return
+
+        # タスクグラフに従って作業用エージェントを実行
+        outcomes: list[TaskOutcome] = []
+        async for outcome in self.scheduler.run(graph):
+            outcomes.append(outcome)
+            content = outcome.output_text if outcome.error is None else f"(失敗: {outcome.error})"
+            message = TextMessage(source=outcome.task.agent_name, content=content)
+            messages.append(message)
+            yield message
+
+        # plannerが結果をまとめる
+        results_text = "\n".join([
+            f"[{outcome.task.id}] {outcome.task.agent_name}: {outcome.output_text if outcome.error is None else '(失敗: ' + outcome.error + ')'}"
+            for outcome in sorted(outcomes, key=lambda outcome: graph.tasks.index(outcome.task))])
+        async for synthesis_result in self._run_planner_stream(f"以下はタスクの実行結果です。結果をまとめて回答してください。\n{results_text}"):
+            if not isinstance(synthesis_result, TaskResult):
+                yield synthesis_result
+        final_message = synthesis_result.messages[-1]
+        messages.append(final_message)
+        yield final_message
+
+        stop_reason = f"Text '{self.termination_text}' mentioned" if self.termination_text in final_message.to_text() else "Task graph completed"
+        yield TaskResult(messages=messages, stop_reason=stop_reason)
+
+    async def run(self, task: str) -> TaskResult:
+        result = None
+        async for message in self.run_stream(task):
+            if isinstance(message, TaskResult):
+                result = message
+        assert result is not None
+        return result
+
+    async def reset(self):
+        await self.planner.on_reset(CancellationToken())
+        for agent in self.worker_agents:
+            await agent.on_reset(CancellationToken())
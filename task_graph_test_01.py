@@ -0,0 +1,45 @@
+import os, sys, asyncio
+from typing import Union
+# autogen
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import BaseChatMessage
+
+from selector_group_chat_test_00 import create_model_client, init_trace, workflow, run_team
+from selector_group_chat_test_00 import worker_registry
+from rate_limiter import PRIORITY_PLANNER
+from agent_registry import AgentRegistry
+from task_graph import TaskGraphRunner, create_graph_planner
+
+
+def create_chat(registry: Union[AgentRegistry, None] = None) -> TaskGraphRunner:
+    # registryが指定されていない場合は、selector_group_chat_test_00.pyの共有のエージェントを使用
+    registry = registry if registry is not None else worker_registry
+    # モデルクライアントを作成
+    model_client = create_model_client(priority=PRIORITY_PLANNER, role="planner")
+
+    # タスクグラフを作成するplannerエージェント
+    worker_agents = registry.agents()
+    planner = create_graph_planner(model_client, worker_agents)
+
+    # plannerが作成したタスクグラフを、依存関係に従って作業用エージェントで並列に実行する
+    chat = TaskGraphRunner(planner, worker_agents)
+    return chat
+
+@workflow(name=__file__)
+async def main(input_message: str):
+    chat = create_chat()
+
+    # タスクグラフを実行
+    await run_team(chat, input_message, __file__)
+
+if __name__ == '__main__':
+    input_message: str = """
+    宇宙について、以下の観点で情報をまとめてください
+    * 宇宙の成り立ち
+    * 哲学的な視点からの宇宙
+    * 宇宙に関するアニメ
+    """
+    # traceloopによるトレース処理初期化
+    init_trace()
+    # メイン処理を実行
+    asyncio.run(main(input_message))
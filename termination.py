@@ -0,0 +1,306 @@
+import os, json
+from typing import Any, Mapping, Sequence, Union
+from pydantic import BaseModel
+from typing_extensions import Self
+# autogen
+from autogen_core import Component
+from autogen_core.models import AssistantMessage
+from autogen_agentchat.base import TerminatedException, TerminationCondition
+from autogen_agentchat.messages import (
+    BaseAgentEvent, BaseChatMessage, HandoffMessage, StopMessage, ToolCallExecutionEvent, ToolCallRequestEvent)
+
+from selection_engine import mentioned_agents
+from model_tiers import MODEL_PRICES, estimate_model_cost
+
+# 無駄なターンを打ち切るための終了条件(コストの上限、進展のない会話、計画した全タスクの完了)
+# トークン数の上限にはautogenのTokenUsageTerminationを使用する
+# いずれもチームのメッセージのmodels_usageと内容で判定するため、execute_agentから呼び出されたエージェントのトークン数は含まない
+
+class CostTerminationConfig(BaseModel):
+    max_cost: float
+    model: str
+    source_models: dict[str, str] = {}
+
+class CostTermination(TerminationCondition, Component[CostTerminationConfig]):
+    """
+    Terminate the conversation when the estimated cost (USD) of the team's model calls reaches max_cost.
+    The cost is computed from models_usage of the messages with the model_tiers.MODEL_PRICES of the model of the message's
+    source (source_models, e.g. the per-role models of model_tiers.py), or of model for the other sources.
+    """
+    component_config_schema = CostTerminationConfig
+
+    def __init__(self, max_cost: float, model: str = "gpt-4o-mini", source_models: Union[Mapping[str, str], None] = None):
+        source_models = dict(source_models) if source_models is not None else {}
+        for name in [model, *source_models.values()]:
+            if name not in MODEL_PRICES:
+                raise ValueError(f"Unknown model for cost estimation: {name}")
+        self._max_cost = max_cost
+        self._model = model
+        self._source_models = source_models
+        self._cost = 0.0
+
+    @property
+    def cost(self) -> float:
+        return self._cost
+
+    @property
+    def terminated(self) -> bool:
+        return self._cost >= self._max_cost
+
+    async def __call__(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> StopMessage | None:
+        if self.terminated:
+            raise TerminatedException("Termination condition has already been reached")
+        for message in messages:
+            if message.models_usage is not None:
+                model = self._source_models.get(message.source, self._model)
+                self._cost += estimate_model_cost(model, message.models_usage.prompt_tokens, message.models_usage.completion_tokens)
+        if self.terminated:
+            return StopMessage(content=f"Cost limit reached, estimated cost: ${self._cost:.4f}.", source="CostTermination")
+        return None
+
+    async def reset(self) -> None:
+        self._cost = 0.0
+
+    def _to_config(self) -> CostTerminationConfig:
+        return CostTerminationConfig(max_cost=self._max_cost, model=self._model, source_models=self._source_models)
+
+    @classmethod
+    def _from_config(cls, config: CostTerminationConfig) -> Self:
+        return cls(max_cost=config.max_cost, model=config.model, source_models=config.source_models)
+
+def _shingles(text: str, size: int = 3) -> set[str]:
+    text = "".join(text.split())
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def text_similarity(a: str, b: str) -> float:
+    # 文字3-gramのJaccard係数。日本語は単語に分割せずに比較できる
+    shingles_a, shingles_b = _shingles(a), _shingles(b)
+    union = len(shingles_a | shingles_b)
+    return len(shingles_a & shingles_b) / union if union > 0 else 1.0
+
+class NoProgressTerminationConfig(BaseModel):
+    max_consecutive: int
+    similarity_threshold: float
+    window: int
+
+class NoProgressTermination(TerminationCondition, Component[NoProgressTerminationConfig]):
+    """
+    Terminate the conversation when it stops making progress:
+    - the same speaker sends max_consecutive chat messages in a row (a handoff ends the speaker's run), or
+    - a speaker repeats one of its last window messages with text_similarity >= similarity_threshold
+      (e.g. the planner confirming the same assignment again).
+    """
+    component_config_schema = NoProgressTerminationConfig
+
+    def __init__(self, max_consecutive: int = 4, similarity_threshold: float = 0.9, window: int = 4):
+        self._max_consecutive = max_consecutive
+        self._similarity_threshold = similarity_threshold
+        self._window = window
+        self._terminated = False
+        self._last_source: Union[str, None] = None
+        self._consecutive = 0
+        # 発言者ごとの直近の発言
+        self._recent: dict[str, list[str]] = {}
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    def _check(self, message: BaseChatMessage) -> Union[str, None]:
+        if message.source != self._last_source:
+            self._last_source = message.source
+            self._consecutive = 0
+        if isinstance(message, HandoffMessage):
+            # Swarmの引き継ぎは発言者の交代として扱い、発言の回数と内容の比較には含めない
+            return None
+        self._consecutive += 1
+        if self._consecutive >= self._max_consecutive:
+            return f"No progress: {message.source} spoke {self._consecutive} times in a row."
+        text = message.to_text()
+        recent = self._recent.setdefault(message.source, [])
+        for previous in recent:
+            similarity = text_similarity(text, previous)
+            if similarity >= self._similarity_threshold:
+                return f"No progress: {message.source} repeated a previous message (similarity {similarity:.2f})."
+        recent.append(text)
+        del recent[:-self._window]
+        return None
+
+    async def __call__(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> StopMessage | None:
+        if self._terminated:
+            raise TerminatedException("Termination condition has already been reached")
+        for message in messages:
+            if not isinstance(message, BaseChatMessage) or message.source == "user":
+                continue
+            reason = self._check(message)
+            if reason is not None:
+                self._terminated = True
+                return StopMessage(content=reason, source="NoProgressTermination")
+        return None
+
+    async def reset(self) -> None:
+        self._terminated = False
+        self._last_source = None
+        self._consecutive = 0
+        self._recent.clear()
+
+    def _to_config(self) -> NoProgressTerminationConfig:
+        return NoProgressTerminationConfig(
+            max_consecutive=self._max_consecutive, similarity_threshold=self._similarity_threshold, window=self._window)
+
+    @classmethod
+    def _from_config(cls, config: NoProgressTerminationConfig) -> Self:
+        return cls(max_consecutive=config.max_consecutive, similarity_threshold=config.similarity_threshold, window=config.window)
+
+def handoff_text(message: HandoffMessage) -> str:
+    # 引き継ぎと同時に返したテキスト(context中のAssistantMessageの内容とthought)
+    # HandoffMessageのcontent自体は引き継ぎツールの固定のメッセージのため含めない
+    texts = []
+    for context_message in message.context:
+        if isinstance(context_message, AssistantMessage):
+            if isinstance(context_message.content, str):
+                texts.append(context_message.content)
+            if context_message.thought is not None:
+                texts.append(context_message.thought)
+    return "\n".join(texts)
+
+# plannerが計画作成の完了時に返信するテキスト(各スクリプトのplannerのsystem_message)
+PLAN_COMPLETE_MARKER = "[計画作成完了]"
+
+def _tool_call_agents(arguments: str) -> list[str]:
+    # execute_agent({"agent_name": ...})、execute_agents({"tasks": [{"agent_name": ...}, ...]})の呼び出し先
+    try:
+        data: Any = json.loads(arguments)
+    except json.JSONDecodeError:
+        return []
+    if not isinstance(data, dict):
+        return []
+    tasks = data.get("tasks", [data])
+    return [task["agent_name"] for task in tasks if isinstance(task, dict) and isinstance(task.get("agent_name"), str)]
+
+class TaskCompletionTerminationConfig(BaseModel):
+    worker_names: list[str]
+    planner_name: str
+    allow_final_message: bool
+    plan_marker: Union[str, None]
+
+class TaskCompletionTermination(TerminationCondition, Component[TaskCompletionTerminationConfig]):
+    """
+    Terminate the conversation once every task of the planner's plan has an answer.
+    The plan is the set of worker agents mentioned by the planner. Answers are counted only after the planner
+    finished planning (a planner message containing plan_marker, or its first message mentioning a worker if
+    plan_marker is None), so replies to the planner's confirmation of the assignments are not answers.
+    A task is then answered when the worker sends a non-empty message (a handoff only if it carries text,
+    see handoff_text), or when an execute_agent/execute_agents call for the worker succeeds.
+    With allow_final_message, the planner may send one more message (its summary) before the conversation stops,
+    so only the turns after it (further confirmations) are cut.
+    """
+    component_config_schema = TaskCompletionTerminationConfig
+
+    def __init__(
+            self, worker_names: Sequence[str], planner_name: str = "planner", allow_final_message: bool = True,
+            plan_marker: Union[str, None] = PLAN_COMPLETE_MARKER):
+        self._worker_names = list(worker_names)
+        self._planner_name = planner_name
+        self._allow_final_message = allow_final_message
+        self._plan_marker = plan_marker
+        self._terminated = False
+        # plannerの計画作成が完了したか。完了前の作業用エージェントの発言は割り当ての確認への返答として扱う
+        self._plan_complete = False
+        self._planned: list[str] = []
+        self._answered: set[str] = set()
+        # ツール呼び出しのid: 呼び出し先のエージェント
+        self._tool_calls: dict[str, list[str]] = {}
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    @property
+    def completed(self) -> bool:
+        return len(self._planned) > 0 and all(name in self._answered for name in self._planned)
+
+    def _observe(self, message: BaseAgentEvent | BaseChatMessage):
+        if isinstance(message, ToolCallRequestEvent):
+            for call in message.content:
+                self._tool_calls[call.id] = _tool_call_agents(call.arguments)
+        elif isinstance(message, ToolCallExecutionEvent):
+            for result in message.content:
+                agents = self._tool_calls.pop(result.call_id, [])
+                if not result.is_error and self._plan_complete:
+                    self._answered.update(agents)
+        elif isinstance(message, BaseChatMessage):
+            if message.source in self._worker_names:
+                # テキストなしで引き継いだ場合(transfer_to_plannerのみの呼び出し)は回答に含めない
+                text = handoff_text(message) if isinstance(message, HandoffMessage) else message.to_text()
+                if self._plan_complete and text.strip() != "":
+                    self._answered.add(message.source)
+            elif message.source == self._planner_name:
+                # 最初に作業用エージェントに言及した発言が計画。その後の発言で新たに言及されたエージェントは計画に追加する
+                text = message.to_text()
+                mentioned = mentioned_agents(text, self._worker_names)
+                for name in mentioned:
+                    if name not in self._planned:
+                        self._planned.append(name)
+                if self._plan_marker is not None:
+                    self._plan_complete = self._plan_complete or self._plan_marker in text
+                else:
+                    self._plan_complete = self._plan_complete or len(mentioned) > 0
+
+    async def __call__(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> StopMessage | None:
+        if self._terminated:
+            raise TerminatedException("Termination condition has already been reached")
+        for message in messages:
+            completed_before = self.completed
+            self._observe(message)
+            if not self.completed:
+                continue
+            if not self._allow_final_message or (
+                    completed_before and isinstance(message, BaseChatMessage) and message.source == self._planner_name):
+                self._terminated = True
+                return StopMessage(
+                    content=f"All planned tasks have answers: {', '.join(self._planned)}.", source="TaskCompletionTermination")
+        return None
+
+    async def reset(self) -> None:
+        self._terminated = False
+        self._plan_complete = False
+        self._planned = []
+        self._answered.clear()
+        self._tool_calls.clear()
+
+    def _to_config(self) -> TaskCompletionTerminationConfig:
+        return TaskCompletionTerminationConfig(
+            worker_names=self._worker_names, planner_name=self._planner_name, allow_final_message=self._allow_final_message,
+            plan_marker=self._plan_marker)
+
+    @classmethod
+    def _from_config(cls, config: TaskCompletionTerminationConfig) -> Self:
+        return cls(config.worker_names, config.planner_name, config.allow_final_message, config.plan_marker)
+
+def _env_float(name: str) -> Union[float, None]:
+    value = os.getenv(name)
+    return float(value) if value is not None and value != "" else None
+
+def get_token_budget() -> Union[int, None]:
+    # 環境変数TERMINATION_MAX_TOKENS: 1回の実行のトークン数(入力+出力)の上限
+    value = _env_float("TERMINATION_MAX_TOKENS")
+    return int(value) if value is not None else None
+
+def get_cost_budget() -> Union[float, None]:
+    # 環境変数TERMINATION_MAX_COST: 1回の実行の推定コスト(USD)の上限
+    return _env_float("TERMINATION_MAX_COST")
+
+def is_no_progress_check_enabled() -> bool:
+    # 環境変数TERMINATION_NO_PROGRESSが設定されている場合に、進展のない会話を打ち切る
+    return os.getenv("TERMINATION_NO_PROGRESS", "") not in ("", "0", "false")
+
+def is_task_completion_check_enabled() -> bool:
+    # 環境変数TERMINATION_TASK_COMPLETIONが設定されている場合に、計画した全タスクの完了で終了する
+    return os.getenv("TERMINATION_TASK_COMPLETION", "") not in ("", "0", "false")
+
+def is_completed(stop_reason: Union[str, None]) -> bool:
+    # TextMentionTermination(終了メッセージ)またはTaskCompletionTermination(全タスクの完了)で終了した場合
+    return stop_reason is not None and ("mentioned" in stop_reason or "All planned tasks have answers" in stop_reason)
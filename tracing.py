@@ -0,0 +1,188 @@
+import os, sys, argparse, json, threading
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Any, Iterator, Sequence, Union
+# opentelemetry
+from opentelemetry import trace
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.sampling import ParentBased, Sampler, TraceIdRatioBased
+
+from stats_utils import percentile, print_table
+
+# トレースの設定と、ネットワークを使用せずにスパンを収集してエージェント、処理ごとの時間を集計するローカルのスパン収集
+# スパンはBatchSpanProcessorで別スレッドからまとめて出力する。キューの上限(OTEL_BSP_MAX_QUEUE_SIZE、既定値2048)を
+# 超えたスパンは、呼び出し元を待たせずに破棄する。出力間隔はOTEL_BSP_SCHEDULE_DELAY、1回の件数はOTEL_BSP_MAX_EXPORT_BATCH_SIZE
+
+def get_trace_mode() -> str:
+    """
+    Return the tracing mode from TRACE_MODE: "traceloop", "local" or "off".
+    The default is "traceloop" when TRACELOOP_API_KEY is set, otherwise "off".
+    """
+    mode = os.getenv("TRACE_MODE")
+    if mode is None or mode == "":
+        return "traceloop" if os.getenv("TRACELOOP_API_KEY") is not None else "off"
+    return mode
+
+def create_sampler(sample_rate: Union[float, None] = None) -> Sampler:
+    # ヘッドサンプリング。sample_rateがNoneの場合は環境変数TRACE_SAMPLE_RATE(既定値1.0)
+    # 子スパンは親スパンのサンプリング結果に従うため、1回の実行のスパンは全て記録されるか全て記録されない
+    if sample_rate is None:
+        sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+    return ParentBased(TraceIdRatioBased(sample_rate))
+
+@dataclass
+class SpanRecord:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Union[str, None]
+    # 開始、終了時刻(秒)
+    start: float
+    end: float
+    agent: Union[str, None] = None
+    tool: Union[str, None] = None
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+def to_span_record(span: ReadableSpan) -> SpanRecord:
+    attributes = span.attributes or {}
+    return SpanRecord(
+        name=span.name,
+        trace_id=format(span.context.trace_id, "032x"), # type: ignore
+        span_id=format(span.context.span_id, "016x"), # type: ignore
+        parent_id=format(span.parent.span_id, "016x") if span.parent is not None else None,
+        start=(span.start_time or 0) / 1e9,
+        end=(span.end_time or 0) / 1e9,
+        agent=attributes.get("gen_ai.agent.name"), # type: ignore
+        tool=attributes.get("gen_ai.tool.name"), # type: ignore
+    )
+
+class SpanCollector(SpanExporter):
+    """
+    SpanExporter that keeps the latest max_spans spans in memory and optionally appends them to a JSONL file.
+    It is called from the BatchSpanProcessor worker thread, so writing the file does not block the traced code.
+    """
+    def __init__(self, path: Union[str, None] = None, max_spans: int = 100000):
+        self.path = path
+        self._records: deque[SpanRecord] = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8") if path is not None else None
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        records = [to_span_record(span) for span in spans]
+        with self._lock:
+            self._records.extend(records)
+            if self._file is not None:
+                self._file.write("".join([json.dumps(asdict(record), ensure_ascii=False) + "\n" for record in records]))
+                self._file.flush()
+        return SpanExportResult.SUCCESS
+
+    def records(self) -> list[SpanRecord]:
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+def load_span_records(path: str) -> list[SpanRecord]:
+    with open(path, encoding="utf-8") as f:
+        return [SpanRecord(**json.loads(line)) for line in f if line.strip() != ""]
+
+# init_local_tracing()で作成したTracerProviderと収集先
+_provider: Union[TracerProvider, None] = None
+_collector: Union[SpanCollector, None] = None
+
+def init_local_tracing(path: Union[str, None] = None, sample_rate: Union[float, None] = None) -> SpanCollector:
+    """
+    Install a TracerProvider that sends sampled spans through a BatchSpanProcessor to a SpanCollector.
+    path defaults to TRACE_FILE (no file when unset). Works without a Traceloop API key or network access.
+    """
+    global _provider, _collector
+    if _collector is not None:
+        return _collector
+    _collector = SpanCollector(path if path is not None else os.getenv("TRACE_FILE"))
+    _provider = TracerProvider(sampler=create_sampler(sample_rate))
+    _provider.add_span_processor(BatchSpanProcessor(_collector))
+    trace.set_tracer_provider(_provider)
+    return _collector
+
+def get_span_collector() -> Union[SpanCollector, None]:
+    return _collector
+
+def flush_spans():
+    # キューに残っているスパンを出力する
+    if _provider is not None:
+        _provider.force_flush()
+
+@contextmanager
+def workflow_span(name: str) -> Iterator[None]:
+    # ローカルのトレースで、mainなどの処理全体を1つのスパンにする
+    with trace.get_tracer("workflow").start_as_current_span(f"workflow {name}"):
+        yield
+
+def _step_name(record: SpanRecord) -> str:
+    # "invoke_agent planner"、"execute_tool execute_agent"、"autogen process ..."のように、
+    # 先頭の語(autogenのランタイムのスパンは2語)を処理の種類とする
+    words = record.name.split(" ")
+    return " ".join(words[:2]) if words[0] == "autogen" else words[0]
+
+def latency_breakdown(records: Sequence[SpanRecord]) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+    """
+    Return (per-agent rows from invoke_agent spans, per-step rows from all spans).
+    self_seconds excludes the time of child spans, so an agent's self time is mostly its model calls
+    while tool execution (including nested agents) is counted under the tool step.
+    """
+    children: dict[str, float] = {}
+    for record in records:
+        if record.parent_id is not None:
+            children[record.parent_id] = children.get(record.parent_id, 0.0) + record.duration
+
+    def self_time(record: SpanRecord) -> float:
+        return max(0.0, record.duration - children.get(record.span_id, 0.0))
+
+    def rows(groups: dict[str, list[SpanRecord]], key: str) -> list[dict[str, Any]]:
+        result = []
+        for name, group in groups.items():
+            durations = [record.duration for record in group]
+            result.append({
+                key: name,
+                "spans": len(group),
+                "total_seconds": sum(durations),
+                "self_seconds": sum([self_time(record) for record in group]),
+                "p50": percentile(durations, 50),
+                "p99": percentile(durations, 99),
+            })
+        return sorted(result, key=lambda row: row["self_seconds"], reverse=True)
+
+    agents: dict[str, list[SpanRecord]] = {}
+    steps: dict[str, list[SpanRecord]] = {}
+    for record in records:
+        if record.agent is not None and record.name.startswith("invoke_agent"):
+            agents.setdefault(record.agent, []).append(record)
+        steps.setdefault(_step_name(record), []).append(record)
+    return rows(agents, "agent"), rows(steps, "step")
+
+def print_latency_breakdown(records: Sequence[SpanRecord], file: Any = sys.stdout):
+    agent_rows, step_rows = latency_breakdown(records)
+    if len(agent_rows) > 0:
+        print_table(agent_rows, list(agent_rows[0].keys()), file=file)
+        print(file=file)
+    if len(step_rows) > 0:
+        print_table(step_rows, list(step_rows[0].keys()), file=file)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="TRACE_MODE=localで出力したスパンのファイルから、エージェント、処理ごとの時間を集計する")
+    parser.add_argument("path", help="スパンのJSONLファイル(TRACE_FILE)")
+    args = parser.parse_args()
+    print_latency_breakdown(load_span_records(args.path))